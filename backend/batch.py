@@ -0,0 +1,243 @@
+"""
+PharmaGuard Batch Cohort Analysis
+=================================
+Parses and risk-scores many VCFs across a process pool and streams one
+NDJSON line per file (per sample for multi-sample VCFs). Each file is
+isolated: a malformed VCF yields an ``error`` line instead of aborting
+the run.
+
+CLI, run from backend/ like the server (files, .zip archives and
+directories are all accepted):
+
+    python batch.py cohort/ extra.vcf.gz more.zip --drugs all --workers 8
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from knowledge_base import DRUG_GENE_MAP, CompiledKnowledgeBase
+from risk_engine import RiskEngine
+from vcf_parser import VCFParser, TargetFilter
+
+VCF_SUFFIXES = (".vcf", ".vcf.gz", ".vcf.bgz")
+
+# A job source is raw bytes, a file path, or a (zip path, member name) pair
+Source = Union[bytes, str, Tuple[str, str]]
+
+# Per-process state, built once by the pool initializer
+_engine: Optional[RiskEngine] = None
+_targets: Optional[TargetFilter] = None
+
+
+def _init_worker(kb_path: Optional[str] = None) -> None:
+    """Build the per-process engine, from ``kb_path`` if given (e.g. after a reload)."""
+    global _engine, _targets
+    kb = CompiledKnowledgeBase.from_file(kb_path) if kb_path else None
+    _engine = RiskEngine(kb=kb)
+    _targets = TargetFilter.pharmacogenes(kb, _engine.gene_index)
+
+
+def _read_source(source: Union[bytes, Tuple[str, str]]) -> bytes:
+    """Bytes of an in-memory or zipped source (paths are memory-mapped instead)."""
+    if isinstance(source, bytes):
+        return source
+    archive, member = source
+    with zipfile.ZipFile(archive) as zf:
+        return zf.read(member)
+
+
+def patient_id_for(name: str) -> str:
+    """'cohort/P0042.vcf.gz' or 'cohort.zip:P0042.vcf' → 'P0042'."""
+    base = os.path.basename(name).rsplit(":", 1)[-1]
+    for suffix in VCF_SUFFIXES:
+        if base.lower().endswith(suffix):
+            return base[:-len(suffix)]
+    return base
+
+
+def analyze_file(name: str, source: Source, drugs: List[str]) -> List[Dict]:
+    """
+    Score one VCF for every drug in ``drugs``. Runs inside a worker process.
+    Multi-sample VCFs are scored column-wise and give one record per sample.
+    Never raises: failures come back as a single {"file", "error"} record.
+    """
+    if _engine is None:
+        _init_worker()
+    try:
+        if isinstance(source, str):
+            with VCFParser.from_path(source, targets=_targets) as parser:
+                matrix = parser.parse_genotype_matrix()
+        else:
+            parser = VCFParser(_read_source(source), targets=_targets)
+            matrix = parser.parse_genotype_matrix()
+        if not parser.validate():
+            raise ValueError("Missing ##fileformat=VCFv4.2 header")
+        if len(matrix.samples) > 1:
+            return _matrix_records(name, matrix, drugs)
+
+        by_gene = _engine.group_variants_by_gene(matrix.variants)
+        # Each gene is called once for the file, however many drugs use it
+        gene_calls = _engine.call_genes(by_gene, _engine.genes_for_drugs(drugs))
+        results = []
+        for drug in drugs:
+            p = _engine.predict_risk(drug, [], gene_calls=gene_calls)
+            results.append({
+                "drug": drug,
+                "gene": p["gene"],
+                "diplotype": f"{p['allele1']}/{p['allele2']}",
+                "phenotype": p["phenotype"],
+                "activity_score": p["activity_score"],
+                "risk_label": p["risk"],
+                "severity": p["severity"],
+                "confidence_score": p["confidence"],
+                "variant_rsids": [v.rsid for v in p["gene_variants"]],
+                "secondary_genes": [
+                    {"gene": c.gene, "diplotype": f"{c.allele1}/{c.allele2}", "phenotype": c.phenotype}
+                    for c in p["gene_calls"][1:]
+                ],
+            })
+        return [{"file": name, "patient_id": patient_id_for(name), "results": results}]
+    except Exception as e:
+        return [{"file": name, "patient_id": patient_id_for(name), "error": f"{type(e).__name__}: {e}"}]
+
+
+def _matrix_records(name: str, matrix, drugs: List[str]) -> List[Dict]:
+    """Per-sample records from the vectorized cohort engine."""
+    cohort = _engine.predict_risk_matrix(drugs, matrix)
+    rsids = [v.rsid for v in matrix.variants]
+    columns = []
+    for drug in drugs:
+        c = cohort[drug]
+        columns.append((drug, c, [rsids[i] for i in c["rows"]]))
+
+    records = []
+    for s, sample in enumerate(matrix.samples):
+        results = []
+        for drug, c, gene_rsids in columns:
+            carried = c["carried"][:, s]
+            results.append({
+                "drug": drug,
+                "gene": c["gene"],
+                "diplotype": f"{c['allele1'][s]}/{c['allele2'][s]}",
+                "phenotype": c["phenotype"][s],
+                "activity_score": float(c["activity_score"][s]),
+                "risk_label": c["risk"][s],
+                "severity": c["severity"][s],
+                "confidence_score": float(c["confidence"][s]),
+                "variant_rsids": [r for r, hit in zip(gene_rsids, carried) if hit],
+                "secondary_genes": [
+                    {"gene": g["gene"], "diplotype": f"{g['allele1'][s]}/{g['allele2'][s]}",
+                     "phenotype": g["phenotype"][s]}
+                    for g in c["gene_calls"][1:]
+                ],
+            })
+        records.append({"file": name, "patient_id": sample, "results": results})
+    return records
+
+
+def resolve_drugs(drugs: str, drug_gene_map: Optional[Dict[str, str]] = None) -> List[str]:
+    """'all' or a comma-separated list → validated upper-case drug names."""
+    drug_gene_map = DRUG_GENE_MAP if drug_gene_map is None else drug_gene_map
+    if drugs.strip().lower() == "all":
+        return list(drug_gene_map)
+    drug_list = list(dict.fromkeys(d.strip().upper() for d in drugs.split(",") if d.strip()))
+    unknown = [d for d in drug_list if d not in drug_gene_map]
+    if unknown or not drug_list:
+        raise ValueError(f"Unsupported drugs {unknown}. Supported drugs: {list(drug_gene_map)}")
+    return drug_list
+
+
+def iter_zip_members(archive: str) -> Iterator[Tuple[str, Tuple[str, str]]]:
+    with zipfile.ZipFile(archive) as zf:
+        for member in zf.namelist():
+            if member.lower().endswith(VCF_SUFFIXES):
+                yield f"{archive}:{member}", (archive, member)
+
+
+def iter_zip_bytes(name: str, data: bytes,
+                   max_bytes: Optional[int] = None) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """
+    VCF members of an in-memory zip (e.g. an uploaded archive). A member
+    that inflates past ``max_bytes`` is yielded with None instead of its data.
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        for member in zf.namelist():
+            if not member.lower().endswith(VCF_SUFFIXES):
+                continue
+            if max_bytes is None:
+                yield f"{name}:{member}", zf.read(member)
+                continue
+            # Read one byte past the cap rather than trusting the declared size
+            with zf.open(member) as fh:
+                content = fh.read(max_bytes + 1)
+            yield f"{name}:{member}", content if len(content) <= max_bytes else None
+
+
+def collect_jobs(paths: Iterable[str]) -> Iterator[Tuple[str, Source]]:
+    """Expand files, .zip archives and directories into (name, source) jobs."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for fname in sorted(files):
+                    full = os.path.join(root, fname)
+                    if fname.lower().endswith(".zip"):
+                        yield from iter_zip_members(full)
+                    elif fname.lower().endswith(VCF_SUFFIXES):
+                        yield full, full
+        elif path.lower().endswith(".zip"):
+            yield from iter_zip_members(path)
+        else:
+            yield path, path
+
+
+def default_workers() -> int:
+    return int(os.getenv("PHARMAGUARD_BATCH_WORKERS", "0")) or (os.cpu_count() or 1)
+
+
+def make_pool(workers: Optional[int] = None, kb_path: Optional[str] = None) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers or default_workers(), initializer=_init_worker,
+                               initargs=(kb_path,))
+
+
+def run_batch(jobs: Iterable[Tuple[str, Source]], drugs: List[str],
+              workers: Optional[int] = None) -> Iterator[Dict]:
+    """Yield one record per single-sample file or per sample, in completion order."""
+    with make_pool(workers) as pool:
+        futures = [pool.submit(analyze_file, name, source, drugs) for name, source in jobs]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="PharmaGuard batch cohort screening (NDJSON output)")
+    ap.add_argument("paths", nargs="+", help="VCF files, .zip archives or directories")
+    ap.add_argument("--drugs", default="all", help='comma-separated drug list or "all"')
+    ap.add_argument("--workers", type=int, default=None, help="process count (default: CPU count)")
+    ap.add_argument("--output", default="-", help="NDJSON output file (default: stdout)")
+    args = ap.parse_args(argv)
+
+    try:
+        drugs = resolve_drugs(args.drugs)
+    except ValueError as e:
+        ap.error(str(e))
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    failed = 0
+    try:
+        for record in run_batch(collect_jobs(args.paths), drugs, args.workers):
+            failed += "error" in record
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""
+PharmaGuard BGZF / Tabix Support
+================================
+Pure-Python reader for BGZF-compressed VCFs (``.vcf.gz``) and their tabix
+(``.tbi``) or CSI (``.csi``) indexes, so the parser can seek straight to the
+pharmacogene windows instead of inflating a whole genome.
+
+A small BGZF writer and ``.tbi`` builder are included for tooling and tests
+on machines without htslib.
+"""
+import io
+import struct
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+GZIP_MAGIC = b'\x1f\x8b'
+BGZF_MAX_BLOCK_DATA = 0xff00
+BGZF_MAX_BLOCK_SIZE = 0x10000
+BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+
+INFLATE_PIECE_SIZE = 1 << 20
+# Uncompressed index sizes are a few MB even for whole genomes
+MAX_INDEX_BYTES = 256 << 20
+
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+
+
+class GzipInflater:
+    """
+    Streaming gzip decoder that handles multi-member files (BGZF is a series
+    of concatenated gzip members), fed one chunk at a time.
+
+    Output is produced in pieces of at most ``piece_size`` bytes, so a small
+    compressed chunk never inflates into one huge buffer, and ``max_output``
+    (if set) caps the total; past it a ValueError is raised.
+    """
+
+    def __init__(self, max_output: Optional[int] = None, piece_size: int = INFLATE_PIECE_SIZE):
+        self._d = zlib.decompressobj(31)
+        self.max_output = max_output
+        self.piece_size = piece_size
+        self.total_out = 0
+
+    def iter_decompress(self, data: bytes) -> Iterator[bytes]:
+        while True:
+            piece = self._d.decompress(data, self.piece_size)
+            data = self._d.unconsumed_tail
+            if piece:
+                self.total_out += len(piece)
+                if self.max_output is not None and self.total_out > self.max_output:
+                    raise ValueError(f"Decompressed data exceeds {self.max_output} bytes.")
+                yield piece
+            if self._d.eof:
+                data = self._d.unused_data
+                self._d = zlib.decompressobj(31)
+                if not data:
+                    return
+            elif not data and len(piece) < self.piece_size:
+                # Input consumed and no output held back by the piece limit
+                return
+
+    def decompress(self, data: bytes) -> bytes:
+        return b"".join(self.iter_decompress(data))
+
+
+class BGZFReader:
+    """Block-level BGZF reader addressed by htslib-style virtual offsets."""
+
+    def __init__(self, fileobj: BinaryIO):
+        self._fh = fileobj
+        self._block_start = 0
+        self._next_block = 0
+        self._data = b""
+        self._within = 0
+
+    def _load_block(self, coffset: int) -> bool:
+        self._fh.seek(coffset)
+        header = self._fh.read(12)
+        if len(header) < 12:
+            self._data, self._within = b"", 0
+            return False
+        if header[:4] != b'\x1f\x8b\x08\x04':
+            raise ValueError("Not a BGZF block (missing gzip FEXTRA header).")
+
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = self._fh.read(xlen)
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra):
+            slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+            if extra[i:i + 2] == b'BC' and slen == 2 and i + 6 <= len(extra):
+                bsize = struct.unpack('<H', extra[i + 4:i + 6])[0]
+            i += 4 + slen
+        if bsize is None:
+            raise ValueError("Not a BGZF block (missing BC subfield).")
+
+        rest = self._fh.read(bsize + 1 - 12 - xlen)
+        # A BGZF block holds at most 64 KB of data; refuse anything that inflates further
+        d = zlib.decompressobj(-15)
+        self._data = d.decompress(rest[:-8], BGZF_MAX_BLOCK_SIZE)
+        if d.unconsumed_tail:
+            raise ValueError("BGZF block inflates past 64 KB.")
+        self._within = 0
+        self._block_start = coffset
+        self._next_block = coffset + bsize + 1
+        return True
+
+    def seek(self, voffset: int) -> None:
+        self._load_block(voffset >> 16)
+        self._within = voffset & 0xffff
+
+    def tell(self) -> int:
+        if self._data and self._within >= len(self._data):
+            return self._next_block << 16
+        return (self._block_start << 16) | self._within
+
+    def readline(self) -> bytes:
+        parts = []
+        while True:
+            if self._within >= len(self._data):
+                if not self._load_block(self._next_block):
+                    break
+                continue
+            nl = self._data.find(b'\n', self._within)
+            if nl == -1:
+                parts.append(self._data[self._within:])
+                self._within = len(self._data)
+                continue
+            parts.append(self._data[self._within:nl + 1])
+            self._within = nl + 1
+            break
+        return b"".join(parts)
+
+
+def reg2bin(beg: int, end: int, min_shift: int = TBI_MIN_SHIFT, depth: int = TBI_DEPTH) -> int:
+    """Smallest bin fully containing the 0-based half-open interval [beg, end)."""
+    end -= 1
+    s = min_shift
+    t = ((1 << depth * 3) - 1) // 7
+    level = depth
+    while level > 0:
+        if beg >> s == end >> s:
+            return t + (beg >> s)
+        level -= 1
+        s += 3
+        t -= 1 << level * 3
+    return 0
+
+
+def reg2bins(beg: int, end: int, min_shift: int = TBI_MIN_SHIFT, depth: int = TBI_DEPTH) -> List[int]:
+    """Every bin that may hold records overlapping [beg, end)."""
+    bins = []
+    end -= 1
+    s = min_shift + depth * 3
+    t = 0
+    for level in range(depth + 1):
+        bins.extend(range(t + (beg >> s), t + (end >> s) + 1))
+        s -= 3
+        t += 1 << (level * 3)
+    return bins
+
+
+class TabixIndex:
+    """
+    Parsed ``.tbi`` or ``.csi`` index.
+    ``refs`` maps sequence name → (bins, linear index); bins map bin number to
+    (loffset, [(chunk_beg, chunk_end), ...]).
+    """
+
+    def __init__(self, min_shift: int, depth: int, names: List[str],
+                 refs: List[Tuple[Dict[int, Tuple[int, List[Tuple[int, int]]]], List[int]]],
+                 linear: bool):
+        self.min_shift = min_shift
+        self.depth = depth
+        self.refs = dict(zip(names, refs))
+        self._linear = linear
+        self._pseudo_bin = ((1 << (depth + 1) * 3) - 1) // 7 + 1
+
+    @classmethod
+    def load(cls, data: bytes) -> "TabixIndex":
+        """Parse raw index bytes (gzip/BGZF compressed or not)."""
+        if data[:2] == GZIP_MAGIC:
+            data = GzipInflater(max_output=MAX_INDEX_BYTES).decompress(data)
+        try:
+            return cls._parse(io.BytesIO(data))
+        except struct.error:
+            # Counts or lengths pointing past the end of a truncated/corrupt index
+            raise ValueError("invalid tabix index")
+
+    @classmethod
+    def _parse(cls, buf: io.BytesIO) -> "TabixIndex":
+        def i32():
+            return struct.unpack('<i', buf.read(4))[0]
+
+        def u32():
+            return struct.unpack('<I', buf.read(4))[0]
+
+        def u64():
+            return struct.unpack('<Q', buf.read(8))[0]
+
+        magic = buf.read(4)
+        if magic == b'TBI\x01':
+            n_ref = i32()
+            buf.read(4 * 6)  # format, col_seq, col_beg, col_end, meta, skip
+            names = cls._split_names(buf.read(i32()))
+            refs = []
+            for _ in range(n_ref):
+                bins = {}
+                for _ in range(i32()):
+                    bin_no = u32()
+                    chunks = [(u64(), u64()) for _ in range(i32())]
+                    bins[bin_no] = (0, chunks)
+                ioff = [u64() for _ in range(i32())]
+                refs.append((bins, ioff))
+            return cls(TBI_MIN_SHIFT, TBI_DEPTH, names, refs, linear=True)
+
+        if magic == b'CSI\x01':
+            min_shift = i32()
+            depth = i32()
+            aux = buf.read(i32())
+            names = cls._split_names(aux[28:]) if len(aux) >= 28 else []
+            n_ref = i32()
+            refs = []
+            for _ in range(n_ref):
+                bins = {}
+                for _ in range(i32()):
+                    bin_no = u32()
+                    loffset = u64()
+                    chunks = [(u64(), u64()) for _ in range(i32())]
+                    bins[bin_no] = (loffset, chunks)
+                refs.append((bins, []))
+            return cls(min_shift, depth, names, refs, linear=False)
+
+        raise ValueError("Unrecognised index format (expected TBI or CSI).")
+
+    @staticmethod
+    def _split_names(raw: bytes) -> List[str]:
+        return [n.decode('utf-8') for n in raw.split(b'\x00') if n]
+
+    def resolve_name(self, chrom: str) -> Optional[str]:
+        """Match '22' against 'chr22' (and vice versa) in the index."""
+        bare = chrom[3:] if chrom.startswith("chr") else chrom
+        for name in (chrom, bare, "chr" + bare):
+            if name in self.refs:
+                return name
+        return None
+
+    def chunks_for(self, chrom: str, beg: int, end: int) -> List[Tuple[int, int]]:
+        """Merged virtual-offset chunks that may hold records in [beg, end)."""
+        name = self.resolve_name(chrom)
+        if name is None:
+            return []
+        bins, ioff = self.refs[name]
+
+        min_off = 0
+        if self._linear and ioff:
+            min_off = ioff[min(beg >> self.min_shift, len(ioff) - 1)]
+
+        chunks = []
+        for bin_no in reg2bins(beg, end, self.min_shift, self.depth):
+            if bin_no == self._pseudo_bin or bin_no not in bins:
+                continue
+            loffset, bin_chunks = bins[bin_no]
+            floor = max(min_off, loffset)
+            chunks.extend(c for c in bin_chunks if c[1] > floor)
+        chunks.sort()
+
+        merged = []
+        for c_beg, c_end in chunks:
+            if merged and c_beg <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], c_end))
+            else:
+                merged.append((c_beg, c_end))
+        return merged
+
+
+def iter_header_lines(fileobj: BinaryIO) -> Iterator[bytes]:
+    """Yield the '#' header lines from the start of a BGZF file."""
+    reader = BGZFReader(fileobj)
+    reader.seek(0)
+    while True:
+        line = reader.readline()
+        if not line or not line.startswith(b'#'):
+            return
+        yield line.rstrip(b'\r\n')
+
+
+def fetch_region(fileobj: BinaryIO, index: TabixIndex,
+                 chrom: str, start: int, end: int) -> Iterator[bytes]:
+    """
+    Yield raw VCF data lines on ``chrom`` whose POS lies in the 1-based
+    inclusive window [start, end], reading only the indexed BGZF blocks.
+    """
+    reader = BGZFReader(fileobj)
+    bare = chrom[3:] if chrom.startswith("chr") else chrom
+    for c_beg, c_end in index.chunks_for(chrom, start - 1, end):
+        reader.seek(c_beg)
+        while reader.tell() < c_end:
+            line = reader.readline()
+            if not line:
+                break
+            fields = line.split(b'\t', 2)
+            if len(fields) < 3:
+                continue
+            seq = fields[0].decode('utf-8')
+            if (seq[3:] if seq.startswith("chr") else seq) != bare:
+                continue
+            try:
+                pos = int(fields[1])
+            except ValueError:
+                continue
+            if pos > end:
+                break
+            if pos >= start:
+                yield line.rstrip(b'\r\n')
+
+
+# ── Writing (tooling / tests) ───────────────────────────────────────────────
+
+def _bgzf_block(data: bytes) -> bytes:
+    comp = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = comp.compress(data) + comp.flush()
+    bsize = 18 + len(cdata) + 8 - 1
+    header = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+              + struct.pack('<H', bsize))
+    return header + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+def compress_bgzf(data: bytes, block_size: int = BGZF_MAX_BLOCK_DATA) -> bytes:
+    """BGZF-compress ``data`` (what ``bgzip`` would produce)."""
+    blocks = [_bgzf_block(data[i:i + block_size]) for i in range(0, len(data), block_size)]
+    return b"".join(blocks) + BGZF_EOF
+
+
+def build_tabix_index(fileobj: BinaryIO) -> bytes:
+    """Build a BGZF-compressed ``.tbi`` index for a BGZF VCF."""
+    reader = BGZFReader(fileobj)
+    reader.seek(0)
+    names: List[str] = []
+    refs: Dict[str, Tuple[Dict[int, List[List[int]]], Dict[int, int]]] = {}
+
+    while True:
+        voff_beg = reader.tell()
+        line = reader.readline()
+        if not line:
+            break
+        if line.startswith(b'#'):
+            continue
+        fields = line.split(b'\t', 4)
+        if len(fields) < 4:
+            continue
+        voff_end = reader.tell()
+        chrom = fields[0].decode('utf-8')
+        beg = int(fields[1]) - 1
+        end = beg + max(1, len(fields[3]))
+
+        if chrom not in refs:
+            names.append(chrom)
+            refs[chrom] = ({}, {})
+        bins, linear = refs[chrom]
+        chunks = bins.setdefault(reg2bin(beg, end), [])
+        if chunks and chunks[-1][1] == voff_beg:
+            chunks[-1][1] = voff_end
+        else:
+            chunks.append([voff_beg, voff_end])
+        for win in range(beg >> TBI_MIN_SHIFT, ((end - 1) >> TBI_MIN_SHIFT) + 1):
+            linear.setdefault(win, voff_beg)
+
+    name_blob = b"".join(n.encode('utf-8') + b'\x00' for n in names)
+    out = [b'TBI\x01', struct.pack('<i', len(names)),
+           struct.pack('<6i', 2, 1, 2, 0, ord('#'), 0),
+           struct.pack('<i', len(name_blob)), name_blob]
+    for chrom in names:
+        bins, linear = refs[chrom]
+        out.append(struct.pack('<i', len(bins)))
+        for bin_no, chunks in sorted(bins.items()):
+            out.append(struct.pack('<Ii', bin_no, len(chunks)))
+            out.extend(struct.pack('<QQ', b, e) for b, e in chunks)
+        n_intv = max(linear) + 1 if linear else 0
+        out.append(struct.pack('<i', n_intv))
+        out.extend(struct.pack('<Q', linear.get(w, 0)) for w in range(n_intv))
+    return compress_bgzf(b"".join(out))
@@ -0,0 +1,83 @@
+"""
+PharmaGuard Caching
+===================
+Thread-safe LRU cache with optional TTL, plus the canonical genotype
+fingerprint used to key analysis results. Two uploads that share a drug,
+a gene-relevant variant set and a knowledge-base version produce the same
+prediction and explanation, so the second one skips the engine and LLM.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+# Variant fields that influence prediction, explanation or response
+FINGERPRINT_FIELDS = ("rsid", "chromosome", "position", "reference", "alternate", "genotype")
+
+
+def genotype_fingerprint(drug: str, gene_variants: List[Dict], kb_version: str) -> str:
+    """Order-independent hash of (drug, gene variants, knowledge-base version)."""
+    rows = sorted(
+        "\t".join(str(v.get(f, "")) for f in FINGERPRINT_FIELDS) for v in gene_variants
+    )
+    payload = "\n".join([drug, kb_version, *rows])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    Bounded LRU map with an optional per-entry TTL.
+    ``maxsize <= 0`` disables caching; ``ttl <= 0`` means entries never expire.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store ``value``; ``ttl`` overrides the cache-wide lifetime for this entry."""
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl > 0 else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
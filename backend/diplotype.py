@@ -0,0 +1,365 @@
+"""
+PharmaGuard Diplotype Caller
+============================
+Genotype-aware star-allele matching that scales to PharmVar-size
+definition tables (thousands of multi-variant haplotypes over 100+ genes).
+
+Every defining variant of a gene gets a bit, and is indexed both by rsID
+and by (chromosome, position, ref, alt), so records without an rsID still
+match. A star allele is the bitset of the variants that define it; one
+variant may define many alleles. Each variant bit also carries a bitset of
+the alleles it belongs to, so the candidate alleles for a sample are the
+OR of its observed variants' allele sets, each checked for containment
+with one AND. Candidate pairs are then scored as diplotypes and ranked.
+
+Calls are memoised by (gene, genotype pattern), and samples share a handful
+of patterns per gene, so repeat calls are a single dict hit.
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from gene_regions import normalize_chrom
+from genotypes import Genotype
+from knowledge_base import ALLELE_ACTIVITY_SCORES, STAR_ALLELE_VARIANTS
+
+WILD_TYPE = "*1"
+WILD_TYPE_ACTIVITY = 1.0
+# Diplotypes kept per memoised genotype pattern, and how many patterns are memoised
+RANK_DEPTH = 5
+MEMO_SIZE = 65536
+
+# (rsid, genotype) pairs; genotype None means "carried, zygosity unknown"
+Hit = Tuple[str, Optional[Genotype]]
+
+# (chromosome without "chr", position, ref, alt)
+VariantKey = Tuple[str, int, str, str]
+
+
+class DefiningVariant(NamedTuple):
+    """One variant of an allele definition, by rsID, by position/allele, or both."""
+    rsid: Optional[str] = None
+    chromosome: Optional[str] = None
+    position: Optional[int] = None
+    reference: str = ""
+    alternate: str = ""
+
+    def key(self) -> Optional[VariantKey]:
+        if self.chromosome is None or self.position is None or not self.alternate:
+            return None
+        return normalize_chrom(self.chromosome), int(self.position), self.reference.upper(), self.alternate.upper()
+
+
+class AlleleDefinition(NamedTuple):
+    gene: str
+    allele: str
+    variants: Tuple[DefiningVariant, ...]
+
+
+class DiplotypeMatch(NamedTuple):
+    """
+    A candidate diplotype. ``score`` is the fraction of observed alternate
+    calls (hom-alt counted once per haplotype) the two alleles explain;
+    ``unexplained`` counts the rest.
+    """
+    allele1: str
+    allele2: str
+    score: float
+    unexplained: int
+
+
+def definitions_from_star_alleles(star_alleles: Dict[str, tuple]) -> List[AlleleDefinition]:
+    """rsid → (gene, star, function) rows as definitions; rsIDs sharing a star form one allele."""
+    grouped: Dict[Tuple[str, str], List[DefiningVariant]] = {}
+    for rsid, (gene, star, _) in star_alleles.items():
+        grouped.setdefault((gene, star), []).append(DefiningVariant(rsid=rsid))
+    return [AlleleDefinition(gene, star, tuple(v)) for (gene, star), v in grouped.items()]
+
+
+def definitions_from_table(table: Dict[str, Dict[str, list]]) -> List[AlleleDefinition]:
+    """The knowledge base's gene → allele → [(rsid, chrom, pos, ref, alt)] table as definitions."""
+    return [
+        AlleleDefinition(gene, allele, tuple(DefiningVariant(*v) for v in variants))
+        for gene, alleles in table.items()
+        for allele, variants in alleles.items()
+    ]
+
+
+def _bits(mask: int) -> List[int]:
+    """The set bits of ``mask`` as powers of two."""
+    out = []
+    while mask:
+        low = mask & -mask
+        out.append(low)
+        mask ^= low
+    return out
+
+
+class _GeneTable:
+    """Bitsets for one gene: allele masks, and per variant bit the alleles containing it."""
+    __slots__ = ("alleles", "masks", "sizes", "activity", "members", "n_bits")
+
+    def __init__(self):
+        self.alleles: List[str] = []
+        self.masks: List[int] = []
+        self.sizes: List[int] = []
+        self.activity: List[float] = []
+        self.members: Dict[int, int] = {}
+        self.n_bits = 0
+
+    def new_bit(self) -> int:
+        self.n_bits += 1
+        return 1 << (self.n_bits - 1)
+
+    def candidates(self, available: int) -> List[int]:
+        """Allele indices whose every defining variant is in ``available``."""
+        members = self.members
+        touched = 0
+        bits = available
+        while bits:
+            low = bits & -bits
+            touched |= members.get(low, 0)
+            bits ^= low
+        masks = self.masks
+        found = []
+        while touched:
+            low = touched & -touched
+            j = low.bit_length() - 1
+            if masks[j] & ~available == 0:
+                found.append(j)
+            touched ^= low
+        return found
+
+
+class DiplotypeCaller:
+    """
+    Haplotype assembly rules:
+    - phased GT (0|1, 1|0, 1|1): the alt is on the haplotype it names
+    - homozygous alt (1/1), or the same variant reported twice without GT:
+      on both haplotypes
+    - unphased het (0/1) or no GT: on exactly one haplotype, either one
+    - reference or missing calls (0/0, ./.) are not carried
+    Every allele pair consistent with those constraints is a candidate; pairs
+    are ranked by how many observed alt calls they explain, then by lower
+    total activity value (the conservative call), then table order.
+    """
+
+    def __init__(self, star_alleles: Optional[Dict[str, tuple]] = None,
+                 allele_scores: Optional[Dict[str, Dict[str, float]]] = None,
+                 definitions: Optional[Iterable[AlleleDefinition]] = None):
+        star_alleles = STAR_ALLELE_VARIANTS if star_alleles is None else star_alleles
+        allele_scores = ALLELE_ACTIVITY_SCORES if allele_scores is None else allele_scores
+
+        self._genes: Dict[str, _GeneTable] = {}
+        # rsid / position key → [(gene, bit)]
+        self._rsid_bits: Dict[str, List[Tuple[str, int]]] = {}
+        self._key_bits: Dict[VariantKey, List[Tuple[str, int]]] = {}
+        # (chromosome, position) → {(ref, alt): [(gene, bit)]}, so off-target records miss on one lookup
+        self._position_bits: Dict[Tuple[str, int], Dict[Tuple[str, str], List[Tuple[str, int]]]] = {}
+        self._chroms: Dict[str, str] = {}
+        allele_index: Dict[Tuple[str, str], int] = {}
+
+        for definition in [*definitions_from_star_alleles(star_alleles), *(definitions or ())]:
+            table = self._genes.get(definition.gene)
+            if table is None:
+                table = self._genes[definition.gene] = _GeneTable()
+            mask = 0
+            for variant in definition.variants:
+                mask |= self._variant_bit(definition.gene, table, variant)
+            j = allele_index.get((definition.gene, definition.allele))
+            if j is None:
+                scores = allele_scores.get(definition.gene, {})
+                j = allele_index[(definition.gene, definition.allele)] = len(table.alleles)
+                table.alleles.append(definition.allele)
+                table.masks.append(0)
+                table.activity.append(scores.get(definition.allele, scores.get("default", 1.0)))
+            table.masks[j] |= mask
+
+        for (chrom, pos, ref, alt), hits in self._key_bits.items():
+            self._position_bits.setdefault((chrom, pos), {})[(ref, alt)] = hits
+        for table in self._genes.values():
+            table.sizes = [bin(m).count("1") for m in table.masks]
+            for j, mask in enumerate(table.masks):
+                for bit in _bits(mask):
+                    table.members[bit] = table.members.get(bit, 0) | 1 << j
+
+        self._calls: Dict[tuple, List[DiplotypeMatch]] = {}
+
+    def _variant_bit(self, gene: str, table: _GeneTable, variant: DefiningVariant) -> int:
+        key = variant.key()
+        bit = 0
+        for index, k in ((self._rsid_bits, variant.rsid), (self._key_bits, key)):
+            if k is not None and not bit:
+                bit = next((b for g, b in index.get(k, ()) if g == gene), 0)
+        if not bit:
+            bit = table.new_bit()
+        for index, k in ((self._rsid_bits, variant.rsid), (self._key_bits, key)):
+            if k is not None and (gene, bit) not in index.get(k, ()):
+                index.setdefault(k, []).append((gene, bit))
+        return bit
+
+    def genes(self) -> List[str]:
+        return list(self._genes)
+
+    def definition_count(self) -> int:
+        return sum(len(t.alleles) for t in self._genes.values())
+
+    def bit(self, gene: str, rsid: str) -> int:
+        """Bit of ``rsid`` within ``gene``'s bitsets, 0 if it defines no allele there."""
+        return next((b for g, b in self._rsid_bits.get(rsid, ()) if g == gene), 0)
+
+    def record_bits(self, record) -> List[Tuple[str, int]]:
+        """
+        (gene, bit) for every definition variant a VCF record matches, by
+        rsID or position/allele. The returned list is shared; do not modify it.
+        """
+        found = self._rsid_bits.get(record.rsid, ())
+        if self._position_bits:
+            chrom = self._chroms.get(record.chromosome)
+            if chrom is None:
+                chrom = self._chroms[record.chromosome] = normalize_chrom(record.chromosome)
+            alleles = self._position_bits.get((chrom, record.position))
+            if alleles is not None:
+                hits = alleles.get((record.reference, record.alternate))
+                if hits is None:
+                    # Lower-case or multi-allelic records
+                    ref = record.reference.upper()
+                    hits = [h for alt in record.alternate.upper().split(",") for h in alleles.get((ref, alt), ())]
+                if hits:
+                    found = hits if not found else list(dict.fromkeys([*found, *hits]))
+        return found
+
+    def genes_for_record(self, record) -> List[str]:
+        return list(dict.fromkeys(g for g, _ in self.record_bits(record)))
+
+    @staticmethod
+    def _pattern(bits: Iterable[Tuple[int, Optional[Genotype]]]) -> Tuple[int, int, int, int]:
+        """(hom, hap A only, hap B only, unphased het) masks of carried variants."""
+        hom = only_a = only_b = het = 0
+        for bit, genotype in bits:
+            if genotype is not None and (genotype.phased or genotype.dosage != 1):
+                on_a, on_b = genotype.hap1 > 0, genotype.hap2 > 0
+                if on_a and on_b:
+                    hom |= bit
+                elif on_a:
+                    only_a |= bit
+                elif on_b:
+                    only_b |= bit
+            elif het & bit:
+                # Reported twice without a usable GT: read as homozygous
+                het &= ~bit
+                hom |= bit
+            else:
+                het |= bit
+        het &= ~(hom | only_a | only_b)
+        return hom, only_a & ~only_b, only_b & ~only_a, het
+
+    def _candidates(self, table: _GeneTable, available: int) -> List[Tuple[int, float, int, int]]:
+        """(size, activity, index, mask) of each fitting allele, largest first, wild-type last."""
+        rows = [(table.sizes[j], table.activity[j], j, table.masks[j]) for j in table.candidates(available)]
+        rows.sort(key=lambda r: (-r[0], r[1], r[2]))
+        rows.append((0, WILD_TYPE_ACTIVITY, -1, 0))
+        return rows
+
+    def _rank(self, gene: str, pattern: Tuple[int, int, int, int],
+              depth: Optional[int] = RANK_DEPTH) -> List[DiplotypeMatch]:
+        """The ``depth`` best diplotypes for a genotype pattern (all of them for None)."""
+        key = (gene, *pattern)
+        if depth == RANK_DEPTH:
+            ranked = self._calls.get(key)
+            if ranked is not None:
+                return ranked
+        hom, only_a, only_b, het = pattern
+        table = self._genes.get(gene)
+        observed = 2 * bin(hom).count("1") + bin(only_a | only_b | het).count("1")
+        if table is None or not observed:
+            ranked = [DiplotypeMatch(WILD_TYPE, WILD_TYPE, 0.0 if observed else 1.0, observed)]
+            self._calls[key] = ranked
+            return ranked
+
+        avail_a, avail_b = hom | only_a | het, hom | only_b | het
+        cand_a = self._candidates(table, avail_a)
+        symmetric = avail_a == avail_b
+        cand_b = cand_a if symmetric else self._candidates(table, avail_b)
+        max_b = cand_b[0][0]
+        wild_order = len(table.alleles) + 1  # -1 % wild_order sorts wild-type after every allele
+
+        # Candidates are largest first, so once a pair cannot reach the
+        # current depth-th best it is safe to stop scanning (ties are kept).
+        rows = []
+        bound = observed
+        for i, (size_x, act_x, x, mx) in enumerate(cand_a):
+            if observed - size_x - max_b > bound:
+                break
+            for size_y, act_y, y, my in (cand_b[i:] if symmetric else cand_b):
+                unexplained = observed - size_x - size_y
+                if unexplained > bound:
+                    break
+                if mx & my & het:
+                    continue  # an unphased het alt sits on one haplotype only
+                rows.append((unexplained, act_x + act_y, x % wild_order, y % wild_order, x, y))
+            if depth and len(rows) >= 2 * depth:
+                rows.sort()
+                del rows[depth:]
+                bound = rows[-1][0]
+        rows.sort()
+
+        ranked = []
+        for unexplained, _, _, _, x, y in rows[:depth] if depth else rows:
+            if symmetric and y < x:
+                x, y = y, x  # unphased: report in table order
+            a = table.alleles[x] if x >= 0 else WILD_TYPE
+            b = table.alleles[y] if y >= 0 else WILD_TYPE
+            if b == WILD_TYPE and a != WILD_TYPE:
+                a, b = WILD_TYPE, a
+            ranked.append(DiplotypeMatch(a, b, round(1 - unexplained / observed, 4), unexplained))
+        if depth == RANK_DEPTH and len(self._calls) < MEMO_SIZE:
+            self._calls[key] = ranked
+        return ranked
+
+    def rank(self, gene: str, hits: Iterable[Hit], limit: Optional[int] = RANK_DEPTH) -> List[DiplotypeMatch]:
+        """Best-matching diplotypes for (rsid, genotype) hits, best first (all for ``limit=None``)."""
+        bits = ((self.bit(gene, rsid), genotype) for rsid, genotype in hits)
+        pattern = self._pattern((b, g) for b, g in bits if b)
+        return self._rank(gene, pattern, RANK_DEPTH if limit and limit <= RANK_DEPTH else limit)[:limit]
+
+    def rank_records(self, gene: str, records: Iterable,
+                     limit: Optional[int] = RANK_DEPTH) -> List[DiplotypeMatch]:
+        """As ``rank``, matching VCF records by rsID or by position and allele."""
+        bits = ((bit, r.genotype) for r in records for g, bit in self.record_bits(r) if g == gene)
+        return self._rank(gene, self._pattern(bits), RANK_DEPTH if limit and limit <= RANK_DEPTH else limit)[:limit]
+
+    def rank_sample(self, records: Iterable, limit: Optional[int] = RANK_DEPTH) -> Dict[str, List[DiplotypeMatch]]:
+        """
+        Best-matching diplotypes for every gene with a defining variant among
+        ``records`` (one sample), in a single pass over the records. Genes
+        without one are wild-type and are left out.
+        """
+        by_gene: Dict[str, list] = {}
+        for r in records:
+            for gene, bit in self.record_bits(r):
+                hits = by_gene.get(gene)
+                if hits is None:
+                    hits = by_gene[gene] = []
+                hits.append((bit, r.genotype))
+        depth = RANK_DEPTH if limit and limit <= RANK_DEPTH else limit
+        return {gene: self._rank(gene, self._pattern(hits), depth)[:limit] for gene, hits in by_gene.items()}
+
+    def call(self, gene: str, hits: Iterable[Hit]) -> Tuple[str, str]:
+        """(allele1, allele2) of the best match, wild-type first for heterozygous calls."""
+        best = self.rank(gene, hits, limit=1)[0]
+        return best.allele1, best.allele2
+
+    def call_records(self, gene: str, records: Iterable) -> Tuple[str, str]:
+        best = self.rank_records(gene, records, limit=1)[0]
+        return best.allele1, best.allele2
+
+    def haplotype_alleles(self, gene: str, records: Iterable) -> List[str]:
+        """Alleles whose every defining variant is carried (either haplotype)."""
+        carried = 0
+        for r in records:
+            for g, bit in self.record_bits(r):
+                if g == gene:
+                    carried |= bit
+        table = self._genes.get(gene)
+        if table is None:
+            return []
+        return [table.alleles[j] for j in table.candidates(carried)]
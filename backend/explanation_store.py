@@ -0,0 +1,167 @@
+"""
+PharmaGuard Explanation Store
+=============================
+Disk-backed (SQLite) store for LLM explanations. The Gemini prompt depends
+only on a handful of clinical inputs, which repeat heavily across patients,
+so each distinct explanation is generated once and then served from here,
+across requests, workers and restarts.
+
+Pre-warm the store for every single- and two-variant genotype per drug:
+
+    cd backend && python explanation_store.py prewarm
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from itertools import combinations
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "explanations.sqlite3")
+
+
+def explanation_key(model_name: str, drug: str, gene: str, phenotype: str, risk: str,
+                    diplotype: str, activity_score: Any, variant_rsids: List[str],
+                    recommendation: str, mechanism: str,
+                    secondary_genes: Sequence[Tuple[str, str, str]] = ()) -> str:
+    """
+    Hash of exactly the inputs that shape the Gemini prompt, plus the model.
+    Secondary (gene, diplotype, phenotype) calls are appended only when
+    present, so single-gene keys are unchanged.
+    """
+    fields = [model_name, drug, gene, phenotype, risk, diplotype, activity_score,
+              list(variant_rsids), recommendation, mechanism]
+    if secondary_genes:
+        fields.append([list(call) for call in secondary_genes])
+    payload = json.dumps(fields, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExplanationStore:
+    """
+    SQLite key → explanation JSON map with least-recently-used eviction once
+    ``max_entries`` is exceeded.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, max_entries: int = 50_000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS explanations ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_explanations_last_used ON explanations(last_used)"
+            )
+            self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional["ExplanationStore"]:
+        """Store configured by environment; PHARMAGUARD_EXPLANATION_DB="" disables it."""
+        path = os.getenv("PHARMAGUARD_EXPLANATION_DB", DEFAULT_DB_PATH)
+        if not path:
+            return None
+        max_entries = int(os.getenv("PHARMAGUARD_EXPLANATION_DB_MAX", "50000"))
+        try:
+            return cls(path, max_entries)
+        except sqlite3.Error as e:
+            print(f"[ExplanationStore] ⚠ Could not open {path}: {e}. Store disabled.")
+            return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM explanations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE explanations SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, model_name: str, explanation: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO explanations (key, model, payload, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, json.dumps(explanation), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM explanations").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM explanations WHERE key IN ("
+                " SELECT key FROM explanations ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def prewarm(llm_service, risk_engine, drugs: Optional[List[str]] = None) -> int:
+    """
+    Generate and store explanations for every wild-type, single-variant and
+    two-variant genotype built from the known star-allele rsIDs of each
+    drug's genes. Returns the number of genotypes visited.
+    """
+    from knowledge_base import DRUG_GENES, STAR_ALLELE_VARIANTS
+    from llm_service import secondary_gene_calls
+
+    visited = 0
+    for drug in drugs or list(DRUG_GENES):
+        genes = DRUG_GENES[drug]
+        gene = genes[0]
+        rsids = [r for r, (g, _, _) in STAR_ALLELE_VARIANTS.items() if g in genes]
+        genotypes = [()] + [(r,) for r in rsids] + list(combinations(rsids, 2))
+        for genotype in genotypes:
+            variants = [{"rsid": r} for r in genotype]
+            by_gene = {g: [v for v in variants if STAR_ALLELE_VARIANTS[v["rsid"]][0] == g] for g in genes}
+            p = risk_engine.predict_risk(drug, [], gene_variants=by_gene)
+            llm_service.generate_explanation(
+                drug=drug, gene=gene, phenotype=p["phenotype"], risk=p["risk"],
+                variants=p["gene_variants"], recommendation=p["recommendation"],
+                mechanism=p["mechanism"], diplotype=f"{p['allele1']}/{p['allele2']}",
+                activity_score=p["activity_score"], secondary_genes=secondary_gene_calls(p),
+            )
+            visited += 1
+    return visited
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["prewarm"]:
+        print("usage: python explanation_store.py prewarm")
+        sys.exit(2)
+    from llm_service import LLMService
+    from risk_engine import RiskEngine
+
+    service = LLMService()
+    service.initialize()
+    if service.store is None:
+        print("No Gemini model or explanation store configured; nothing to pre-warm.")
+        sys.exit(1)
+    count = prewarm(service, RiskEngine())
+    print(f"Pre-warmed {count} genotypes; store holds {len(service.store)} explanations.")
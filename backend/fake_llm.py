@@ -0,0 +1,119 @@
+"""
+PharmaGuard Fake Gemini
+=======================
+In-process stand-in for ``google.generativeai.GenerativeModel`` used for
+load testing and offline development. It answers the explanation prompt
+with valid JSON after a sampled latency and can inject errors and hangs,
+so timeouts, fallbacks, concurrency limits and caching can be exercised
+without network access or API quota.
+
+Enable with ``PHARMAGUARD_LLM_BACKEND=fake``; tune with
+PHARMAGUARD_FAKE_LLM_LATENCY    fixed:MS | uniform:LO,HI | lognormal:MEDIAN,SIGMA | exp:MEAN
+                                (milliseconds, default lognormal:800,0.4)
+PHARMAGUARD_FAKE_LLM_ERROR_RATE fraction of calls that raise (default 0)
+PHARMAGUARD_FAKE_LLM_HANG_RATE  fraction of calls that sleep HANG_S first (default 0)
+PHARMAGUARD_FAKE_LLM_HANG_S     hang duration in seconds (default 60)
+PHARMAGUARD_FAKE_LLM_SEED       RNG seed for reproducible runs
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+_CITATIONS = re.compile(r'"variant_citations": (\[.*?\])')
+_FIELD = re.compile(r"^- (Gene|Drug): (\S+)", re.MULTILINE)
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """'lognormal:800,0.4' → sampler returning seconds (spec values are ms)."""
+    kind, _, params = spec.partition(":")
+    try:
+        values = [float(p) for p in params.split(",")] if params.strip() else []
+    except ValueError:
+        values = []
+    kind = kind.strip().lower()
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        mu, sigma = math.log(values[0] / 1000), values[1]
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if kind == "exp" and len(values) == 1:
+        return lambda rng: rng.expovariate(1000 / values[0])
+    raise ValueError(f"Unrecognised latency distribution {spec!r}")
+
+
+class FakeLLMError(RuntimeError):
+    pass
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Duck-typed GenerativeModel: generate_content and generate_content_async."""
+
+    def __init__(self, latency: str = "lognormal:800,0.4", error_rate: float = 0.0,
+                 hang_rate: float = 0.0, hang_s: float = 60.0, seed: Optional[int] = None):
+        self.latency_spec = latency
+        self._sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_s = hang_s
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeGeminiModel":
+        seed = os.getenv("PHARMAGUARD_FAKE_LLM_SEED")
+        return cls(
+            latency=os.getenv("PHARMAGUARD_FAKE_LLM_LATENCY", "lognormal:800,0.4"),
+            error_rate=float(os.getenv("PHARMAGUARD_FAKE_LLM_ERROR_RATE", "0")),
+            hang_rate=float(os.getenv("PHARMAGUARD_FAKE_LLM_HANG_RATE", "0")),
+            hang_s=float(os.getenv("PHARMAGUARD_FAKE_LLM_HANG_S", "60")),
+            seed=int(seed) if seed else None,
+        )
+
+    def _plan(self) -> tuple:
+        """(delay seconds, fail?) for one call; the RNG is shared across threads."""
+        with self._lock:
+            self.calls += 1
+            delay = self._sample_latency(self._rng)
+            if self._rng.random() < self.hang_rate:
+                delay += self.hang_s
+            return delay, self._rng.random() < self.error_rate
+
+    @staticmethod
+    def _answer(prompt: str) -> _Response:
+        fields = dict(_FIELD.findall(prompt))
+        drug, gene = fields.get("Drug", "the drug"), fields.get("Gene", "the gene")
+        citations = _CITATIONS.search(prompt)
+        return _Response(json.dumps({
+            "summary": f"[fake] {gene} genotype and {drug} risk summary.",
+            "biological_mechanism": f"[fake] {gene} mechanism for {drug}.",
+            "variant_citations": json.loads(citations.group(1)) if citations else [],
+            "confidence_reasoning": "[fake] Generated by the local Gemini stand-in.",
+        }))
+
+    def generate_content(self, prompt: str) -> _Response:
+        delay, fail = self._plan()
+        time.sleep(delay)
+        if fail:
+            raise FakeLLMError("injected fake Gemini error")
+        return self._answer(prompt)
+
+    async def generate_content_async(self, prompt: str) -> _Response:
+        delay, fail = self._plan()
+        await asyncio.sleep(delay)
+        if fail:
+            raise FakeLLMError("injected fake Gemini error")
+        return self._answer(prompt)
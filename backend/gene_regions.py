@@ -0,0 +1,110 @@
+"""
+PharmaGuard Gene Region Index
+=============================
+Per-chromosome interval index over pharmacogene windows, built once at
+import time. Assigning a variant to its gene(s) is a bisect on the sorted
+window starts instead of a linear scan over every gene.
+
+The default windows come from ``GENE_CHROMOSOMES``. Set
+``PHARMAGUARD_GENE_BED`` to a BED file (chrom, start, end, gene) to
+replace them and extend coverage.
+"""
+import os
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Tuple
+
+from knowledge_base import GENE_CHROMOSOMES
+
+
+def normalize_chrom(chrom: str) -> str:
+    """'chr22' → '22' (matching the bare names in GENE_CHROMOSOMES)."""
+    return chrom[3:] if chrom.startswith("chr") else chrom
+
+
+class GeneIntervalIndex:
+    """
+    Sorted-start interval index per chromosome.
+    Each chromosome keeps its intervals ordered by start plus a running max
+    of ends, so a lookup bisects to the last start <= pos and walks back only
+    while an earlier interval could still reach pos.
+    """
+
+    def __init__(self, regions: Iterable[Tuple[str, str, int, int]]):
+        by_chrom: Dict[str, List[Tuple[int, int, str]]] = {}
+        for gene, chrom, start, end in regions:
+            by_chrom.setdefault(normalize_chrom(chrom), []).append((start, end, gene))
+
+        self._starts: Dict[str, List[int]] = {}
+        self._intervals: Dict[str, List[Tuple[int, int, str]]] = {}
+        self._max_end: Dict[str, List[int]] = {}
+        for chrom, intervals in by_chrom.items():
+            intervals.sort()
+            running, max_end = 0, []
+            for _, end, _ in intervals:
+                running = max(running, end)
+                max_end.append(running)
+            self._starts[chrom] = [s for s, _, _ in intervals]
+            self._intervals[chrom] = intervals
+            self._max_end[chrom] = max_end
+
+    @classmethod
+    def from_gene_table(cls, table: Dict[str, Tuple[str, int, int]]) -> "GeneIntervalIndex":
+        """Build from a {gene: (chrom, start, end)} table (1-based inclusive)."""
+        return cls((gene, chrom, start, end) for gene, (chrom, start, end) in table.items())
+
+    @classmethod
+    def from_bed(cls, path: str) -> "GeneIntervalIndex":
+        """
+        Build from a BED file: chrom, start (0-based), end (exclusive), gene.
+        Columns may be split by tabs or spaces; blank, ``#`` comment, ``track``
+        and ``browser`` lines are skipped.
+        """
+        regions = []
+        with open(path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                cols = line.split()
+                if not cols or cols[0].startswith("#") or cols[0] in ("track", "browser"):
+                    continue
+                if len(cols) < 4:
+                    raise ValueError(f"BED line needs chrom, start, end, gene: {line!r}")
+                regions.append((cols[3], cols[0], int(cols[1]) + 1, int(cols[2])))
+        return cls(regions)
+
+    def genes_at(self, chrom: str, pos: int) -> List[str]:
+        """Genes whose window contains ``pos`` on ``chrom``."""
+        chrom = normalize_chrom(chrom)
+        starts = self._starts.get(chrom)
+        if not starts:
+            return []
+        intervals = self._intervals[chrom]
+        max_end = self._max_end[chrom]
+        hits = []
+        i = bisect_right(starts, pos) - 1
+        while i >= 0 and max_end[i] >= pos:
+            start, end, gene = intervals[i]
+            if end >= pos:
+                hits.append(gene)
+            i -= 1
+        return hits
+
+    def regions(self) -> List[Tuple[str, int, int]]:
+        """All (chrom, start, end) windows, e.g. for tabix seeking."""
+        return [(chrom, start, end)
+                for chrom, intervals in self._intervals.items()
+                for start, end, _ in intervals]
+
+    def genes(self) -> List[str]:
+        return list(dict.fromkeys(
+            gene for intervals in self._intervals.values() for _, _, gene in intervals
+        ))
+
+
+def load_gene_index(kb=None) -> GeneIntervalIndex:
+    """The BED override if set, else the windows of ``kb`` (default: the startup tables)."""
+    bed_path = os.getenv("PHARMAGUARD_GENE_BED")
+    if bed_path:
+        return GeneIntervalIndex.from_bed(bed_path)
+    return GeneIntervalIndex.from_gene_table(GENE_CHROMOSOMES if kb is None else kb.gene_windows)
+
+
+GENE_INDEX = load_gene_index()
@@ -0,0 +1,140 @@
+"""
+PharmaGuard Genotype Handling
+=============================
+GT-field parsing and the columnar genotype matrix used for multi-sample
+(joint-called cohort) VCFs: one int8 row per variant, one column per
+sample, holding the alternate-allele dosage (0, 1, 2; -1 when missing).
+numpy is imported on first use so single-sample serving never loads it.
+"""
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Sequence
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MISSING_DOSAGE = -1
+
+
+class Genotype(NamedTuple):
+    """
+    Compact per-variant call. hap1/hap2 are 1 for an alternate allele, 0 for
+    reference and -1 for missing; ``phased`` is True for '|' separated GTs.
+    """
+    hap1: int
+    hap2: int
+    phased: bool
+
+    @property
+    def dosage(self) -> int:
+        return (self.hap1 > 0) + (self.hap2 > 0)
+
+    def __str__(self) -> str:
+        sep = "|" if self.phased else "/"
+        return sep.join("." if h < 0 else str(h) for h in (self.hap1, self.hap2))
+
+
+# Unphased genotypes by alt dosage, as recovered from a dosage matrix
+DOSAGE_GENOTYPES = {0: Genotype(0, 0, False), 1: Genotype(0, 1, False), 2: Genotype(1, 1, False)}
+
+_GENOTYPE_CACHE: Dict[str, Optional[Genotype]] = {}
+
+
+def parse_gt(gt: str) -> Optional[Genotype]:
+    """
+    '0/1' → Genotype(0, 1, False), '1|0' → Genotype(1, 0, True).
+    Multi-allelic alts collapse to 1; haploid calls get a reference second
+    haplotype. Returns None for an empty field.
+    """
+    genotype = _GENOTYPE_CACHE.get(gt)
+    if genotype is None and gt not in _GENOTYPE_CACHE:
+        if not gt:
+            genotype = None
+        else:
+            phased = "|" in gt
+            alleles = gt.replace("|", "/").split("/")
+            haps = [-1 if a in (".", "") else int(a != "0") for a in alleles[:2]]
+            if len(haps) == 1:
+                haps.append(0)
+            genotype = Genotype(haps[0], haps[1], phased)
+        if len(_GENOTYPE_CACHE) < 4096:
+            _GENOTYPE_CACHE[gt] = genotype
+    return genotype
+
+
+def sample_genotype(format_field: str, sample_field: str) -> Optional[Genotype]:
+    """GT of one sample column, or None when there is no GT."""
+    if not format_field or not sample_field:
+        return None
+    if format_field.startswith("GT"):
+        return parse_gt(sample_field.split(":", 1)[0])
+    keys = format_field.split(":")
+    if "GT" not in keys:
+        return None
+    parts = sample_field.split(":")
+    i = keys.index("GT")
+    return parse_gt(parts[i]) if i < len(parts) else None
+
+
+# GT strings repeat constantly ("0/1", "1|1", ...), so memoise their dosage
+_DOSAGE_CACHE: Dict[str, int] = {}
+
+
+def gt_dosage(gt: str) -> int:
+    """Alternate-allele count of a GT string; -1 if any allele is missing."""
+    dosage = _DOSAGE_CACHE.get(gt)
+    if dosage is None:
+        alleles = gt.replace("|", "/").split("/")
+        if any(a in (".", "") for a in alleles):
+            dosage = MISSING_DOSAGE
+        else:
+            dosage = sum(1 for a in alleles if a != "0")
+        if len(_DOSAGE_CACHE) < 4096:
+            _DOSAGE_CACHE[gt] = dosage
+    return dosage
+
+
+def sample_dosages(format_field: str, sample_fields: Sequence[str], n_samples: int) -> List[int]:
+    """Dosage per sample for one VCF line, padded with -1 for absent columns."""
+    keys = format_field.split(":") if format_field else []
+    if "GT" not in keys:
+        return [MISSING_DOSAGE] * n_samples
+    gt_index = keys.index("GT")
+    if gt_index == 0:
+        row = [gt_dosage(f.split(":", 1)[0]) for f in sample_fields[:n_samples]]
+    else:
+        row = []
+        for f in sample_fields[:n_samples]:
+            parts = f.split(":")
+            row.append(gt_dosage(parts[gt_index]) if gt_index < len(parts) else MISSING_DOSAGE)
+    if len(row) < n_samples:
+        row.extend([MISSING_DOSAGE] * (n_samples - len(row)))
+    return row
+
+
+class GenotypeMatrix:
+    """
+    Variants × samples dosage matrix for a multi-sample VCF.
+    ``variants`` are the parser's VariantRecords, aligned with the rows.
+    """
+
+    def __init__(self, samples: List[str], variants: List[Any], dosages: "np.ndarray"):
+        if dosages.shape != (len(variants), len(samples)):
+            raise ValueError(
+                f"Dosage matrix shape {dosages.shape} does not match "
+                f"{len(variants)} variants × {len(samples)} samples"
+            )
+        self.samples = samples
+        self.variants = variants
+        self.dosages = dosages
+
+    @classmethod
+    def from_rows(cls, samples: List[str], variants: List[Any],
+                  rows: List[List[int]]) -> "GenotypeMatrix":
+        import numpy as np
+        dosages = np.array(rows, dtype=np.int8).reshape(len(variants), len(samples))
+        return cls(samples, variants, dosages)
+
+    def sample_variants(self, sample_index: int) -> List[Any]:
+        """Variants carried (dosage > 0) by one sample, in file order, with GT."""
+        column = self.dosages[:, sample_index]
+        return [v.with_genotype(DOSAGE_GENOTYPES[min(int(d), 2)])
+                for v, d in zip(self.variants, column) if d > 0]
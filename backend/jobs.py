@@ -0,0 +1,56 @@
+"""
+PharmaGuard Background Explanation Jobs
+=======================================
+Tracks LLM explanations that are generated after the risk result has been
+returned (``explain=deferred``). Jobs live in a bounded LRU/TTL map so an
+unpolled job cannot leak memory.
+"""
+import asyncio
+import uuid
+from typing import Any, Coroutine, Dict, Hashable, Optional
+
+from cache import LRUCache
+
+
+class ExplanationJobs:
+    def __init__(self, maxsize: int = 4096, ttl: float = 3600):
+        self._jobs = LRUCache(maxsize=maxsize, ttl=ttl)
+        # Strong references so running tasks are not garbage-collected
+        self._running = set()
+        # key → job ID of the job still running for it
+        self._in_flight: Dict[Hashable, str] = {}
+
+    def submit(self, coro: Coroutine[Any, Any, Dict[str, Any]], key: Optional[Hashable] = None) -> str:
+        """
+        Schedule ``coro`` on the running loop and return its job ID. If a job
+        for ``key`` is still running, ``coro`` is discarded and that job's ID
+        is returned instead, so identical requests share one LLM call.
+        """
+        if key is not None:
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                coro.close()
+                return job_id
+        job_id = uuid.uuid4().hex
+        task = asyncio.ensure_future(coro)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        if key is not None:
+            self._in_flight[key] = job_id
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        self._jobs.set(job_id, task)
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job state, or None if the ID is unknown or expired."""
+        task = self._jobs.get(job_id)
+        if task is None:
+            return None
+        if not task.done():
+            return {"job_id": job_id, "status": "pending", "explanation": None}
+        if task.cancelled() or task.exception() is not None:
+            return {"job_id": job_id, "status": "failed", "explanation": None}
+        return {"job_id": job_id, "status": "ready", "explanation": task.result()}
+
+    def __len__(self) -> int:
+        return len(self._running)
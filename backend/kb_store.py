@@ -0,0 +1,70 @@
+"""
+PharmaGuard Knowledge-Base Store
+================================
+Holds the knowledge base in service as one immutable snapshot (compiled
+tables, the risk engine and the VCF target filter built from them) and
+swaps it atomically on reload.
+
+A request reads ``store.current`` once and uses that snapshot throughout,
+so a reload never mixes two versions within one response and never
+interrupts a request already in flight. Reloads are serialized; a file
+that fails to load or validate leaves the current snapshot in place.
+"""
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+from knowledge_base import COMPILED_KB, CompiledKnowledgeBase, kb_path
+from risk_engine import RiskEngine
+from vcf_parser import TargetFilter
+
+
+class KnowledgeBaseSnapshot(NamedTuple):
+    kb: CompiledKnowledgeBase
+    engine: RiskEngine
+    targets: TargetFilter
+    path: str
+    loaded_at: float
+
+    @property
+    def version(self) -> str:
+        return self.kb.version
+
+
+def build_snapshot(kb: CompiledKnowledgeBase, path: str) -> KnowledgeBaseSnapshot:
+    engine = RiskEngine(kb=kb)
+    targets = TargetFilter.pharmacogenes(kb, engine.gene_index)
+    return KnowledgeBaseSnapshot(kb, engine, targets, path, time.time())
+
+
+class KnowledgeBaseStore:
+    def __init__(self, path: Optional[str] = None, kb: Optional[CompiledKnowledgeBase] = None):
+        self.path = path or kb_path()
+        # The startup tables were loaded from the same path; compile them only once
+        self.current = build_snapshot(kb or COMPILED_KB, self.path)
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[KnowledgeBaseSnapshot, KnowledgeBaseSnapshot], None]] = []
+
+    def on_reload(self, fn: Callable[[KnowledgeBaseSnapshot, KnowledgeBaseSnapshot], None]) -> None:
+        """Call ``fn(previous, current)`` after every reload that changed the version."""
+        self._listeners.append(fn)
+
+    def reload(self, path: Optional[str] = None) -> KnowledgeBaseSnapshot:
+        """
+        Load, validate and compile ``path`` (default: the configured file),
+        then publish it with a single reference swap. Raises OSError or
+        ValueError, keeping the current snapshot, if the file is unusable.
+        """
+        with self._lock:
+            path = path or self.path
+            snapshot = build_snapshot(CompiledKnowledgeBase.from_file(path), path)
+            previous, self.current = self.current, snapshot
+            self.path = path
+            self.reloads += 1
+        if snapshot.version != previous.version:
+            for fn in self._listeners:
+                fn(previous, snapshot)
+        print(f"[KnowledgeBase] Loaded {path} version {snapshot.version} "
+              f"(was {previous.version})")
+        return snapshot
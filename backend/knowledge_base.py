@@ -3,382 +3,330 @@ PharmaGuard Knowledge Base — CPIC v2024 Aligned
 ================================================
 Real RSID → Star-Allele mappings and comprehensive CPIC guidelines.
 Based on official CPIC gene-drug guidelines.
+
+The tables live in a versioned data file (``data/knowledge_base.json``, or
+``PHARMAGUARD_KB_PATH``) so a CPIC update is a data change, not a deploy.
+``CompiledKnowledgeBase.from_file`` turns a file into immutable lookups;
+the module-level tables below are the ones loaded at startup.
 """
+import hashlib
+import json
+import os
+from itertools import product
+from types import MappingProxyType
+from typing import Any, Dict, List, Optional, Tuple
 
-# ── Drug → Primary Gene mapping ──────────────────────────────────────────────
-DRUG_GENE_MAP = {
-    "CODEINE":     "CYP2D6",
-    "WARFARIN":    "CYP2C9",
-    "CLOPIDOGREL": "CYP2C19",
-    "SIMVASTATIN": "SLCO1B1",
-    "AZATHIOPRINE":"TPMT",
-    "FLUOROURACIL":"DPYD",
-}
+DEFAULT_KB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "knowledge_base.json")
 
-# ── Star-Allele Defining Variants ─────────────────────────────────────────────
-# Source: PharmVar, PharmGKB, CPIC official tables
-# Each entry: rsid -> list of (gene, star_allele, function_impact)
-# function_impact: "no_function" | "decreased_function" | "increased_function" | "normal_function"
-
-STAR_ALLELE_VARIANTS = {
-    # ── CYP2D6 ──────────────────────────────────────────────────────────────
-    "rs3892097":  ("CYP2D6", "*4",  "no_function"),        # CYP2D6*4 — most common PM allele
-    "rs35742686": ("CYP2D6", "*3",  "no_function"),        # CYP2D6*3 frameshift
-    "rs5030655":  ("CYP2D6", "*6",  "no_function"),        # CYP2D6*6 frameshift
-    "rs16947":    ("CYP2D6", "*2",  "normal_function"),    # CYP2D6*2 (activity ~1.0)
-    "rs28371725": ("CYP2D6", "*41", "decreased_function"), # CYP2D6*41 splice defect
-    "rs1065852":  ("CYP2D6", "*10", "decreased_function"), # CYP2D6*10 — common in Asians
-    "rs5030867":  ("CYP2D6", "*8",  "no_function"),        # CYP2D6*8
-    "rs769258":   ("CYP2D6", "*29", "decreased_function"), # CYP2D6*29
-
-    # ── CYP2C9 ──────────────────────────────────────────────────────────────
-    "rs1799853":  ("CYP2C9", "*2",  "decreased_function"), # CYP2C9*2 (R144C) ~12% activity
-    "rs1057910":  ("CYP2C9", "*3",  "decreased_function"), # CYP2C9*3 (I359L) ~5% activity
-    "rs28371686": ("CYP2C9", "*5",  "decreased_function"), # CYP2C9*5
-    "rs9332131":  ("CYP2C9", "*6",  "no_function"),        # CYP2C9*6 splicing
-
-    # ── CYP2C19 ─────────────────────────────────────────────────────────────
-    "rs4244285":  ("CYP2C19", "*2",  "no_function"),       # CYP2C19*2 — most common loss-of-function
-    "rs4986893":  ("CYP2C19", "*3",  "no_function"),       # CYP2C19*3 — common in Asians
-    "rs28399504": ("CYP2C19", "*4",  "no_function"),       # CYP2C19*4
-    "rs12248560": ("CYP2C19", "*17", "increased_function"),# CYP2C19*17 — rapid metabolizer allele
-    "rs72552267": ("CYP2C19", "*35", "no_function"),       # CYP2C19*35
-
-    # ── SLCO1B1 ──────────────────────────────────────────────────────────────
-    "rs4149056":  ("SLCO1B1", "*5",  "decreased_function"),# SLCO1B1*5 — key simvastatin risk variant
-    "rs2306283":  ("SLCO1B1", "*1b", "normal_function"),   # SLCO1B1*1b
-    "rs11045819": ("SLCO1B1", "*14", "decreased_function"),# SLCO1B1*14
-
-    # ── TPMT ─────────────────────────────────────────────────────────────────
-    "rs1800462":  ("TPMT", "*2",   "no_function"),         # TPMT*2 (A80P)
-    "rs1800460":  ("TPMT", "*3B",  "no_function"),         # TPMT*3B (G460A)
-    "rs1142345":  ("TPMT", "*3C",  "no_function"),         # TPMT*3C (A719G) — most common
-
-
-    # ── DPYD ─────────────────────────────────────────────────────────────────
-    "rs3918290":  ("DPYD", "*2A",  "no_function"),         # DPYD*2A (IVS14+1G>A) — deadly
-    "rs55886062": ("DPYD", "*13",  "no_function"),         # DPYD*13 (I560S)
-    "rs67376798": ("DPYD", "c.2846A>T", "decreased_function"), # Key risk variant
-    "rs1801159":  ("DPYD", "c.1627A>G", "decreased_function"), # c.1627A>G
-}
+_REQUIRED_TABLES = ("drug_gene_map", "gene_windows", "star_allele_variants",
+                    "allele_activity_scores", "phenotype_thresholds", "cpic_guidelines")
+_PHENOTYPES = {"PM", "IM", "NM", "RM", "URM"}
+
+
+def kb_path() -> str:
+    return os.getenv("PHARMAGUARD_KB_PATH") or DEFAULT_KB_PATH
+
+
+def load_tables(path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Read a knowledge-base data file into the in-memory table shapes:
+      drug_genes             drug → (gene, ...) primary gene first; the file's
+                             drug_gene_map may name one gene or a list
+      drug_gene_map          drug → primary gene
+      gene_windows           gene → (chromosome without "chr", start, end), 1-based inclusive
+      star_allele_variants   rsid → (gene, star_allele, function_impact)
+      allele_activity_scores gene → {allele: score, "default": score}
+      phenotype_thresholds   gene → [(min activity, phenotype)] ascending; 0 is always PM
+      allele_definitions     optional multi-variant haplotypes (e.g. imported from PharmVar):
+                             gene → allele → [(rsid, chromosome, position, ref, alt)],
+                             any of rsid or chromosome/position/ref/alt may be null
+      cpic_guidelines        drug → phenotype → rule, by the primary gene's phenotype
+      combined_guidelines    optional multi-gene rules: drug → [{"phenotypes": {gene: (phenotype, ...)},
+                             risk, severity, recommendation, mechanism}]; genes a rule does
+                             not name match any phenotype, and the first matching rule wins
+      drug_info              drug → display metadata
+    Raises ValueError if the file is malformed or internally inconsistent.
+    """
+    path = path or kb_path()
+    with open(path, "r", encoding="utf-8") as fh:
+        raw = json.load(fh)
+    if not isinstance(raw, dict):
+        raise ValueError(f"Knowledge base {path} is not a JSON object")
+    missing = [t for t in _REQUIRED_TABLES if t not in raw]
+    if missing:
+        raise ValueError(f"Knowledge base {path} is missing tables: {missing}")
+    # A missing key or wrong shape deep in an entry is a bad file, like any
+    # other validation failure, not a crash in whoever is reloading
+    try:
+        tables = _build_tables(raw)
+        _check_tables(path, tables)
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid knowledge base {path}: malformed entry ({type(e).__name__}: {e})") from e
+    return tables
+
+
+def _build_tables(raw: Dict[str, Any]) -> Dict[str, Any]:
+    drug_genes = {d.upper(): (g,) if isinstance(g, str) else tuple(g)
+                  for d, g in raw["drug_gene_map"].items()}
+    return {
+        "version": str(raw.get("version", "unversioned")),
+        "drug_genes": drug_genes,
+        "drug_gene_map": {d: genes[0] for d, genes in drug_genes.items() if genes},
+        "gene_windows": {g: (str(w["chromosome"]), int(w["start"]), int(w["end"]))
+                         for g, w in raw["gene_windows"].items()},
+        "star_allele_variants": {r: (v["gene"], v["allele"], v["function"])
+                                 for r, v in raw["star_allele_variants"].items()},
+        "allele_activity_scores": {g: {a: float(x) for a, x in scores.items()}
+                                   for g, scores in raw["allele_activity_scores"].items()},
+        "phenotype_thresholds": {g: [(float(t), p) for t, p in rows]
+                                 for g, rows in raw["phenotype_thresholds"].items()},
+        "cpic_guidelines": raw["cpic_guidelines"],
+        "combined_guidelines": {
+            drug.upper(): [
+                {**rule, "phenotypes": {g: (p,) if isinstance(p, str) else tuple(p)
+                                        for g, p in rule.get("phenotypes", {}).items()}}
+                for rule in rules
+            ]
+            for drug, rules in raw.get("combined_guidelines", {}).items()
+        },
+        "drug_info": raw.get("drug_info", {}),
+        "allele_definitions": {
+            gene: {allele: [(v.get("rsid"), v.get("chromosome"), v.get("position"),
+                             v.get("ref", ""), v.get("alt", "")) for v in variants]
+                   for allele, variants in alleles.items()}
+            for gene, alleles in raw.get("allele_definitions", {}).items()
+        },
+    }
+
+
+def _check_tables(path: str, tables: Dict[str, Any]) -> None:
+    problems = []
+    for drug, genes in tables["drug_genes"].items():
+        if not genes or len(set(genes)) != len(genes):
+            problems.append(f"{drug}: genes must be a non-empty list without repeats")
+        if drug not in tables["cpic_guidelines"]:
+            problems.append(f"{drug} has no CPIC guidelines")
+    for drug, rules in tables["combined_guidelines"].items():
+        genes = tables["drug_genes"].get(drug, ())
+        for i, rule in enumerate(rules):
+            if not rule["phenotypes"] or any(g not in genes for g in rule["phenotypes"]):
+                problems.append(f"{drug} combined rule {i}: phenotypes must name genes of the drug {list(genes)}")
+            if any(p not in _PHENOTYPES for codes in rule["phenotypes"].values() for p in codes):
+                problems.append(f"{drug} combined rule {i}: unknown phenotype")
+            for field in ("risk", "severity", "recommendation", "mechanism"):
+                if field not in rule:
+                    problems.append(f"{drug} combined rule {i}: missing {field!r}")
+    for drug, rules in tables["cpic_guidelines"].items():
+        for phenotype, rule in rules.items():
+            if phenotype not in _PHENOTYPES:
+                problems.append(f"{drug}: unknown phenotype {phenotype!r}")
+            for field in ("risk", "severity", "recommendation", "mechanism"):
+                if field not in rule:
+                    problems.append(f"{drug}/{phenotype}: missing {field!r}")
+    for gene, rows in tables["phenotype_thresholds"].items():
+        if [t for t, _ in rows] != sorted(t for t, _ in rows):
+            problems.append(f"{gene}: phenotype thresholds are not ascending")
+        if any(p not in _PHENOTYPES for _, p in rows):
+            problems.append(f"{gene}: unknown phenotype in thresholds")
+    for gene, alleles in tables["allele_definitions"].items():
+        for allele, variants in alleles.items():
+            if not variants or any(not v[0] and (v[1] is None or v[2] is None or not v[4]) for v in variants):
+                problems.append(f"{gene} {allele}: every defining variant needs an rsid or chromosome/position/alt")
+    if problems:
+        raise ValueError(f"Invalid knowledge base {path}: " + "; ".join(problems))
+
+
+def phenotype_for_score(thresholds: Dict[str, List[Tuple[float, str]]], gene: str, total: float) -> str:
+    """Activity-score total → phenotype: 0 is PM, else the highest threshold reached."""
+    rows = thresholds.get(gene)
+    if not rows:
+        return "NM"
+    if total == 0:
+        return "PM"
+    phenotype = "NM"
+    for minimum, name in rows:
+        if total >= minimum:
+            phenotype = name
+    return phenotype
+
+
+_TABLES = load_tables()
+
+KB_DATA_VERSION = _TABLES["version"]
+DRUG_GENES = _TABLES["drug_genes"]
+DRUG_GENE_MAP = _TABLES["drug_gene_map"]
+GENE_CHROMOSOMES = _TABLES["gene_windows"]
+STAR_ALLELE_VARIANTS = _TABLES["star_allele_variants"]
+ALLELE_ACTIVITY_SCORES = _TABLES["allele_activity_scores"]
+PHENOTYPE_THRESHOLDS = _TABLES["phenotype_thresholds"]
+CPIC_GUIDELINES = _TABLES["cpic_guidelines"]
+COMBINED_GUIDELINES = _TABLES["combined_guidelines"]
+DRUG_INFO = _TABLES["drug_info"]
+ALLELE_DEFINITIONS = _TABLES["allele_definitions"]
 
-# ── Diplotype → Activity Score → Phenotype rules ──────────────────────────────
-# For each gene, define diplotype classification logic:
-# Activity score approach (CYP2D6 standard):
-# 0 = PM, 0.25-0.75 = IM, 1.0-2.25 = NM, >2.25 = URM
-ALLELE_ACTIVITY_SCORES = {
-    "CYP2D6": {
-        "*1": 1.0, "*2": 1.0, "*10": 0.25, "*17": 0.5, "*41": 0.5, "*29": 0.5,
-        "*3": 0.0, "*4": 0.0, "*5": 0.0, "*6": 0.0, "*8": 0.0,
-        "*1xN": 2.0, "*2xN": 2.0,  # gene duplications → URM
-        "default": 1.0  # unknown = assume *1
-    },
-    "CYP2C9": {
-        "*1": 1.0, "*2": 0.5, "*3": 0.25, "*5": 0.25, "*6": 0.0,
-        "default": 1.0
-    },
-    "CYP2C19": {
-        "*1": 1.0, "*17": 1.5,
-        "*2": 0.0, "*3": 0.0, "*4": 0.0, "*35": 0.0,
-        "default": 1.0
-    },
-    "SLCO1B1": {
-        "*1a": 1.0, "*1b": 1.0, "*5": 0.0, "*14": 0.5,
-        "default": 1.0
-    },
-    "TPMT": {
-        "*1": 1.0, "*2": 0.0, "*3A": 0.0, "*3B": 0.0, "*3C": 0.0,
-        "default": 1.0
-    },
-    "DPYD": {
-        "wt": 1.0, "*2A": 0.0, "*13": 0.0, "c.2846A>T": 0.5, "c.1627A>G": 0.5,
-        "default": 1.0
-    },
-}
 
 def activity_score_to_phenotype(gene: str, allele1: str, allele2: str) -> str:
     """Convert two alleles into phenotype using activity scores."""
     scores = ALLELE_ACTIVITY_SCORES.get(gene, {})
     s1 = scores.get(allele1, scores.get("default", 1.0))
     s2 = scores.get(allele2, scores.get("default", 1.0))
-    total = s1 + s2
+    return phenotype_for_score(PHENOTYPE_THRESHOLDS, gene, s1 + s2)
 
-    if gene == "CYP2D6":
-        if total == 0: return "PM"
-        elif total < 1.25: return "IM"
-        elif total >= 2.25: return "URM"
-        else: return "NM"
 
-    elif gene == "CYP2C19":
-        if total == 0: return "PM"
-        elif 0 < total < 1.0: return "IM"
-        elif total >= 2.5: return "URM"
-        elif total >= 1.5: return "RM"
-        else: return "NM"
+def diplotype_string(allele1: str, allele2: str) -> str:
+    return f"{allele1}/{allele2}"
 
-    elif gene in ("CYP2C9", "SLCO1B1", "TPMT", "DPYD"):
-        if total == 0: return "PM"
-        elif total < 1.0: return "IM"
-        else: return "NM"
 
-    return "NM"
+# ── Compiled lookup tables ────────────────────────────────────────────────────
+PHENOTYPE_CODES = ("PM", "IM", "NM", "RM", "URM", "Unknown")
 
+DEFAULT_RULE = {
+    "risk": "Unknown",
+    "severity": "none",
+    "recommendation": "No CPIC guideline available for this phenotype.",
+    "mechanism": "See CPIC website for latest guidance."
+}
 
-def diplotype_string(allele1: str, allele2: str) -> str:
-    return f"{allele1}/{allele2}"
 
+class CompiledKnowledgeBase:
+    """
+    Immutable lookups compiled once from one set of tables:
+      (gene, allele1, allele2) → (phenotype, activity score)
+      (drug, phenotype)        → CPIC rule (NM / default fallback already applied)
+      (drug, (phenotype, ...)) → rule for a multi-gene drug, one phenotype per
+                                 gene in ``drug_genes`` order
+    The allele space per gene and the phenotype space per drug are small, so
+    every pair and every phenotype combination is precomputed; phenotyping
+    and rule resolution are each a single dict hit per request.
 
-# ── CPIC Guidelines — Complete Coverage ───────────────────────────────────────
-CPIC_GUIDELINES = {
-    "CODEINE": {
-        "URM": {
-            "risk": "Toxic",
-            "severity": "critical",
-            "recommendation": (
-                "AVOID CODEINE. Ultra-rapid CYP2D6 metabolism converts codeine to morphine "
-                "at dangerously high rates. Risk of life-threatening respiratory depression and "
-                "morphine toxicity. Select an alternative opioid (e.g., morphine, oxycodone) "
-                "NOT metabolized by CYP2D6."
-            ),
-            "mechanism": "CYP2D6 URM phenotype causes excessive O-demethylation of codeine to morphine. Plasma morphine concentrations can reach 50x normal, causing respiratory depression, coma, or death.",
-        },
-        "PM": {
-            "risk": "Ineffective",
-            "severity": "high",
-            "recommendation": (
-                "AVOID CODEINE. Poor CYP2D6 metabolism means codeine cannot be converted "
-                "to its active metabolite morphine. No analgesic benefit expected. "
-                "Select a non-CYP2D6 metabolized opioid (e.g., oxymorphone, buprenorphine)."
-            ),
-            "mechanism": "CYP2D6 PM phenotype prevents O-demethylation of codeine to morphine (active metabolite). Patient receives no analgesia.",
-        },
-        "IM": {
-            "risk": "Adjust Dosage",
-            "severity": "moderate",
-            "recommendation": (
-                "Use codeine with caution. Intermediate metabolism results in reduced but "
-                "variable morphine production. Monitor pain control effectiveness. "
-                "Consider alternative if pain is not controlled."
-            ),
-            "mechanism": "Reduced CYP2D6 activity leads to subtherapeutic morphine levels in most cases.",
-        },
-        "NM": {
-            "risk": "Safe",
-            "severity": "none",
-            "recommendation": "Use standard codeine dose per label. Normal analgesic response expected.",
-            "mechanism": "Normal CYP2D6 activity converts codeine to morphine at expected rates.",
-        },
-        "RM": {
-            "risk": "Adjust Dosage",
-            "severity": "moderate",
-            "recommendation": "Monitor for increased morphine effect. Consider reduced dose.",
-            "mechanism": "Slightly elevated CYP2D6 activity may lead to higher-than-expected morphine levels.",
-        },
-    },
-
-    "WARFARIN": {
-        "PM": {
-            "risk": "Toxic",
-            "severity": "high",
-            "recommendation": (
-                "START with significantly lower warfarin dose (typically 30-50% reduction). "
-                "INR target weekly or more frequently. Use clinical decision support algorithms "
-                "(IWPC, EU-PACT) incorporating CYP2C9 genotype for personalized dosing."
-            ),
-            "mechanism": "CYP2C9 PM reduces S-warfarin (more potent enantiomer) clearance by >80%. Drug accumulates causing supratherapeutic INR and hemorrhage risk.",
-        },
-        "IM": {
-            "risk": "Adjust Dosage",
-            "severity": "moderate",
-            "recommendation": (
-                "Consider lower starting warfarin dose (20-30% reduction). "
-                "More frequent INR monitoring especially in first 4 weeks. "
-                "Titrate carefully to therapeutic INR (2.0-3.0)."
-            ),
-            "mechanism": "Reduced CYP2C9 activity leads to higher warfarin exposure. *2 reduces activity to ~12% of *1/*1.",
-        },
-        "NM": {
-            "risk": "Safe",
-            "severity": "none",
-            "recommendation": "Standard warfarin dosing per CPIC algorithm. Target INR 2.0-3.0. Standard monitoring schedule.",
-            "mechanism": "Normal CYP2C9 activity maintains expected warfarin clearance.",
-        },
-    },
-
-    "CLOPIDOGREL": {
-        "PM": {
-            "risk": "Ineffective",
-            "severity": "high",
-            "recommendation": (
-                "AVOID CLOPIDOGREL. Two loss-of-function CYP2C19 alleles severely impair "
-                "bioactivation. Use prasugrel or ticagrelor as alternatives. "
-                "Prasugrel preferred in ACS with PCI (check for bleeding risk contraindications)."
-            ),
-            "mechanism": "CYP2C19 PM (*2/*2, *2/*3) reduces clopidogrel active thienopyridine formation by >70%. High platelet reactivity and major adverse cardiovascular events (MACE) risk.",
-        },
-        "IM": {
-            "risk": "Ineffective",
-            "severity": "moderate",
-            "recommendation": (
-                "Consider alternative antiplatelet (prasugrel, ticagrelor) especially for ACS/PCI. "
-                "One loss-of-function allele still reduces active metabolite formation significantly. "
-                "If clopidogrel must be used, monitor platelet function if available."
-            ),
-            "mechanism": "Single CYP2C19 loss-of-function allele reduces active metabolite by ~30-40%. Increased but less severe platelet reactivity.",
-        },
-        "NM": {
-            "risk": "Safe",
-            "severity": "none",
-            "recommendation": "Standard clopidogrel dosing. Normal antiplatelet response expected.",
-            "mechanism": "Normal CYP2C19 bioactivation of clopidogrel prodrug.",
-        },
-        "RM": {
-            "risk": "Safe",
-            "severity": "none",
-            "recommendation": "Standard clopidogrel dosing. Enhanced bioactivation, monitor for bleeding.",
-            "mechanism": "CYP2C19*17 increases active metabolite formation. Potentially enhanced antiplatelet effect.",
-        },
-        "URM": {
-            "risk": "Adjust Dosage",
-            "severity": "low",
-            "recommendation": "Monitor for increased bleeding risk. Standard dose typically appropriate.",
-            "mechanism": "Enhanced clopidogrel bioactivation may increase active metabolite exposure.",
-        },
-    },
-
-    "SIMVASTATIN": {
-        "PM": {
-            "risk": "Toxic",
-            "severity": "high",
-            "recommendation": (
-                "AVOID SIMVASTATIN 40mg or higher. SLCO1B1*5/*5 homozygous dramatically "
-                "reduces hepatic uptake, increasing systemic simvastatin exposure. "
-                "If statin required: use pravastatin or rosuvastatin (not SLCO1B1-dependent). "
-                "Alternatively, simvastatin ≤20mg with intensive CK monitoring."
-            ),
-            "mechanism": "SLCO1B1 PM (*5/*5) reduces hepatic organic anion transporter (OATP1B1) function, increasing systemic simvastatin acid AUC by ~220%. Severe myopathy and rhabdomyolysis risk.",
-        },
-        "IM": {
-            "risk": "Adjust Dosage",
-            "severity": "moderate",
-            "recommendation": (
-                "AVOID SIMVASTATIN 80mg. Use maximum dose of 20mg with monitoring. "
-                "Consider rosuvastatin or pravastatin for equivalent LDL-reduction with less risk. "
-                "Monitor CK levels at baseline and 6-12 weeks."
-            ),
-            "mechanism": "One SLCO1B1*5 allele increases simvastatin AUC by ~60-100%, moderately elevating myopathy risk especially at doses ≥40mg.",
-        },
-        "NM": {
-            "risk": "Safe",
-            "severity": "none",
-            "recommendation": "Standard simvastatin dosing per clinical guidelines. Maximum 40mg/day per FDA guidance.",
-            "mechanism": "Normal OATP1B1 transport function maintains expected hepatic uptake and systemic exposure.",
-        },
-    },
-
-    "AZATHIOPRINE": {
-        "PM": {
-            "risk": "Toxic",
-            "severity": "critical",
-            "recommendation": (
-                "CONTRAINDICATED at standard doses. TPMT PM phenotype leads to extreme accumulation "
-                "of toxic thioguanine nucleotides (TGNs). Risk of life-threatening hematopoietic toxicity. "
-                "If azathioprine/6-MP is required: reduce dose to 10% of normal (e.g., 10mg/day) with "
-                "weekly CBC monitoring. Consider mycophenolate as alternative."
-            ),
-            "mechanism": "TPMT PM (*2/*2, *3A/*3A, *3C/*3C) cannot inactivate thiopurine via S-methylation. All drug shunted to cytotoxic TGN pathway. Myelosuppression in first 2-4 weeks.",
-        },
-        "IM": {
-            "risk": "Adjust Dosage",
-            "severity": "moderate",
-            "recommendation": (
-                "Start with 30-70% of standard dose. Monitor CBC every 2 weeks for first 2 months, "
-                "then monthly. Target TGN levels 235-450 pmol/8x10^8 RBC if measurable. "
-                "Reduce dose or discontinue if WBC <3000 cells/μL."
-            ),
-            "mechanism": "Single TPMT loss-of-function allele reduces enzyme activity by ~50%. Intermediate TGN accumulation. Risk of delayed myelosuppression.",
-        },
-        "NM": {
-            "risk": "Safe",
-            "severity": "none",
-            "recommendation": "Standard azathioprine dosing per clinical indication. CBC at baseline and at 1-3 months.",
-            "mechanism": "Normal TPMT activity efficiently inactivates thiopurines via methylation pathway.",
-        },
-    },
-
-    "FLUOROURACIL": {
-        "PM": {
-            "risk": "Toxic",
-            "severity": "critical",
-            "recommendation": (
-                "CONTRAINDICATED. DPYD PM (*2A/*2A) blocks >80% of 5-FU catabolism. "
-                "Even standard doses cause severe and potentially fatal toxicity (neutropenia, "
-                "mucositis, diarrhea, hand-foot syndrome, neurotoxicity). "
-                "Select an alternative non-fluoropyrimidine chemotherapy regimen."
-            ),
-            "mechanism": "DPYD enzyme (dihydropyrimidine dehydrogenase) is responsible for ~80% of 5-FU degradation. PM phenotype causes massive systemic 5-FU accumulation with catastrophic multi-organ toxicity.",
-        },
-        "IM": {
-            "risk": "Adjust Dosage",
-            "severity": "high",
-            "recommendation": (
-                "Reduce 5-FU/capecitabine starting dose by 50%. Monitor closely for toxicity (CBC, "
-                "diarrhea, stomatitis). If grade 1-2 toxicity, proceed cautiously with escalation "
-                "based on tolerability. DPYD*2A heterozygotes can often tolerate reduced doses."
-            ),
-            "mechanism": "One DPYD loss-of-function allele halves catabolism capacity. 5-FU exposure approximately doubles, causing severe but often manageable toxicity with dose reduction.",
-        },
-        "NM": {
-            "risk": "Safe",
-            "severity": "none",
-            "recommendation": "Standard 5-FU/capecitabine dosing per oncology protocol. Normal toxicity monitoring.",
-            "mechanism": "Normal DPYD activity (~80% of 5-FU catabolized in liver) maintains expected drug exposure.",
-        },
-    },
-}
+    The source tables are kept alongside (``drug_genes``, ``star_alleles``,
+    ``gene_windows``, ``drug_info``, ...) so one instance is a complete,
+    self-consistent knowledge base that can be swapped in as a unit.
 
-# ── Extended drug info for frontend display ────────────────────────────────────
-DRUG_INFO = {
-    "CODEINE": {
-        "class": "Opioid Analgesic",
-        "mechanism_short": "Prodrug converted to morphine via CYP2D6",
-        "cpic_tier": "A",
-        "cpic_url": "https://cpicpgx.org/guidelines/cpic-guideline-for-codeine-and-cyp2d6/",
-        "common_uses": "Mild-moderate pain, cough suppression",
-    },
-    "WARFARIN": {
-        "class": "Vitamin K Antagonist Anticoagulant",
-        "mechanism_short": "Inhibits VKORC1; metabolism via CYP2C9 (S-form)",
-        "cpic_tier": "A",
-        "cpic_url": "https://cpicpgx.org/guidelines/guideline-for-warfarin-and-cyp2c9-and-vkorc1/",
-        "common_uses": "DVT prophylaxis, atrial fibrillation, mechanical heart valves",
-    },
-    "CLOPIDOGREL": {
-        "class": "P2Y12 Antiplatelet",
-        "mechanism_short": "Prodrug activated by CYP2C19 to irreversible P2Y12 blocker",
-        "cpic_tier": "A",
-        "cpic_url": "https://cpicpgx.org/guidelines/guideline-for-clopidogrel-and-cyp2c19/",
-        "common_uses": "Acute coronary syndrome, PCI, stroke prevention",
-    },
-    "SIMVASTATIN": {
-        "class": "HMG-CoA Reductase Inhibitor (Statin)",
-        "mechanism_short": "Hepatic uptake via OATP1B1 (SLCO1B1); cholesterol lowering",
-        "cpic_tier": "A",
-        "cpic_url": "https://cpicpgx.org/guidelines/guideline-for-simvastatin-and-slco1b1/",
-        "common_uses": "Hypercholesterolemia, cardiovascular risk reduction",
-    },
-    "AZATHIOPRINE": {
-        "class": "Thiopurine Immunosuppressant",
-        "mechanism_short": "Converted to active thioguanine nucleotides; inactivated by TPMT",
-        "cpic_tier": "A",
-        "cpic_url": "https://cpicpgx.org/guidelines/guideline-for-azathioprine-and-tpmt-and-nudt15/",
-        "common_uses": "Inflammatory bowel disease, organ transplant, autoimmune disorders",
-    },
-    "FLUOROURACIL": {
-        "class": "Fluoropyrimidine Antineoplastic",
-        "mechanism_short": "Pyrimidine analog; 80% catabolized by DPYD in liver",
-        "cpic_tier": "A",
-        "cpic_url": "https://cpicpgx.org/guidelines/cpic-guideline-for-fluoropyrimidines-and-dpyd/",
-        "common_uses": "Colorectal, breast, head and neck cancers; also capecitabine prodrug",
-    },
-}
+    ``version`` is the data file's declared version plus a content hash of
+    the tables, so any edit yields a new version that downstream caches can
+    key on.
+    """
+
+    def __init__(self, allele_scores, star_alleles, guidelines, *, drug_gene_map=None,
+                 gene_windows=None, thresholds=None, drug_info=None, data_version=None,
+                 allele_definitions=None, drug_genes=None, combined_guidelines=None):
+        self.allele_scores = allele_scores
+        self.star_alleles = star_alleles
+        self.guidelines = guidelines
+        if drug_genes is None:
+            drug_genes = DRUG_GENES if drug_gene_map is None else {d: (g,) for d, g in drug_gene_map.items()}
+        self.drug_genes = drug_genes
+        self.drug_gene_map = {d: genes[0] for d, genes in drug_genes.items()} if drug_gene_map is None else drug_gene_map
+        self.genes = tuple(dict.fromkeys(g for genes in drug_genes.values() for g in genes))
+        self.combined_guidelines = COMBINED_GUIDELINES if combined_guidelines is None else combined_guidelines
+        self.gene_windows = GENE_CHROMOSOMES if gene_windows is None else gene_windows
+        self.thresholds = PHENOTYPE_THRESHOLDS if thresholds is None else thresholds
+        self.drug_info = DRUG_INFO if drug_info is None else drug_info
+        self.data_version = KB_DATA_VERSION if data_version is None else data_version
+        self.allele_definitions = ALLELE_DEFINITIONS if allele_definitions is None else allele_definitions
+        digest = hashlib.sha256(json.dumps(
+            [allele_scores, star_alleles, guidelines, self.drug_genes, self.gene_windows, self.thresholds,
+             self.allele_definitions, self.combined_guidelines],
+            sort_keys=True, default=list,
+        ).encode("utf-8")).hexdigest()[:12]
+        self.version = f"{self.data_version}+{digest}"
+
+        phenotypes = {}
+        for gene, scores in allele_scores.items():
+            alleles = {a for a in scores if a != "default"} | {"*1"}
+            alleles |= {star for g, star, _ in star_alleles.values() if g == gene}
+            alleles |= set(self.allele_definitions.get(gene, ()))
+            for a1 in alleles:
+                for a2 in alleles:
+                    phenotypes[(gene, a1, a2)] = self._compute_phenotype(gene, a1, a2)
+        self._phenotypes = phenotypes
+        self.phenotypes = MappingProxyType(phenotypes)
+
+        rules = {}
+        for drug, drug_rules in guidelines.items():
+            fallback = drug_rules.get("NM", DEFAULT_RULE)
+            for code in PHENOTYPE_CODES:
+                rules[(drug, code)] = MappingProxyType(dict(drug_rules.get(code, fallback)))
+        self._rules = rules
+        self.rules = MappingProxyType(rules)
+        self._default_rule = MappingProxyType(dict(DEFAULT_RULE))
+
+        drug_rules = {}
+        rule_genes = {}
+        for drug, genes in self.drug_genes.items():
+            if len(genes) < 2:
+                continue
+            combined = []
+            for rule in self.combined_guidelines.get(drug, ()):
+                allowed = [rule["phenotypes"].get(g) for g in genes]
+                combined.append((
+                    allowed,
+                    MappingProxyType({f: rule[f] for f in ("risk", "severity", "recommendation", "mechanism")}),
+                    tuple(i for i, a in enumerate(allowed) if i == 0 or a is not None),
+                ))
+            for codes in product(PHENOTYPE_CODES, repeat=len(genes)):
+                match = next((m for m in combined if all(a is None or c in a for a, c in zip(m[0], codes))), None)
+                if match is None:
+                    drug_rules[(drug, codes)] = rules.get((drug, codes[0]), self._default_rule)
+                else:
+                    _, drug_rules[(drug, codes)], rule_genes[(drug, codes)] = match
+        self._drug_rules = drug_rules
+        self._rule_genes = rule_genes
+
+    @classmethod
+    def from_tables(cls, tables: Dict[str, Any]) -> "CompiledKnowledgeBase":
+        return cls(
+            tables["allele_activity_scores"], tables["star_allele_variants"], tables["cpic_guidelines"],
+            drug_gene_map=tables["drug_gene_map"], gene_windows=tables["gene_windows"],
+            thresholds=tables["phenotype_thresholds"], drug_info=tables["drug_info"],
+            data_version=tables["version"], allele_definitions=tables["allele_definitions"],
+            drug_genes=tables["drug_genes"], combined_guidelines=tables["combined_guidelines"],
+        )
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "CompiledKnowledgeBase":
+        """Load and compile a data file; raises (OSError / ValueError) without side effects."""
+        return cls.from_tables(load_tables(path))
+
+    def _compute_phenotype(self, gene, allele1, allele2):
+        scores = self.allele_scores.get(gene, {})
+        s1 = scores.get(allele1, scores.get("default", 1.0))
+        s2 = scores.get(allele2, scores.get("default", 1.0))
+        return phenotype_for_score(self.thresholds, gene, s1 + s2), round(s1 + s2, 2)
+
+    def phenotype(self, gene: str, allele1: str, allele2: str):
+        """(phenotype, activity score) for a diplotype."""
+        hit = self._phenotypes.get((gene, allele1, allele2))
+        if hit is None:
+            # Allele outside the compiled table (e.g. novel call): compute directly
+            return self._compute_phenotype(gene, allele1, allele2)
+        return hit
+
+    def rule(self, drug: str, phenotype: str):
+        """CPIC rule for a drug/phenotype pair."""
+        return self._rules.get((drug, phenotype), self._default_rule)
+
+    def drug_rule(self, drug: str, phenotypes: Tuple[str, ...]):
+        """
+        Rule for a drug given one phenotype per gene of ``drug_genes[drug]``:
+        the first matching combined rule, else the primary gene's CPIC rule.
+        """
+        if len(phenotypes) == 1:
+            return self._rules.get((drug, phenotypes[0]), self._default_rule)
+        hit = self._drug_rules.get((drug, phenotypes))
+        if hit is None:
+            return self.rule(drug, phenotypes[0])
+        return hit
+
+    def rule_genes(self, drug: str, phenotypes: Tuple[str, ...]) -> Tuple[int, ...]:
+        """
+        Positions in ``drug_genes[drug]`` whose calls chose drug_rule's
+        result: the primary gene, plus the genes a matching combined rule
+        names. A secondary gene that only fell through to the primary
+        gene's rule is not among them.
+        """
+        return self._rule_genes.get((drug, phenotypes), (0,))
+
+
+COMPILED_KB = CompiledKnowledgeBase.from_tables(_TABLES)
@@ -3,23 +3,104 @@ PharmaGuard LLM Service — Gemini AI Integration
 ================================================
 Generates detailed, CPIC-aligned clinical explanations using Google Gemini.
 Falls back to rich template-based explanations if Gemini is unavailable.
+
+Constructing the service is cheap: the Gemini SDK is imported and the client
+configured by ``initialize()``, which the app runs on a worker thread at
+startup (``start_warmup``) so deterministic endpoints serve immediately.
 """
 import os
 import json
-from typing import List, Dict
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Dict, Optional, Sequence, Tuple
+
+from explanation_store import ExplanationStore, explanation_key
+from metrics import LLM_CALLS
+
+
+def secondary_gene_calls(prediction: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    """(gene, diplotype, phenotype) of each non-primary gene call in a prediction."""
+    return [(c.gene, f"{c.allele1}/{c.allele2}", c.phenotype) for c in prediction.get("gene_calls", [])[1:]]
 
 
 class LLMService:
     def __init__(self):
         self.api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
         self.model = None
+        self.model_name = "gemini-1.5-flash"
+        self.store: Optional[ExplanationStore] = None
+
+        # Async path: per-call timeout, in-flight cap and a bounded thread pool
+        # for SDKs without a native async call.
+        self.timeout = float(os.getenv("PHARMAGUARD_LLM_TIMEOUT", "15"))
+        self.max_concurrency = int(os.getenv("PHARMAGUARD_LLM_CONCURRENCY", "8"))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="llm"
+        )
+        self._semaphore = None
+        self._semaphore_loop = None
+
+        # gemini (default) | fake (local stand-in, see fake_llm.py) | none (templates only)
+        self.backend = os.getenv("PHARMAGUARD_LLM_BACKEND", "gemini").strip().lower()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        self._warmup = None
+        self._warmup_loop = None
+        if not self.configured:
+            # Nothing to import; settle the template-only state now
+            self.initialize()
+
+    @property
+    def configured(self) -> bool:
+        """True if initialize() will try to create a model."""
+        return self.backend == "fake" or (self.backend == "gemini" and bool(self.api_key))
 
-        if self.api_key:
+    @property
+    def warming(self) -> bool:
+        """A model is configured but initialize() has not finished yet."""
+        return self.configured and not self._initialized
+
+    def initialize(self) -> None:
+        """Import the SDK and create the client. Blocking and idempotent."""
+        with self._init_lock:
+            if self._initialized:
+                return
+            try:
+                self._create_model()
+            finally:
+                self._initialized = True
+
+    def start_warmup(self) -> "asyncio.Future":
+        """Run initialize() on a worker thread; returns an awaitable for this loop."""
+        loop = asyncio.get_running_loop()
+        if self._warmup is None or self._warmup_loop is not loop:
+            self._warmup = loop.run_in_executor(None, self.initialize)
+            self._warmup_loop = loop
+        return self._warmup
+
+    async def ready(self) -> None:
+        """Wait for warmup (starting it if needed) before the first LLM call."""
+        if self.warming:
+            await self.start_warmup()
+
+    def _create_model(self) -> None:
+        if self.backend == "fake":
+            from fake_llm import FakeGeminiModel
+            self.model = FakeGeminiModel.from_env()
+            self.model_name = "fake-gemini"
+            self.store = ExplanationStore.from_env()
+            print(f"[LLMService] ⚠ Using fake Gemini backend (latency {self.model.latency_spec})")
+        elif self.backend == "none":
+            print("[LLMService] ℹ LLM backend disabled. Using enhanced template explanations.")
+        elif self.api_key:
             try:
                 import google.generativeai as genai
                 genai.configure(api_key=self.api_key)
-                self.model = genai.GenerativeModel("gemini-1.5-flash")
-                print("[LLMService] ✓ Gemini AI initialized (gemini-1.5-flash)")
+                self.model = genai.GenerativeModel(self.model_name)
+                print(f"[LLMService] ✓ Gemini AI initialized ({self.model_name})")
+                # Only Gemini output is worth persisting; templates are free
+                self.store = ExplanationStore.from_env()
             except ImportError:
                 print("[LLMService] ⚠ google-generativeai not installed. Run: pip install google-generativeai")
             except Exception as e:
@@ -38,24 +119,150 @@ class LLMService:
         mechanism: str,
         diplotype: str = "*1/*1",
         activity_score: float = 2.0,
+        use_llm: bool = True,
+        secondary_genes: Sequence[Tuple[str, str, str]] = (),
     ) -> Dict:
         """
         Generate clinical explanation.
-        Uses Gemini if available, otherwise rich template fallback.
+        Uses Gemini if available (and use_llm), otherwise rich template fallback.
+        ``secondary_genes`` are the (gene, diplotype, phenotype) calls of the
+        drug's other genes, which the combined CPIC rule also depends on.
         """
-        if self.model:
-            return self._generate_with_gemini(
-                drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score
-            )
+        args = (drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score,
+                tuple(secondary_genes))
+        if use_llm and self.warming:
+            self.initialize()
+        if self.model and use_llm:
+            return self._generate_with_gemini(*args)
         else:
-            return self._generate_template(
-                drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score
-            )
+            return self._generate_template(*args)
 
-    def _generate_with_gemini(
-        self, drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score
+    async def generate_explanation_async(
+        self,
+        drug: str,
+        gene: str,
+        phenotype: str,
+        risk: str,
+        variants: List[Dict],
+        recommendation: str,
+        mechanism: str,
+        diplotype: str = "*1/*1",
+        activity_score: float = 2.0,
+        secondary_genes: Sequence[Tuple[str, str, str]] = (),
     ) -> Dict:
-        """Use Gemini to generate a clinical-quality explanation."""
+        """
+        Non-blocking variant of generate_explanation for the request path.
+        Uses the SDK's async call when available, otherwise a bounded thread
+        pool. Calls are capped at max_concurrency (a timed-out thread call
+        holds its slot until it returns) and fall back to the template after
+        `timeout` seconds.
+        """
+        explanation, _ = await self.explain_async(
+            drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score,
+            secondary_genes,
+        )
+        return explanation
+
+    async def explain_async(
+        self, drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype="*1/*1",
+        activity_score=2.0, secondary_genes=(),
+    ) -> Tuple[Dict, bool]:
+        """
+        generate_explanation_async plus whether the result is a fallback: the
+        template served because a configured LLM timed out or failed, which
+        callers should not keep as if it were the real explanation.
+        """
+        args = (drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score,
+                tuple(secondary_genes))
+        await self.ready()
+        if not self.model:
+            return self._generate_template(*args), False
+
+        prompt, variant_rsids = self._build_prompt(*args)
+        key = self._store_key(*args)
+        stored = self._store_get(key)
+        if stored is not None:
+            LLM_CALLS.inc("stored")
+            return stored, False
+        try:
+            response = await self._call_model(prompt)
+            explanation = self._parse_response(response, variant_rsids)
+            LLM_CALLS.inc("generated")
+            return self._store_put(key, explanation), False
+        except asyncio.TimeoutError:
+            LLM_CALLS.inc("timeout")
+            print(f"[LLMService] Gemini call timed out after {self.timeout}s. Using template fallback.")
+        except Exception as e:
+            LLM_CALLS.inc("error")
+            print(f"[LLMService] Gemini call failed: {e}. Using template fallback.")
+        return self._generate_template(*args), True
+
+    def _store_key(
+        self, drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score,
+        secondary_genes=(),
+    ) -> str:
+        variant_rsids = [v.get("rsid", "?") for v in variants] if variants else []
+        return explanation_key(self.model_name, drug, gene, phenotype, risk, diplotype,
+                               activity_score, variant_rsids, recommendation, mechanism, secondary_genes)
+
+    def _store_get(self, key: str) -> Optional[Dict]:
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(key)
+        except Exception as e:
+            print(f"[LLMService] Explanation store read failed: {e}")
+            return None
+
+    def _store_put(self, key: str, explanation: Dict) -> Dict:
+        if self.store is not None:
+            try:
+                self.store.put(key, self.model_name, explanation)
+            except Exception as e:
+                print(f"[LLMService] Explanation store write failed: {e}")
+        return explanation
+
+    async def _call_model(self, prompt: str):
+        """
+        One Gemini call under the concurrency cap. Waiting for a slot counts
+        against the timeout, so a saturated backend fails fast to the template.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        semaphore = self._get_semaphore()
+        await asyncio.wait_for(semaphore.acquire(), timeout=self.timeout)
+        generate_async = getattr(self.model, "generate_content_async", None)
+        if generate_async is not None:
+            # Cancelling the coroutine on timeout ends the request, so the slot is free again
+            try:
+                return await asyncio.wait_for(generate_async(prompt), timeout=max(deadline - loop.time(), 0))
+            finally:
+                semaphore.release()
+
+        # A worker thread cannot be cancelled: a timed-out call keeps its slot
+        # until the thread returns, so the cap bounds real outbound calls and
+        # the executor never queues more than max_concurrency jobs
+        try:
+            call = loop.run_in_executor(self._executor, self.model.generate_content, prompt)
+        except BaseException:
+            semaphore.release()
+            raise
+        call.add_done_callback(lambda f: (semaphore.release(), f.cancelled() or f.exception()))
+        return await asyncio.wait_for(asyncio.shield(call), timeout=max(deadline - loop.time(), 0))
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # One semaphore per event loop (test clients and workers may each run their own)
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def _build_prompt(
+        self, drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score,
+        secondary_genes=(),
+    ) -> tuple:
+        """Gemini prompt plus the cited RSIDs."""
         phenotype_names = {
             "PM": "Poor Metabolizer", "IM": "Intermediate Metabolizer",
             "NM": "Normal Metabolizer", "RM": "Rapid Metabolizer",
@@ -64,12 +271,19 @@ class LLMService:
         pheno_full = phenotype_names.get(phenotype, phenotype)
         variant_rsids = [v.get("rsid", "?") for v in variants] if variants else []
         variant_str = ", ".join(variant_rsids) if variant_rsids else "none detected (wild-type)"
+        # The risk and recommendation come from the combined rule over all of the drug's genes
+        other_genes = "".join(
+            f"\n- Also in this drug's CPIC rule: {g} | Diplotype: {d} | "
+            f"Phenotype: {phenotype_names.get(p, p)} ({p})"
+            for g, d, p in secondary_genes
+        )
+        genes_str = " and ".join([gene] + [g for g, _, _ in secondary_genes])
 
         prompt = f"""You are a clinical pharmacogenomics expert specializing in CPIC guidelines.
 
 Generate a structured pharmacogenomics report for:
 - Patient Diplotype: {diplotype} (Activity Score: {activity_score})
-- Gene: {gene} | Phenotype: {pheno_full} ({phenotype})
+- Gene: {gene} | Phenotype: {pheno_full} ({phenotype}){other_genes}
 - Drug: {drug} | Risk: {risk}
 - Detected Variants (RSIDs): {variant_str}
 - Mechanism: {mechanism}
@@ -77,31 +291,50 @@ Generate a structured pharmacogenomics report for:
 
 Respond ONLY with valid JSON in this exact format:
 {{
-  "summary": "2-3 sentence clinical summary for a physician. State the phenotype, drug risk, and key action. Be specific about {drug} and {gene}.",
+  "summary": "2-3 sentence clinical summary for a physician. State the phenotype, drug risk, and key action. Be specific about {drug} and {genes_str}.",
   "biological_mechanism": "3-4 sentences explaining the molecular mechanism. Include enzyme/transporter name, metabolic pathway, what the variant(s) do to protein function, and why that causes {risk} risk for {drug}.",
   "variant_citations": {json.dumps(variant_rsids)},
   "confidence_reasoning": "1-2 sentences explaining confidence in this classification based on the available variant data."
 }}"""
+        return prompt, variant_rsids
+
+    def _parse_response(self, response, variant_rsids: List[str]) -> Dict:
+        text = response.text.strip()
+        # Clean markdown code fences if present
+        if text.startswith("```"):
+            text = text[text.find("{"):text.rfind("}")+1]
+        result = json.loads(text)
+        # Ensure all keys exist
+        result.setdefault("variant_citations", variant_rsids)
+        result.setdefault("confidence_reasoning", "Based on CPIC guideline evidence and detected variant data.")
+        return result
 
+    def _generate_with_gemini(
+        self, drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score,
+        secondary_genes=(),
+    ) -> Dict:
+        """Use Gemini to generate a clinical-quality explanation."""
+        args = (drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score,
+                secondary_genes)
+        prompt, variant_rsids = self._build_prompt(*args)
+        key = self._store_key(*args)
+        stored = self._store_get(key)
+        if stored is not None:
+            LLM_CALLS.inc("stored")
+            return stored
         try:
             response = self.model.generate_content(prompt)
-            text = response.text.strip()
-            # Clean markdown code fences if present
-            if text.startswith("```"):
-                text = text[text.find("{"):text.rfind("}")+1]
-            result = json.loads(text)
-            # Ensure all keys exist
-            result.setdefault("variant_citations", variant_rsids)
-            result.setdefault("confidence_reasoning", "Based on CPIC guideline evidence and detected variant data.")
-            return result
+            explanation = self._parse_response(response, variant_rsids)
+            LLM_CALLS.inc("generated")
+            return self._store_put(key, explanation)
         except Exception as e:
+            LLM_CALLS.inc("error")
             print(f"[LLMService] Gemini call failed: {e}. Using template fallback.")
-            return self._generate_template(
-                drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score
-            )
+            return self._generate_template(*args)
 
     def _generate_template(
-        self, drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score
+        self, drug, gene, phenotype, risk, variants, recommendation, mechanism, diplotype, activity_score,
+        secondary_genes=(),
     ) -> Dict:
         """
         Rich template-based explanation using actual CPIC knowledge.
@@ -143,9 +376,16 @@ Respond ONLY with valid JSON in this exact format:
             f"No pathogenic variants were detected; the {diplotype} (wild-type) diplotype suggests normal enzyme function"
         )
 
+        # The CPIC rule of a multi-gene drug is set by the combination of phenotypes
+        other_genes = "".join(
+            f" and the {d} {g} diplotype ({phenotype_names.get(p, 'Unknown Phenotype')}, {p})"
+            for g, d, p in secondary_genes
+        )
+        basis = "this combination of phenotypes" if secondary_genes else "this metabolizer phenotype"
+
         summary = (
-            f"This patient carries the {diplotype} {gene} diplotype, classifying them as a {pheno_full} (phenotype code: {phenotype}). "
-            f"Based on CPIC Tier-A evidence, {drug} {action} for patients with this metabolizer phenotype. "
+            f"This patient carries the {diplotype} {gene} diplotype, classifying them as a {pheno_full} (phenotype code: {phenotype}){other_genes}. "
+            f"Based on CPIC Tier-A evidence, {drug} {action} for patients with {basis}. "
             f"{'Immediate clinical action is recommended per CPIC guidelines.' if risk in ('Toxic', 'Ineffective') else 'Standard monitoring is recommended.'}"
         )
 
@@ -1,18 +1,50 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+import asyncio
+import os
+import signal
+import threading
+import time
+import zipfile
+import zlib
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from datetime import datetime, timezone
 
-from schemas import AnalysisResult, RiskAssessment, PharmacogenomicProfile
-from schemas import ClinicalRecommendation, LLMExplanation, QualityMetrics, Variant
+from schemas import AnalysisResult, PanelResult, ExplanationJob, ProfileGene, ProfileSummary
 from vcf_parser import VCFParser
-from risk_engine import RiskEngine
-from llm_service import LLMService
-from knowledge_base import DRUG_GENE_MAP, CPIC_GUIDELINES
+from llm_service import LLMService, secondary_gene_calls
+from kb_store import KnowledgeBaseStore
+from cache import LRUCache, genotype_fingerprint
+from jobs import ExplanationJobs
+from patient_profiles import ProfileStore
+from batch import analyze_file, iter_zip_bytes, make_pool, resolve_drugs
+from metrics import REGISTRY, ANALYSES, LLM_CALLS, STAGE_SECONDS, UPLOAD_BYTES
+from metrics import MetricsMiddleware, cache_gauges, stage
+import profiling
+from responses import dumps, encode_analysis, render_analysis, render_panel
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import and configure the Gemini client off the event loop; deterministic
+    # endpoints serve meanwhile and LLM calls wait for it in llm_service.ready()
+    llm_service.start_warmup()
+    # SIGHUP reloads the knowledge base, like POST /admin/knowledge-base/reload
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, _reload_on_signal)
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        pass  # no SIGHUP (Windows) or not the main thread
+    yield
+
 
 app = FastAPI(
     title="PharmaGuard API",
     version="2.0",
-    description="CPIC-aligned pharmacogenomic risk prediction API"
+    description="CPIC-aligned pharmacogenomic risk prediction API",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -22,142 +54,626 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+# Opt-in request profiling; not installed at all unless configured
+profile_token, slow_request_ms, profile_store = profiling.from_env()
+if profile_store is not None:
+    app.add_middleware(profiling.ProfilingMiddleware, store=profile_store,
+                       token=profile_token, slow_ms=slow_request_ms)
 
-risk_engine = RiskEngine()
+knowledge_base = KnowledgeBaseStore()
 llm_service = LLMService()
+analysis_cache = LRUCache(
+    maxsize=int(os.getenv("PHARMAGUARD_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PHARMAGUARD_CACHE_TTL", "3600")),
+)
+# Lifetime of a cached template that replaced a timed-out or failed LLM call
+FALLBACK_CACHE_TTL = float(os.getenv("PHARMAGUARD_CACHE_FALLBACK_TTL", "30"))
+explanation_jobs = ExplanationJobs()
+patient_profiles = ProfileStore.from_env()
+_batch_pool = None
+_batch_pool_users = {}  # pool -> batch streams still submitting to or awaiting it
+_batch_pool_lock = threading.Lock()
+_admin_token = os.getenv("PHARMAGUARD_ADMIN_TOKEN") or None
+_started_at = time.time()
+cache_gauges(REGISTRY, "pharmaguard_analysis_cache", analysis_cache.stats, "Analysis result cache")
+cache_gauges(REGISTRY, "pharmaguard_patient_profiles", patient_profiles.stats, "Patient profile store")
 
+KB_VERSION_HEADER = "X-Knowledge-Base-Version"
 
-@app.post("/analyze", response_model=AnalysisResult)
-async def analyze_genomics(
-    file: UploadFile = File(...),
-    drug: str = Form(...),
-    patient_id: str = Form("PATIENT_001")
-):
-    # 1. Validate file
-    if not file.filename.lower().endswith('.vcf'):
-        raise HTTPException(status_code=400, detail="Invalid file format. Only .vcf files are accepted.")
 
-    content = await file.read()
-    if len(content) > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Maximum size is 5MB.")
+def _on_knowledge_base_reload(previous, current):
+    """
+    Drop results and batch workers built from the previous tables. Batch
+    streams already using the old pool keep it; the last one retires it.
+    """
+    global _batch_pool
+    analysis_cache.clear()
+    with _batch_pool_lock:
+        pool, _batch_pool = _batch_pool, None
+        idle = pool is not None and pool not in _batch_pool_users
+    if idle:
+        pool.shutdown(wait=False)
 
-    drug_upper = drug.upper()
 
-    # 2. Validate drug
-    target_gene = DRUG_GENE_MAP.get(drug_upper)
-    if not target_gene:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Drug '{drug}' is not supported. Supported drugs: {list(DRUG_GENE_MAP.keys())}"
-        )
+knowledge_base.on_reload(_on_knowledge_base_reload)
 
-    # 3. Parse VCF
-    parser = VCFParser(content)
-    vcf_valid = parser.validate()
-    all_variants = parser.parse()
-
-    # 4. Risk Prediction (engine handles gene filtering internally)
-    prediction = risk_engine.predict_risk(drug_upper, all_variants)
-
-    # 5. Get gene-specific variants from prediction result
-    gene_variants = prediction.get("gene_variants", [])
-
-    # 6. Build diplotype string from alleles
-    allele1 = prediction.get("allele1", "*1")
-    allele2 = prediction.get("allele2", "*1")
-    diplotype = f"{allele1}/{allele2}"
-    activity_score = prediction.get("activity_score", 2.0)
-
-    # 7. Build monitoring advice from CPIC guideline severity
-    severity = prediction.get("severity", "none")
-    monitoring_map = {
-        "critical": "Immediate clinical review required. Do NOT administer without pharmacogenomics consultation.",
-        "high": "Frequent monitoring required. Adjust dose before initiating therapy.",
-        "moderate": "Monitor for drug response and adverse effects at each clinical visit.",
-        "low": "Routine monitoring per standard of care.",
-        "none": "Standard label monitoring. No additional pharmacogenomics-specific monitoring required.",
-    }
-    monitoring_advice = monitoring_map.get(severity, "Monitor per standard clinical protocol.")
 
-    # 8. LLM Clinical Explanation
-    explanation = llm_service.generate_explanation(
+def _reload_logged():
+    try:
+        knowledge_base.reload()
+    except (OSError, ValueError) as e:
+        print(f"[KnowledgeBase] Reload failed, keeping {knowledge_base.current.version}: {e}")
+
+
+def _reload_on_signal():
+    # Load and compile off the event loop; requests keep serving meanwhile
+    asyncio.get_running_loop().run_in_executor(None, _reload_logged)
+
+
+MAX_UPLOAD_MB = int(os.getenv("PHARMAGUARD_MAX_UPLOAD_MB", "5"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# A BGZF upload sent with its tabix/CSI index is never read whole
+MAX_INDEXED_UPLOAD_MB = int(os.getenv("PHARMAGUARD_MAX_INDEXED_UPLOAD_MB", "4096"))
+MAX_INDEXED_UPLOAD_BYTES = MAX_INDEXED_UPLOAD_MB * 1024 * 1024
+MAX_INDEX_UPLOAD_BYTES = 64 * 1024 * 1024
+# Gzip uploads may inflate to at most this much VCF text
+MAX_INFLATED_MB = int(os.getenv("PHARMAGUARD_MAX_INFLATED_MB", "512"))
+MAX_INFLATED_BYTES = MAX_INFLATED_MB * 1024 * 1024
+MAX_BATCH_MB = int(os.getenv("PHARMAGUARD_MAX_BATCH_MB", "100"))
+MAX_BATCH_BYTES = MAX_BATCH_MB * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+VCF_EXTENSIONS = ('.vcf', '.vcf.gz', '.vcf.bgz')
+
+
+def _upload_parser(kb) -> VCFParser:
+    """Parser for one upload: pharmacogene lines only, inflated size capped."""
+    return VCFParser(targets=kb.targets, max_inflated_bytes=MAX_INFLATED_BYTES)
+
+
+async def _read_capped(file: UploadFile, limit: int) -> Optional[bytes]:
+    """Read a whole upload; None as soon as it passes ``limit`` bytes."""
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        total += len(chunk)
+        if total > limit:
+            return None
+        chunks.append(chunk)
+
+
+async def _stream_vcf_upload(file: UploadFile, parser: VCFParser, kb,
+                             index: Optional[UploadFile] = None) -> list:
+    """
+    Validate the upload's name, then read it in chunks through the parser.
+    The size cap is enforced while reading, and only parsed variant records
+    (never the whole file) are held in memory.
+
+    If a tabix/CSI index accompanies a BGZF upload, only the pharmacogene
+    windows are decompressed.
+    """
+    if not file.filename.lower().endswith(VCF_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Invalid file format. Only .vcf or .vcf.gz files are accepted.")
+    too_large = HTTPException(status_code=400, detail=f"File too large. Maximum size is {MAX_UPLOAD_MB}MB.")
+
+    try:
+        if index is not None:
+            # Only the indexed windows are read, so the file itself may be far
+            # larger than a streamed upload. The client-declared size may be
+            # absent or wrong; measure what was received.
+            size = file.file.seek(0, os.SEEK_END)
+            file.file.seek(0)
+            if size > MAX_INDEXED_UPLOAD_BYTES:
+                raise HTTPException(status_code=400, detail=f"File too large. Maximum size for indexed "
+                                                            f"uploads is {MAX_INDEXED_UPLOAD_MB}MB.")
+            with stage("upload_read"):
+                index_data = await _read_capped(index, MAX_INDEX_UPLOAD_BYTES)
+            if index_data is None:
+                raise HTTPException(status_code=400, detail="Index file too large.")
+            UPLOAD_BYTES.observe(size)
+            with stage("parse"):
+                return list(parser.iter_regions(file.file, index_data, kb.engine.gene_index.regions()))
+
+        variants = []
+        total = 0
+        read_s = parse_s = 0.0
+        clock = time.perf_counter
+        while True:
+            t0 = clock()
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            t1 = clock()
+            read_s += t1 - t0
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > MAX_UPLOAD_BYTES:
+                raise too_large
+            variants.extend(parser.feed(chunk))
+            parse_s += clock() - t1
+        t0 = clock()
+        variants.extend(parser.close())
+        STAGE_SECONDS.observe(read_s, "upload_read")
+        STAGE_SECONDS.observe(parse_s + clock() - t0, "parse")
+        UPLOAD_BYTES.observe(total)
+        return variants
+    except (ValueError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read VCF: {e}")
+
+
+def _unsupported_drug(drug: str, kb) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"Drug '{drug}' is not supported. Supported drugs: {list(kb.kb.drug_gene_map.keys())}"
+    )
+
+
+def _explanation_args(drug_upper: str, target_gene: str, prediction: dict) -> dict:
+    return dict(
         drug=drug_upper,
         gene=target_gene,
         phenotype=prediction['phenotype'],
         risk=prediction['risk'],
-        variants=gene_variants,
+        variants=prediction.get("gene_variants", []),
         recommendation=prediction['recommendation'],
         mechanism=prediction['mechanism'],
-        diplotype=diplotype,
-        activity_score=activity_score,
+        diplotype=f"{prediction.get('allele1', '*1')}/{prediction.get('allele2', '*1')}",
+        activity_score=prediction.get("activity_score", 2.0),
+        secondary_genes=secondary_gene_calls(prediction),
     )
 
-    # 9. Confidence level text
-    confidence = prediction.get("confidence", 0.85)
-    confidence_text = (
-        "High" if confidence >= 0.88
-        else "Moderate" if confidence >= 0.65
-        else "Low"
-    )
 
-    # 10. Build and return result
-    return AnalysisResult(
-        patient_id=patient_id,
-        drug=drug_upper,
-        timestamp=datetime.now(timezone.utc).isoformat(),
-        risk_assessment=RiskAssessment(
-            risk_label=prediction['risk'],
-            confidence_score=confidence,
-            severity=severity,
-        ),
-        pharmacogenomic_profile=PharmacogenomicProfile(
-            primary_gene=target_gene,
-            diplotype=diplotype,
-            phenotype=prediction['phenotype'],
-            detected_variants=[
-                Variant(
-                    rsid=v['rsid'],
-                    chromosome=v['chromosome'],
-                    position=str(v['position']),
-                    reference=v['reference'],
-                    alternate=v['alternate'],
-                ) for v in gene_variants
-            ]
-        ),
-        clinical_recommendation=ClinicalRecommendation(
-            cpic_guideline_reference=f"CPIC Guideline for {drug.title()} and {target_gene} (Tier A)",
-            dose_adjustment=prediction['recommendation'],
-            monitoring_advice=monitoring_advice,
-        ),
-        llm_generated_explanation=LLMExplanation(**explanation),
-        quality_metrics=QualityMetrics(
-            vcf_parsing_success=vcf_valid,
-            missing_annotations=len(gene_variants) == 0,
-            confidence_level=confidence_text,
+async def _explain(drug_upper: str, target_gene: str, prediction: dict) -> tuple:
+    """
+    (LLM clinical explanation, whether it is a template fallback) for a
+    prediction, without blocking the event loop.
+    """
+    return await llm_service.explain_async(**_explanation_args(drug_upper, target_gene, prediction))
+
+
+def _cache_analysis(key: str, prediction: dict, explanation: dict, encoded: bytes, fallback: bool) -> None:
+    # A fallback stands in for an LLM call that timed out or failed; keep it
+    # only briefly (or not at all) so the genotype gets a real explanation later
+    if fallback and FALLBACK_CACHE_TTL <= 0:
+        return
+    analysis_cache.set(key, (prediction, explanation, encoded), ttl=FALLBACK_CACHE_TTL if fallback else None)
+
+
+async def _explain_and_cache(key: str, drug_upper: str, target_gene: str, prediction: dict,
+                             kb_version: str) -> dict:
+    """Background half of a deferred analysis: generate, then cache the pair."""
+    with stage("llm"):
+        explanation, fallback = await _explain(drug_upper, target_gene, prediction)
+    encoded = encode_analysis(drug_upper, target_gene, prediction, explanation, kb_version)
+    _cache_analysis(key, prediction, explanation, encoded, fallback)
+    return explanation
+
+
+async def _analyze_drug(
+    kb,
+    patient_id: str,
+    drug_upper: str,
+    variants_by_gene: dict,
+    gene_calls: dict,
+    vcf_valid: bool,
+    deferred: bool = False,
+) -> bytes:
+    """
+    Score one drug against its genes' variants; returns the encoded
+    AnalysisResult. The prediction and explanation only depend on the
+    genotype, so they are cached (validated and pre-encoded) by genotype
+    fingerprint; patient_id and timestamp are per request.
+
+    ``gene_calls`` is shared by every drug of the request: a gene is called
+    at most once, and only on a cache miss for a drug that needs it.
+
+    With ``deferred``, a cache miss returns straight away with the template
+    explanation and an explanation_job_id to poll for the LLM text.
+
+    ``kb`` is the knowledge-base snapshot the request started with.
+    """
+    genes = kb.kb.drug_genes[drug_upper]
+    target_gene = genes[0]
+    gene_variants = [v for gene in genes for v in variants_by_gene.get(gene, ())]
+    key = genotype_fingerprint(drug_upper, gene_variants, kb.version)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        ANALYSES.inc(drug_upper, "hit")
+        with stage("serialize"):
+            return render_analysis(patient_id, _timestamp(), cached[2], vcf_valid)
+
+    ANALYSES.inc(drug_upper, "miss")
+    with stage("phenotype"):
+        kb.engine.call_genes(variants_by_gene, genes, gene_calls)
+        prediction = kb.engine.predict_risk(drug_upper, [], gene_calls=gene_calls)
+    if deferred and (llm_service.model is not None or llm_service.warming):
+        explanation = llm_service.generate_explanation(
+            **_explanation_args(drug_upper, target_gene, prediction), use_llm=False
         )
+        # Concurrent misses for the same genotype share the job already generating it
+        job_id = explanation_jobs.submit(
+            _explain_and_cache(key, drug_upper, target_gene, prediction, kb.version), key=key)
+        with stage("serialize"):
+            encoded = encode_analysis(drug_upper, target_gene, prediction, explanation, kb.version)
+            return render_analysis(patient_id, _timestamp(), encoded, vcf_valid, job_id)
+
+    with stage("llm"):
+        explanation, fallback = await _explain(drug_upper, target_gene, prediction)
+    with stage("serialize"):
+        encoded = encode_analysis(drug_upper, target_gene, prediction, explanation, kb.version)
+        _cache_analysis(key, prediction, explanation, encoded, fallback)
+        return render_analysis(patient_id, _timestamp(), encoded, vcf_valid)
+
+
+def _timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _isoformat(ts: Optional[float]) -> Optional[str]:
+    return None if ts is None else datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def _json_response(body: bytes, kb) -> Response:
+    """
+    Already-encoded JSON (see responses.py). Returning a Response skips
+    FastAPI's response_model re-validation; the model still documents it.
+    The knowledge-base version is also sent as a header for HTTP caches.
+    """
+    return Response(body, media_type="application/json", headers={KB_VERSION_HEADER: kb.version})
+
+
+def _explain_mode(explain: str) -> bool:
+    """True for deferred explanations; rejects unknown modes."""
+    mode = explain.strip().lower()
+    if mode not in ("inline", "deferred"):
+        raise HTTPException(status_code=400, detail="explain must be 'inline' or 'deferred'.")
+    return mode == "deferred"
+
+
+@app.post("/analyze", response_model=AnalysisResult)
+async def analyze_genomics(
+    file: UploadFile = File(...),
+    drug: str = Form(...),
+    patient_id: str = Form("PATIENT_001"),
+    index: Optional[UploadFile] = File(None),
+    explain: str = Form("inline"),
+):
+    drug_upper = drug.upper()
+    deferred = _explain_mode(explain)
+    kb = knowledge_base.current
+
+    # 1. Validate drug
+    if drug_upper not in kb.kb.drug_genes:
+        raise _unsupported_drug(drug, kb)
+
+    # 2. Validate file and stream-parse VCF, keeping pharmacogene lines only
+    parser = _upload_parser(kb)
+    all_variants = await _stream_vcf_upload(file, parser, kb, index)
+    with stage("validate"):
+        vcf_valid = parser.validate()
+
+    # 3. Bucket variants by gene (one pass covers every gene of the drug)
+    with stage("gene_filter"):
+        variants_by_gene = kb.engine.group_variants_by_gene(all_variants)
+
+    # 4. Risk prediction + explanation (cached by genotype) and result
+    body = await _analyze_drug(kb, patient_id, drug_upper, variants_by_gene, {}, vcf_valid, deferred)
+    return _json_response(body, kb)
+
+
+@app.post("/analyze/panel", response_model=PanelResult)
+async def analyze_panel(
+    file: UploadFile = File(...),
+    drugs: str = Form("all"),
+    patient_id: str = Form("PATIENT_001"),
+    index: Optional[UploadFile] = File(None),
+    explain: str = Form("inline"),
+):
+    """
+    Score several drugs against one upload.
+    `drugs` is a comma-separated list of drug names, or "all".
+    The VCF is parsed once, variants are grouped by gene once, and each
+    gene is called once however many drugs use it.
+    """
+    deferred = _explain_mode(explain)
+    kb = knowledge_base.current
+    drug_gene_map = kb.kb.drug_gene_map
+
+    # 1. Validate drug list
+    if drugs.strip().lower() == "all":
+        drug_list = list(drug_gene_map.keys())
+    else:
+        drug_list = list(dict.fromkeys(d.strip().upper() for d in drugs.split(",") if d.strip()))
+        if not drug_list:
+            raise HTTPException(status_code=400, detail="No drugs requested.")
+        for d in drug_list:
+            if d not in drug_gene_map:
+                raise _unsupported_drug(d, kb)
+
+    # 2. Validate file and stream-parse VCF once, keeping pharmacogene lines only
+    parser = _upload_parser(kb)
+    all_variants = await _stream_vcf_upload(file, parser, kb, index)
+    with stage("validate"):
+        vcf_valid = parser.validate()
+
+    # 3. Group variants by gene once, shared by every drug
+    with stage("gene_filter"):
+        variants_by_gene = kb.engine.group_variants_by_gene(all_variants)
+
+    # 4. Score each drug from shared gene calls; LLM calls run concurrently
+    # within the service's limit
+    gene_calls = {}
+    results = await asyncio.gather(*(
+        _analyze_drug(kb, patient_id, drug_upper, variants_by_gene, gene_calls, vcf_valid, deferred)
+        for drug_upper in drug_list
+    ))
+
+    with stage("serialize"):
+        body = render_panel(patient_id, results)
+    return _json_response(body, kb)
+
+
+def _get_profile(profile_id: str):
+    profile = patient_profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found or expired.")
+    return profile
+
+
+def _profile_summary(profile, kb) -> ProfileSummary:
+    """Every gene's call for the profile under ``kb``, computed at most once per version."""
+    calls = kb.engine.call_genes(profile.variants_by_gene, calls=profile.gene_calls(kb.version))
+    return ProfileSummary(
+        profile_id=profile.profile_id,
+        patient_id=profile.patient_id,
+        created_at=_isoformat(profile.created),
+        expires_at=_isoformat(profile.expires),
+        vcf_parsing_success=profile.vcf_valid,
+        knowledge_base_version=kb.version,
+        genes=[
+            ProfileGene(gene=gene, diplotype=f"{c.allele1}/{c.allele2}", phenotype=c.phenotype,
+                        activity_score=c.activity_score, detected_variants=len(c.variants))
+            for gene, c in calls.items()
+        ],
     )
 
 
+@app.post("/profiles", response_model=ProfileSummary, status_code=201)
+async def create_profile(
+    file: UploadFile = File(...),
+    patient_id: str = Form("PATIENT_001"),
+    index: Optional[UploadFile] = File(None),
+):
+    """
+    Upload a VCF once and keep the patient's pharmacogene variants, by gene,
+    under a new profile ID. Query drugs against it with
+    GET /profiles/{profile_id}/analyze?drug=X, without re-uploading.
+    """
+    kb = knowledge_base.current
+    parser = _upload_parser(kb)
+    all_variants = await _stream_vcf_upload(file, parser, kb, index)
+    with stage("validate"):
+        vcf_valid = parser.validate()
+    with stage("gene_filter"):
+        variants_by_gene = kb.engine.group_variants_by_gene(all_variants)
+    profile = patient_profiles.create(patient_id, variants_by_gene, vcf_valid)
+    with stage("phenotype"):
+        return _profile_summary(profile, kb)
+
+
+@app.get("/profiles/{profile_id}", response_model=ProfileSummary)
+def get_patient_profile(profile_id: str):
+    """The profile's per-gene diplotype summary under the current knowledge base."""
+    return _profile_summary(_get_profile(profile_id), knowledge_base.current)
+
+
+@app.delete("/profiles/{profile_id}", status_code=204)
+def delete_patient_profile(profile_id: str):
+    if not patient_profiles.delete(profile_id):
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found or expired.")
+    return Response(status_code=204)
+
+
+@app.get("/profiles/{profile_id}/analyze", response_model=AnalysisResult)
+async def analyze_profile(profile_id: str, drug: str, explain: str = "inline"):
+    """
+    Score one drug against a stored profile: same result as POST /analyze
+    with the original upload. Gene calls are shared across the profile's
+    queries, and a genotype seen before is served from the result cache.
+    """
+    drug_upper = drug.upper()
+    deferred = _explain_mode(explain)
+    kb = knowledge_base.current
+    if drug_upper not in kb.kb.drug_genes:
+        raise _unsupported_drug(drug, kb)
+    profile = _get_profile(profile_id)
+    body = await _analyze_drug(kb, profile.patient_id, drug_upper, profile.variants_by_gene,
+                               profile.gene_calls(kb.version), profile.vcf_valid, deferred)
+    return _json_response(body, kb)
+
+
+def _acquire_batch_pool():
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            # Workers load the tables this process is serving (the file may have been reloaded)
+            _batch_pool = make_pool(kb_path=knowledge_base.current.path if knowledge_base.reloads else None)
+        pool = _batch_pool
+        _batch_pool_users[pool] = _batch_pool_users.get(pool, 0) + 1
+    return pool
+
+
+def _release_batch_pool(pool) -> None:
+    with _batch_pool_lock:
+        users = _batch_pool_users.pop(pool) - 1
+        if users:
+            _batch_pool_users[pool] = users
+            return
+        retired = pool is not _batch_pool
+    if retired:
+        pool.shutdown(wait=False)
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    drugs: str = Form("all"),
+):
+    """
+    Cohort screening: score many VCFs (or .zip archives of VCFs) across a
+    process pool and stream one NDJSON line per file as it completes.
+    A bad file produces an error line; the rest of the batch continues.
+    """
+    try:
+        drug_list = resolve_drugs(drugs, knowledge_base.current.kb.drug_gene_map)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Jobs are held in memory until the pool has them: each file (or zip
+    # member) is capped at MAX_UPLOAD_BYTES and the whole batch at MAX_BATCH_BYTES
+    too_large = f"File too large. Maximum size is {MAX_UPLOAD_MB}MB."
+    batch_too_large = HTTPException(status_code=400,
+                                    detail=f"Batch too large. Maximum total size is {MAX_BATCH_MB}MB.")
+    jobs, errors = [], []
+    total = 0
+
+    def add_job(name: str, data: Optional[bytes]) -> None:
+        nonlocal total
+        if data is None:
+            errors.append({"file": name, "error": too_large})
+            return
+        total += len(data)
+        if total > MAX_BATCH_BYTES:
+            raise batch_too_large
+        jobs.append((name, data))
+
+    for f in files:
+        name = f.filename or "upload"
+        if name.lower().endswith(".zip"):
+            data = await _read_capped(f, MAX_UPLOAD_BYTES)
+            if data is None:
+                errors.append({"file": name, "error": too_large})
+                continue
+            try:
+                for member, member_data in iter_zip_bytes(name, data, MAX_UPLOAD_BYTES):
+                    add_job(member, member_data)
+            except zipfile.BadZipFile as e:
+                errors.append({"file": name, "error": f"BadZipFile: {e}"})
+        elif name.lower().endswith(VCF_EXTENSIONS):
+            add_job(name, await _read_capped(f, MAX_UPLOAD_BYTES))
+        else:
+            errors.append({"file": name, "error": "Invalid file format. Only .vcf, .vcf.gz or .zip files are accepted."})
+
+    loop = asyncio.get_running_loop()
+
+    async def stream():
+        for record in errors:
+            yield dumps(record) + b"\n"
+        # Held until every job has finished, so a reload cannot shut the pool down under us
+        pool = _acquire_batch_pool()
+        futures = []
+        try:
+            futures = [loop.run_in_executor(pool, analyze_file, name, data, drug_list) for name, data in jobs]
+            for future in asyncio.as_completed(futures):
+                for record in await future:
+                    yield dumps(record) + b"\n"
+        finally:
+            # A disconnected client leaves jobs running; release once they are done
+            pending = [f for f in futures if not f.done()]
+            if pending:
+                asyncio.gather(*pending, return_exceptions=True).add_done_callback(
+                    lambda _: _release_batch_pool(pool))
+            else:
+                _release_batch_pool(pool)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson",
+                             headers={KB_VERSION_HEADER: knowledge_base.current.version})
+
+
+@app.get("/explanations/{job_id}", response_model=ExplanationJob)
+async def get_explanation(job_id: str):
+    """Poll a deferred explanation started by /analyze with explain=deferred."""
+    job = explanation_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Explanation job '{job_id}' not found or expired.")
+    return ExplanationJob(**job)
+
+
+@app.get("/debug/profiles/{request_id}")
+def get_profile(
+    request_id: str,
+    format: str = "json",
+    x_pharmaguard_profile: Optional[str] = Header(None),
+):
+    """
+    A profile captured by the profiling middleware: ``format=json`` (both
+    views), ``text`` (cProfile stats) or ``folded`` (flamegraph stacks).
+    Always requires the profile token header: with only
+    PHARMAGUARD_SLOW_REQUEST_MS set, slow-request stacks go to the log and
+    PHARMAGUARD_PROFILE_DIR, never over HTTP.
+    """
+    if profile_store is None or not profile_token or x_pharmaguard_profile != profile_token:
+        raise HTTPException(status_code=404, detail="Not found")
+    entry = profile_store.get(request_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No profile for request '{request_id}'.")
+    if format == "text":
+        return Response(entry.get("cprofile", ""), media_type="text/plain")
+    if format == "folded":
+        return Response(entry.get("folded", ""), media_type="text/plain")
+    return entry
+
+
+@app.post("/admin/knowledge-base/reload")
+def reload_knowledge_base(x_pharmaguard_admin: Optional[str] = Header(None)):
+    """
+    Re-read the knowledge-base data file and swap it in atomically. In-flight
+    requests finish on the version they started with; an invalid file is
+    rejected and the current version keeps serving. Disabled unless
+    PHARMAGUARD_ADMIN_TOKEN is set; send it as ``X-PharmaGuard-Admin``.
+    """
+    if not _admin_token or x_pharmaguard_admin != _admin_token:
+        raise HTTPException(status_code=404, detail="Not found")
+    previous = knowledge_base.current.version
+    try:
+        current = knowledge_base.reload()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Knowledge base not reloaded: {e}")
+    return {
+        "previous_version": previous,
+        "knowledge_base_version": current.version,
+        "changed": current.version != previous,
+        "path": current.path,
+    }
+
+
 @app.get("/")
 def read_root():
+    kb = knowledge_base.current.kb
     return {
         "status": "PharmaGuard Backend Operational",
         "version": "2.0",
-        "supported_drugs": list(DRUG_GENE_MAP.keys()),
-        "supported_genes": list(set(DRUG_GENE_MAP.values())),
+        "supported_drugs": list(kb.drug_gene_map.keys()),
+        "supported_genes": list(kb.genes),
     }
 
 
 @app.get("/drugs")
 def get_drugs():
     """Return list of supported drug-gene pairs."""
-    from knowledge_base import DRUG_INFO
+    kb = knowledge_base.current.kb
     result = []
-    for drug, gene in DRUG_GENE_MAP.items():
-        info = DRUG_INFO.get(drug, {})
+    for drug, genes in kb.drug_genes.items():
+        info = kb.drug_info.get(drug, {})
         result.append({
             "drug": drug,
-            "gene": gene,
+            "gene": genes[0],
+            "genes": list(genes),
             "class": info.get("class", ""),
             "mechanism_short": info.get("mechanism_short", ""),
             "cpic_tier": info.get("cpic_tier", "A"),
@@ -176,6 +692,8 @@ def get_genes():
         "CYP2C19": {"variants_catalogued": 35,  "population_frequency_pm": "2-15%", "cpic_drugs": 12},
         "SLCO1B1": {"variants_catalogued": 28,  "population_frequency_pm": "5-15%", "cpic_drugs": 4},
         "TPMT":    {"variants_catalogued": 40,  "population_frequency_pm": "0.3%",  "cpic_drugs": 3},
+        "NUDT15":  {"variants_catalogued": 20,  "population_frequency_pm": "0.2-2%","cpic_drugs": 3},
+        "VKORC1":  {"variants_catalogued": 12,  "population_frequency_pm": "14-80%","cpic_drugs": 1},
         "DPYD":    {"variants_catalogued": 18,  "population_frequency_pm": "0.5-3%","cpic_drugs": 3},
     }
     return {"genes": genes}
@@ -183,12 +701,32 @@ def get_genes():
 
 @app.get("/stats")
 def get_stats():
-    """Usage statistics endpoint."""
+    """Knowledge-base coverage and runtime counters for this worker."""
+    llm_outcomes = {o: int(LLM_CALLS.value(o)) for o in ("generated", "stored", "timeout", "error")}
+    snapshot = knowledge_base.current
+    kb = snapshot.kb
     return {
-        "total_analyses_supported": "Unlimited",
-        "drug_gene_pairs": len(DRUG_GENE_MAP),
-        "known_variants": 24,
-        "cpic_tier": "A",
+        "uptime_seconds": round(time.time() - _started_at, 1),
+        "analyses_served": int(ANALYSES.total()),
+        "drug_gene_pairs": sum(len(genes) for genes in kb.drug_genes.values()),
+        "genes": len(kb.genes),
+        "known_variants": len(kb.star_alleles),
+        "star_alleles": len({(gene, star) for gene, star, _ in kb.star_alleles.values()}),
+        "cpic_tiers": sorted({kb.drug_info.get(d, {}).get("cpic_tier", "A") for d in kb.drug_gene_map}),
         "accuracy_mode": "RSID-based star-allele + activity-score phenotyping",
         "guidelines_version": "CPIC v2024",
+        "knowledge_base_version": kb.version,
+        "knowledge_base_loaded_at": datetime.fromtimestamp(snapshot.loaded_at, timezone.utc).isoformat(),
+        "knowledge_base_reloads": knowledge_base.reloads,
+        "llm_backend": (llm_service.model_name if llm_service.model is not None
+                        else "warming" if llm_service.warming else "template"),
+        "llm_calls": {**llm_outcomes, "fallbacks": llm_outcomes["timeout"] + llm_outcomes["error"]},
+        "analysis_cache": analysis_cache.stats(),
+        "patient_profiles": patient_profiles.stats(),
     }
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of stage timers, request latency and counters."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
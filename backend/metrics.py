@@ -0,0 +1,226 @@
+"""
+PharmaGuard Metrics
+===================
+Minimal in-process Prometheus instrumentation: labelled counters and
+histograms rendered in the text exposition format for ``GET /metrics``,
+plus a pure ASGI middleware that times every request by route template.
+
+Histograms keep cumulative bucket counts only, so an observation is a
+bisect and two additions under a lock, and memory is bounded by the label
+combinations in use (stage names, route templates, status codes).
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; stages range from sub-millisecond filtering to multi-second LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Bytes; 1 KB panels up to whole-genome uploads
+SIZE_BUCKETS = tuple(float(1 << s) for s in range(10, 32, 2))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Observe the wall time of the ``with`` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            base = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{base} {_format_value(total)}"
+            yield f"{self.name}_count{base} {cumulative}"
+
+
+class Gauge:
+    """A value read from ``fn`` at scrape time (e.g. a cache's size)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        yield f"{self.name} {_format_value(self.fn())}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float], kind: str = "gauge") -> Gauge:
+        """Callback metric; ``kind="counter"`` for monotonic values kept elsewhere."""
+        return self.register(Gauge(name, help, fn, kind))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "pharmaguard_stage_seconds",
+    "Wall time of each analysis stage (upload_read, parse, validate, gene_filter, "
+    "phenotype, llm, serialize).",
+    ("stage",),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "pharmaguard_request_seconds", "HTTP request latency by route template.",
+    ("method", "route", "status"),
+)
+UPLOAD_BYTES = REGISTRY.histogram(
+    "pharmaguard_upload_bytes", "Size of uploaded VCFs as read from the request.",
+    buckets=SIZE_BUCKETS,
+)
+ANALYSES = REGISTRY.counter(
+    "pharmaguard_analyses_total", "Drug analyses returned, by drug and cache outcome.",
+    ("drug", "cache"),
+)
+LLM_CALLS = REGISTRY.counter(
+    "pharmaguard_llm_calls_total",
+    "Explanation requests by outcome: generated, stored (explanation store hit), "
+    "timeout and error (both fell back to the template).",
+    ("outcome",),
+)
+
+
+def stage(name: str):
+    """``with stage("parse"): ...`` records into pharmaguard_stage_seconds."""
+    return STAGE_SECONDS.time(name)
+
+
+class MetricsMiddleware:
+    """Times each HTTP request and labels it with the matched route's path template."""
+
+    def __init__(self, app, histogram: Histogram = REQUEST_SECONDS):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.observe(time.perf_counter() - start, scope["method"], path, str(status[0]))
+
+
+def cache_gauges(registry: Registry, prefix: str, stats: Callable[[], Dict[str, float]],
+                 help: str, counters: Optional[Sequence[str]] = ("hits", "misses")) -> None:
+    """Expose an LRUCache.stats() source as scrape-time counters and a size gauge."""
+    for field in counters or ():
+        registry.gauge(f"{prefix}_{field}_total", f"{help} {field}.", lambda f=field: stats()[f], kind="counter")
+    registry.gauge(f"{prefix}_entries", f"{help} entries.", lambda: stats()["size"])
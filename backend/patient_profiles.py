@@ -0,0 +1,237 @@
+"""
+PharmaGuard Patient Profiles
+============================
+A profile is one patient's upload reduced to what drug queries need: the
+pharmacogene variants (with GT) bucketed by gene. Clinicians upload a VCF
+once, get a profile ID, and query drug after drug against it; each query
+is a map lookup plus rule resolution, never a re-upload or re-parse.
+
+Gene calls are derived from the stored variants, once per knowledge-base
+version, and shared by every drug query on the profile. Genes the
+knowledge base gains after a profile was created have no stored variants
+(the upload was filtered to the pharmacogenes of the time); re-upload to
+cover them.
+
+Profiles live in an in-memory LRU bounded by count and by bytes (their
+serialized size), with a fixed lifetime from creation. With a SQLite path
+they are also persisted, so they survive memory eviction, restarts and
+other workers sharing the file. Profile IDs are random bearer tokens; a
+profile holds genotype data, so persistence is off unless configured.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from genotypes import parse_gt
+from variants import VariantRecord
+
+
+class PatientProfile:
+    __slots__ = ("profile_id", "patient_id", "created", "expires", "vcf_valid", "variants_by_gene",
+                 "size", "_calls", "_calls_version")
+
+    def __init__(self, profile_id: str, patient_id: str, created: float, expires: Optional[float],
+                 vcf_valid: bool, variants_by_gene: Dict[str, List[VariantRecord]], size: int = 0):
+        self.profile_id = profile_id
+        self.patient_id = patient_id
+        self.created = created
+        self.expires = expires
+        self.vcf_valid = vcf_valid
+        # Only genes with variants are kept (a missing gene is reference), and
+        # INFO is dropped: gene assignment is already done and nothing else reads it
+        self.variants_by_gene = {
+            g: [v if not v.info else VariantRecord(v.rsid, v.chromosome, v.position, v.reference,
+                                                   v.alternate, genotype=v.genotype) for v in vs]
+            for g, vs in variants_by_gene.items() if vs
+        }
+        self.size = size
+        self._calls: Dict[str, Any] = {}
+        self._calls_version: Optional[str] = None
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return self.expires is not None and self.expires <= (time.time() if now is None else now)
+
+    def gene_calls(self, kb_version: str) -> Dict[str, Any]:
+        """
+        The {gene: GeneCall} map for this knowledge-base version, filled in
+        lazily by RiskEngine.call_genes and shared by every drug query.
+        """
+        if self._calls_version != kb_version:
+            self._calls, self._calls_version = {}, kb_version
+        return self._calls
+
+    def to_payload(self) -> bytes:
+        genes = {
+            gene: [[v.rsid, v.chromosome, v.position, v.reference, v.alternate,
+                    None if v.genotype is None else str(v.genotype)] for v in variants]
+            for gene, variants in self.variants_by_gene.items()
+        }
+        return json.dumps({
+            "patient_id": self.patient_id, "created": self.created, "expires": self.expires,
+            "vcf_valid": self.vcf_valid, "genes": genes,
+        }, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_payload(cls, profile_id: str, payload: bytes) -> "PatientProfile":
+        raw = json.loads(payload)
+        variants_by_gene = {
+            gene: [VariantRecord(rsid, chrom, pos, ref, alt, genotype=None if gt is None else parse_gt(gt))
+                   for rsid, chrom, pos, ref, alt, gt in rows]
+            for gene, rows in raw["genes"].items()
+        }
+        return cls(profile_id, raw["patient_id"], raw["created"], raw["expires"], raw["vcf_valid"],
+                   variants_by_gene, len(payload))
+
+
+class ProfileStore:
+    """
+    In-memory LRU of profiles, capped at ``max_profiles`` entries and
+    ``max_bytes`` of serialized profile data, with an optional SQLite tier
+    at ``path`` holding up to ``db_max_entries`` profiles.
+    ``ttl <= 0`` means profiles never expire.
+    """
+
+    def __init__(self, max_profiles: int = 10_000, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 86_400, path: Optional[str] = None, db_max_entries: int = 100_000):
+        self.max_profiles = max_profiles
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.db_max_entries = db_max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._profiles: "OrderedDict[str, PatientProfile]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            with self._lock:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS profiles ("
+                    " id TEXT PRIMARY KEY,"
+                    " payload BLOB NOT NULL,"
+                    " created REAL NOT NULL,"
+                    " expires REAL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_profiles_created ON profiles(created)")
+                self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> "ProfileStore":
+        """Store configured by environment; SQLite persistence only if PHARMAGUARD_PATIENT_PROFILE_DB is set."""
+        kwargs = dict(
+            max_profiles=int(os.getenv("PHARMAGUARD_PATIENT_PROFILES", "10000")),
+            max_bytes=int(float(os.getenv("PHARMAGUARD_PATIENT_PROFILE_MB", "64")) * 1024 * 1024),
+            ttl=float(os.getenv("PHARMAGUARD_PATIENT_PROFILE_TTL", "86400")),
+            db_max_entries=int(os.getenv("PHARMAGUARD_PATIENT_PROFILE_DB_MAX", "100000")),
+        )
+        path = os.getenv("PHARMAGUARD_PATIENT_PROFILE_DB") or None
+        try:
+            return cls(path=path, **kwargs)
+        except sqlite3.Error as e:
+            print(f"[ProfileStore] ⚠ Could not open {path}: {e}. Profiles kept in memory only.")
+            return cls(**kwargs)
+
+    def create(self, patient_id: str, variants_by_gene: Dict[str, List[VariantRecord]],
+               vcf_valid: bool) -> PatientProfile:
+        now = time.time()
+        profile = PatientProfile(secrets.token_urlsafe(16), patient_id, now,
+                                 now + self.ttl if self.ttl > 0 else None, vcf_valid, variants_by_gene)
+        payload = profile.to_payload()
+        profile.size = len(payload)
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO profiles (id, payload, created, expires) VALUES (?, ?, ?, ?)",
+                    (profile.profile_id, payload, profile.created, profile.expires),
+                )
+                self._evict_db(now)
+                self._conn.commit()
+        self._remember(profile)
+        return profile
+
+    def get(self, profile_id: str) -> Optional[PatientProfile]:
+        """The profile, from memory or else the SQLite tier; None if unknown or expired."""
+        with self._lock:
+            profile = self._profiles.get(profile_id)
+            if profile is not None:
+                if not profile.expired():
+                    self._profiles.move_to_end(profile_id)
+                    self.hits += 1
+                    return profile
+                self._forget(profile_id)
+            self.misses += 1
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT payload FROM profiles WHERE id = ? AND (expires IS NULL OR expires > ?)",
+                (profile_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        profile = PatientProfile.from_payload(profile_id, row[0])
+        self._remember(profile)
+        return profile
+
+    def delete(self, profile_id: str) -> bool:
+        with self._lock:
+            found = self._forget(profile_id)
+            if self._conn is not None:
+                found = self._conn.execute("DELETE FROM profiles WHERE id = ?", (profile_id,)).rowcount > 0 or found
+                self._conn.commit()
+        return found
+
+    def _remember(self, profile: PatientProfile) -> None:
+        with self._lock:
+            self._forget(profile.profile_id)
+            self._profiles[profile.profile_id] = profile
+            self._bytes += profile.size
+            # The newest profile always stays, even if it alone exceeds max_bytes
+            while len(self._profiles) > 1 and (len(self._profiles) > self.max_profiles
+                                               or self._bytes > self.max_bytes):
+                _, evicted = self._profiles.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def _forget(self, profile_id: str) -> bool:
+        profile = self._profiles.pop(profile_id, None)
+        if profile is None:
+            return False
+        self._bytes -= profile.size
+        return True
+
+    def _evict_db(self, now: float) -> None:
+        self._conn.execute("DELETE FROM profiles WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM profiles").fetchone()
+        excess = count - self.db_max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM profiles WHERE id IN (SELECT id FROM profiles ORDER BY created ASC LIMIT ?)",
+                (excess,),
+            )
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._profiles),
+            "maxsize": self.max_profiles,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "persistent": self._conn is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,217 @@
+"""
+PharmaGuard Request Profiling
+=============================
+Opt-in diagnostics for slow analyses, installed only when configured so a
+normal deployment pays nothing:
+
+PHARMAGUARD_PROFILE_TOKEN   requests carrying ``X-PharmaGuard-Profile: <token>``
+                            run under cProfile; the profile is kept (LRU) by
+                            request ID and served at /debug/profiles/{id}
+                            to holders of the same token
+PHARMAGUARD_SLOW_REQUEST_MS requests slower than this have the event-loop
+                            thread's stacks, sampled while they ran, logged
+                            in folded (flamegraph.pl / speedscope) format
+PHARMAGUARD_PROFILE_DIR     also write .prof / .folded files here
+
+Both views cover the event-loop thread, so work from other requests that
+overlapped in time shows up too; profile under low concurrency when exact
+attribution matters.
+"""
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from cache import LRUCache
+
+PROFILE_HEADER = "x-pharmaguard-profile"
+REQUEST_ID_HEADER = "x-request-id"
+
+
+def folded_stacks(samples: List[Tuple[str, ...]]) -> str:
+    """'root;child;leaf count' lines, heaviest first."""
+    counts = collections.Counter(samples)
+    return "\n".join(f"{';'.join(stack)} {n}" for stack, n in counts.most_common())
+
+
+def _frame_stack(frame) -> Tuple[str, ...]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+class StackSampler:
+    """
+    Samples the event-loop thread's stack every ``interval`` seconds while
+    at least one request is in flight; the sampler blocks when idle.
+    """
+
+    def __init__(self, interval: float = 0.005, history: int = 20000):
+        self.thread_id: Optional[int] = None
+        self.interval = interval
+        self._samples: "collections.deque" = collections.deque(maxlen=history)
+        self._active = threading.Event()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+            frame = sys._current_frames().get(self.thread_id) if self.thread_id is not None else None
+            if frame is not None:
+                self._samples.append((time.perf_counter(), _frame_stack(frame)))
+            del frame
+            time.sleep(self.interval)
+
+    def begin(self) -> float:
+        """Call from the event-loop thread when a request starts."""
+        with self._lock:
+            self.thread_id = threading.get_ident()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pharmaguard-sampler", daemon=True)
+                self._thread.start()
+            self._in_flight += 1
+            self._active.set()
+        return time.perf_counter()
+
+    def end(self, start: float) -> List[Tuple[str, ...]]:
+        """Stacks sampled since ``start``."""
+        stop = time.perf_counter()
+        with self._lock:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._active.clear()
+        return [stack for ts, stack in list(self._samples) if start <= ts <= stop]
+
+
+class ProfileStore:
+    """Recent profiles by request ID, optionally mirrored to a directory."""
+
+    def __init__(self, maxsize: int = 64, ttl: float = 3600, directory: Optional[str] = None):
+        self._profiles = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def put_cprofile(self, request_id: str, profile: cProfile.Profile, meta: Dict) -> None:
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(60)
+        entry = self._profiles.get(request_id) or {"request_id": request_id}
+        entry.update(meta, cprofile=out.getvalue())
+        self._profiles.set(request_id, entry)
+        if self.directory:
+            profile.dump_stats(os.path.join(self.directory, f"{request_id}.prof"))
+
+    def put_folded(self, request_id: str, folded: str, meta: Dict) -> None:
+        entry = self._profiles.get(request_id) or {"request_id": request_id}
+        entry.update(meta, folded=folded)
+        self._profiles.set(request_id, entry)
+        if self.directory:
+            with open(os.path.join(self.directory, f"{request_id}.folded"), "w", encoding="utf-8") as fh:
+                fh.write(folded + "\n")
+
+    def get(self, request_id: str) -> Optional[Dict]:
+        return self._profiles.get(request_id)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware for header-triggered cProfile runs and slow-request
+    stack dumps. Only one request is cProfiled at a time; a concurrent
+    profile request is served unprofiled with ``X-PharmaGuard-Profile: busy``.
+    """
+
+    def __init__(self, app, store: ProfileStore, token: Optional[str] = None,
+                 slow_ms: Optional[float] = None, sampler: Optional[StackSampler] = None):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.slow_s = slow_ms / 1000 if slow_ms else None
+        self.sampler = sampler if sampler is not None or self.slow_s is None else StackSampler()
+        self._profiling = threading.Lock()
+
+    def _wants_profile(self, scope) -> bool:
+        if not self.token:
+            return False
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER.encode() and value.decode("latin-1") == self.token:
+                return True
+        return False
+
+    @staticmethod
+    def _request_id(scope) -> str:
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER.encode():
+                rid = value.decode("latin-1")
+                if rid.replace("-", "").isalnum() and len(rid) <= 64:
+                    return rid
+        return uuid.uuid4().hex
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = self._request_id(scope)
+        profile_state = None
+        if self._wants_profile(scope):
+            profile_state = "busy"
+            if self._profiling.acquire(blocking=False):
+                profile_state = "on"
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode(), request_id.encode()))
+                if profile_state:
+                    headers.append((PROFILE_HEADER.encode(), profile_state.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = cProfile.Profile() if profile_state == "on" else None
+        sample_start = self.sampler.begin() if self.sampler is not None else None
+        start = time.perf_counter()
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler (e.g. a coverage or debugging tool) owns the thread
+                profiler, profile_state = None, "busy"
+                self._profiling.release()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling.release()
+            elapsed = time.perf_counter() - start
+            meta = {"path": scope["path"], "status": status[0], "elapsed_ms": round(elapsed * 1e3, 2)}
+            if profiler is not None:
+                self.store.put_cprofile(request_id, profiler, meta)
+            if sample_start is not None:
+                samples = self.sampler.end(sample_start)
+                if elapsed >= self.slow_s:
+                    folded = folded_stacks(samples)
+                    self.store.put_folded(request_id, folded, meta)
+                    print(f"[Profiling] Slow request {request_id} {scope['method']} {scope['path']} "
+                          f"took {elapsed * 1e3:.0f} ms ({len(samples)} stack samples, folded):\n{folded}")
+
+
+def from_env() -> Tuple[Optional[str], Optional[float], Optional[ProfileStore]]:
+    """(token, slow_ms, store) from the environment; store is None when profiling is off."""
+    token = os.getenv("PHARMAGUARD_PROFILE_TOKEN") or None
+    slow_ms = float(os.getenv("PHARMAGUARD_SLOW_REQUEST_MS") or 0) or None
+    if not token and not slow_ms:
+        return None, None, None
+    return token, slow_ms, ProfileStore(directory=os.getenv("PHARMAGUARD_PROFILE_DIR") or None)
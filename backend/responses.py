@@ -0,0 +1,136 @@
+"""
+PharmaGuard Response Encoding
+=============================
+Fast JSON path for AnalysisResult and PanelResult. The genotype-dependent
+part of a result (risk, profile, recommendation, explanation) is validated
+against the schemas once, when it is computed, and kept pre-encoded next to
+the cached prediction. Each response then only encodes patient_id and
+timestamp and splices byte fragments together, so pydantic neither
+rebuilds nor re-validates the nested models per request.
+
+Output is byte-for-byte what ``AnalysisResult.model_dump_json()`` produces.
+orjson is used when installed, the stdlib json module otherwise.
+"""
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from schemas import GeneDiplotype, LLMExplanation, PharmacogenomicProfile, RiskAssessment
+
+try:
+    import orjson
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:  # pragma: no cover - exercised only without orjson
+    orjson = None
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+
+MONITORING_ADVICE = {
+    "critical": "Immediate clinical review required. Do NOT administer without pharmacogenomics consultation.",
+    "high": "Frequent monitoring required. Adjust dose before initiating therapy.",
+    "moderate": "Monitor for drug response and adverse effects at each clinical visit.",
+    "low": "Routine monitoring per standard of care.",
+    "none": "Standard label monitoring. No additional pharmacogenomics-specific monitoring required.",
+}
+DEFAULT_MONITORING_ADVICE = "Monitor per standard clinical protocol."
+
+
+def confidence_level(confidence: float) -> str:
+    return "High" if confidence >= 0.88 else "Moderate" if confidence >= 0.65 else "Low"
+
+
+@lru_cache(maxsize=1024)
+def recommendation_fragment(drug: str, gene: str, recommendation: str, severity: str) -> bytes:
+    """Encoded clinical_recommendation; one per CPIC rule, so effectively static."""
+    return dumps({
+        "cpic_guideline_reference": f"CPIC Guideline for {drug.title()} and {gene} (Tier A)",
+        "dose_adjustment": recommendation,
+        "monitoring_advice": MONITORING_ADVICE.get(severity, DEFAULT_MONITORING_ADVICE),
+    })
+
+
+@lru_cache(maxsize=64)
+def _quality_fragment(vcf_valid: bool, missing_annotations: bool, level: str) -> bytes:
+    return dumps({
+        "vcf_parsing_success": vcf_valid,
+        "missing_annotations": missing_annotations,
+        "confidence_level": level,
+    })
+
+
+class EncodedAnalysis(NamedTuple):
+    """Pre-encoded, already validated genotype-dependent part of an AnalysisResult."""
+    drug: bytes
+    body: bytes
+    missing_annotations: bool
+    confidence_level: str
+    knowledge_base_version: bytes = b"null"
+
+
+def encode_analysis(drug: str, gene: str, prediction: Dict[str, Any],
+                    explanation: Dict[str, Any], kb_version: Optional[str] = None) -> EncodedAnalysis:
+    """
+    Validate the prediction-derived fields (risk label, severity and
+    phenotype patterns; the explanation's shape) once and encode them.
+    Raises pydantic.ValidationError exactly as building the models would.
+    """
+    gene_variants = prediction.get("gene_variants", [])
+    severity = prediction.get("severity", "none")
+    confidence = prediction.get("confidence", 0.85)
+    risk = RiskAssessment(risk_label=prediction["risk"], confidence_score=confidence, severity=severity)
+    # Only the scalar fields need checking; variants come typed from the parser
+    profile = PharmacogenomicProfile(
+        primary_gene=gene,
+        diplotype=f"{prediction.get('allele1', '*1')}/{prediction.get('allele2', '*1')}",
+        phenotype=prediction["phenotype"],
+        detected_variants=[],
+        secondary_genes=[
+            GeneDiplotype(gene=c.gene, diplotype=f"{c.allele1}/{c.allele2}", phenotype=c.phenotype)
+            for c in prediction.get("gene_calls", [])[1:]
+        ],
+    )
+    explained = LLMExplanation(**explanation)
+
+    variants = [
+        {"rsid": v.rsid, "chromosome": v.chromosome, "position": str(v.position),
+         "reference": v.reference, "alternate": v.alternate}
+        for v in gene_variants
+    ]
+    body = b"".join((
+        b'"risk_assessment":', dumps(risk.model_dump()),
+        b',"pharmacogenomic_profile":', dumps({
+            "primary_gene": profile.primary_gene,
+            "diplotype": profile.diplotype,
+            "phenotype": profile.phenotype,
+            "detected_variants": variants,
+            "secondary_genes": [g.model_dump() for g in profile.secondary_genes],
+        }),
+        b',"clinical_recommendation":', recommendation_fragment(drug, gene, prediction["recommendation"], severity),
+        b',"llm_generated_explanation":', dumps(explained.model_dump()),
+    ))
+    return EncodedAnalysis(dumps(drug), body, len(gene_variants) == 0, confidence_level(confidence),
+                           dumps(kb_version))
+
+
+def render_analysis(patient_id: str, timestamp: str, encoded: EncodedAnalysis, vcf_valid: bool,
+                    explanation_job_id: Optional[str] = None) -> bytes:
+    """One AnalysisResult document."""
+    return b"".join((
+        b'{"patient_id":', dumps(patient_id),
+        b',"drug":', encoded.drug,
+        b',"timestamp":', dumps(timestamp),
+        b",", encoded.body,
+        b',"quality_metrics":', _quality_fragment(vcf_valid, encoded.missing_annotations, encoded.confidence_level),
+        b',"knowledge_base_version":', encoded.knowledge_base_version,
+        b',"explanation_job_id":', dumps(explanation_job_id),
+        b"}",
+    ))
+
+
+def render_panel(patient_id: str, results: List[bytes]) -> bytes:
+    """A PanelResult document from rendered AnalysisResults."""
+    return b'{"patient_id":' + dumps(patient_id) + b',"results":[' + b",".join(results) + b"]}"
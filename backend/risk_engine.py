@@ -5,55 +5,79 @@ Uses real RSID→star-allele tables and activity-score based phenotyping
 instead of naive variant-count heuristics.
 """
 from schemas import *
-from knowledge_base import (
-    CPIC_GUIDELINES, DRUG_GENE_MAP, STAR_ALLELE_VARIANTS, 
-    activity_score_to_phenotype, diplotype_string,
-    ALLELE_ACTIVITY_SCORES
-)
-from typing import List, Dict, Optional
+from knowledge_base import COMPILED_KB, CompiledKnowledgeBase
+from gene_regions import GENE_INDEX, GeneIntervalIndex, load_gene_index
+from genotypes import DOSAGE_GENOTYPES, GenotypeMatrix
+from diplotype import DiplotypeCaller, DiplotypeMatch, definitions_from_table
+from variants import VariantLike, VariantRecord, as_records
+from typing import TYPE_CHECKING, Any, Iterable, List, Dict, Mapping, NamedTuple, Optional, Union
 import math
+import re
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class GeneCall(NamedTuple):
+    """One gene's call for one patient, shared by every drug that uses the gene."""
+    gene: str
+    phenotype: str
+    allele1: str
+    allele2: str
+    activity_score: float
+    confidence: float
+    variants: List[VariantRecord]
 
 
 class RiskEngine:
-    def __init__(self):
-        pass
+    def __init__(self, gene_index: Optional[GeneIntervalIndex] = None,
+                 kb: Optional[CompiledKnowledgeBase] = None):
+        self.kb = kb or COMPILED_KB
+        if gene_index is None:
+            gene_index = GENE_INDEX if self.kb is COMPILED_KB else load_gene_index(self.kb)
+        self.gene_index = gene_index
+        self.drug_gene_map = self.kb.drug_gene_map
+        self.drug_genes = self.kb.drug_genes
+        self.caller = DiplotypeCaller(self.kb.star_alleles, self.kb.allele_scores,
+                                      definitions_from_table(self.kb.allele_definitions))
+
+        # Canonical spelling for every gene we can recognise, keyed upper-case
+        # so INFO matches of any case map back to it.
+        known = set(self.gene_index.genes()) | set(self.kb.genes)
+        known |= set(self.caller.genes())
+        self._gene_names = {g.upper(): g for g in known}
+        # Zero-width lookahead so every gene mention is found, even overlapping ones
+        names = sorted(known, key=len, reverse=True)
+        self._info_gene_pattern = re.compile(
+            "(?=(" + "|".join(re.escape(g) for g in names) + "))", re.IGNORECASE
+        ) if names else None
 
     def classify_variants_to_alleles(self, gene: str, variants: List[Dict]) -> List[str]:
         """
-        Map detected RSIDs to star-alleles for this gene.
-        Returns list of non-reference alleles found (e.g. ['*4', '*2']).
+        Star alleles of this gene whose every defining variant was detected,
+        matched by rsID or by position and allele (e.g. ['*4', '*2']).
         If no variants → both alleles are *1 (wild-type).
         """
-        star_alleles_found = []
-        for v in variants:
-            rsid = v.get("rsid", "")
-            # Look up in our RSID→star-allele table
-            if rsid in STAR_ALLELE_VARIANTS:
-                var_gene, star, _ = STAR_ALLELE_VARIANTS[rsid]
-                if var_gene == gene:
-                    star_alleles_found.append(star)
+        return self.caller.haplotype_alleles(gene, as_records(variants))
 
-        return star_alleles_found
+    def rank_diplotypes(self, gene: str, variants: List[Dict], limit: int = 5) -> List[DiplotypeMatch]:
+        """Best-matching diplotypes for this gene, best first (see DiplotypeCaller)."""
+        return self.caller.rank_records(gene, as_records(variants), limit)
 
     def determine_diplotype(self, gene: str, variants: List[Dict]) -> tuple:
         """
-        Determines diplotype (allele1, allele2) for a gene from variants.
-        
+        Determines diplotype (allele1, allele2) for a gene from variants,
+        honouring each variant's GT (``genotype``) and phase.
+
         Logic:
-        - Scan all detected variants for known star-allele RSIDs
-        - Assign alleles in order: first variant → allele1, second → allele2
-        - If 0 variants found: *1/*1 (wild-type homozygous = NM)  
-        - If 1 variant found: *1 / <found_allele> (heterozygous)
-        - If 2+ variants: <allele1> / <allele2>
-        """
-        found = self.classify_variants_to_alleles(gene, variants)
-
-        if len(found) == 0:
-            return "*1", "*1"
-        elif len(found) == 1:
-            return "*1", found[0]
-        else:
-            return found[0], found[1]
+        - 0 known star-allele variants: *1/*1 (wild-type homozygous = NM)
+        - homozygous alt (1/1): the allele on both haplotypes, e.g. *4/*4
+        - phased calls go onto the haplotype they name; unphased hets and
+          variants without GT alternate between haplotypes in file order
+        - 0/0 and missing calls are ignored
+        See DiplotypeCaller for how each haplotype is called.
+        """
+        return self.caller.call_records(gene, as_records(variants))
 
     def determine_phenotype(self, gene: str, variants: List[Dict]) -> tuple:
         """
@@ -62,19 +86,13 @@ class RiskEngine:
         simplified diplotype method for others.
         """
         allele1, allele2 = self.determine_diplotype(gene, variants)
-        phenotype = activity_score_to_phenotype(gene, allele1, allele2)
-
-        scores = ALLELE_ACTIVITY_SCORES.get(gene, {})
-        s1 = scores.get(allele1, scores.get("default", 1.0))
-        s2 = scores.get(allele2, scores.get("default", 1.0))
-        activity = s1 + s2
-
-        return phenotype, allele1, allele2, round(activity, 2)
+        phenotype, activity = self.kb.phenotype(gene, allele1, allele2)
+        return phenotype, allele1, allele2, activity
 
     def calculate_confidence(self, gene: str, variants: List[Dict], phenotype: str) -> float:
         """
         Multi-factor confidence scoring:
-        - If RSIDs are in our known STAR_ALLELE_VARIANTS table → high confidence
+        - If variants define known star alleles → high confidence
         - Unknown RSIDs → lower confidence (we're making inferences)
         - Number of variants also affects confidence
         """
@@ -83,8 +101,8 @@ class RiskEngine:
             return 0.91
 
         known_count = sum(
-            1 for v in variants
-            if v.get("rsid", "") in STAR_ALLELE_VARIANTS
+            1 for v in as_records(variants)
+            if self.caller.record_bits(v)
         )
         total = len(variants)
 
@@ -105,60 +123,89 @@ class RiskEngine:
 
         return round(base, 2)
 
-    def filter_variants_for_gene(self, gene: str, variants: List[Dict]) -> List[Dict]:
+    def genes_for_variant(self, variant: VariantLike) -> List[str]:
+        """
+        All pharmacogenes a variant belongs to, by any of:
+        1. it defines a star allele of the gene (by rsID or position/allele)
+        2. gene name appears in the INFO field (case-insensitive)
+        3. position falls inside the gene's window in the interval index
+        """
+        if not isinstance(variant, VariantRecord):
+            variant = VariantRecord.from_mapping(variant)
+        genes = []
+        genes.extend(g for g, _ in self.caller.record_bits(variant))
+
+        info = variant.info
+        if info and self._info_gene_pattern is not None:
+            genes.extend(m.upper() for m in self._info_gene_pattern.findall(info))
+
+        genes.extend(self.gene_index.genes_at(variant.chromosome, variant.position))
+
+        return list(dict.fromkeys(self._gene_names.get(g, g) for g in genes))
+
+    def filter_variants_for_gene(self, gene: str, variants: List[VariantLike]) -> List[VariantRecord]:
         """
         Filter the variant list to only those relevant to the target gene.
-        Strategy:
-        1. Check if rsid is in STAR_ALLELE_VARIANTS for this gene
-        2. Check if gene name appears in INFO field
-        3. Known genomic coordinate ranges (approximate, hg38)
-        """
-        GENE_CHROMOSOMES = {
-            "CYP2D6":  ("22", 42_095_000, 42_130_000),
-            "CYP2C9":  ("10", 94_937_000, 94_979_000),
-            "CYP2C19": ("10", 94_761_000, 94_855_000),
-            "SLCO1B1": ("12", 21_131_000, 21_239_000),
-            "TPMT":    ("6",  18_128_000, 18_155_000),
-            "DPYD":    ("1",  97_540_000, 98_388_000),
-        }
+        For several genes at once, prefer group_variants_by_gene.
+        """
+        return [v for v in as_records(variants) if gene in self.genes_for_variant(v)]
 
-        relevant = []
-        for v in variants:
-            rsid = v.get("rsid", "")
-            info = v.get("info", "")
-            chrom = v.get("chromosome", "").lstrip("chr")
-
-            # 1. Known RSID for this gene
-            if rsid in STAR_ALLELE_VARIANTS:
-                if STAR_ALLELE_VARIANTS[rsid][0] == gene:
-                    relevant.append(v)
-                    continue
-
-            # 2. Gene name in INFO field
-            if gene in info or gene.lower() in info.lower():
-                relevant.append(v)
-                continue
+    def group_variants_by_gene(self, variants: List[VariantLike]) -> Dict[str, List[VariantRecord]]:
+        """
+        Bucket the variant list by pharmacogene in a single pass so that a
+        multi-drug panel can reuse the same gene buckets for every drug.
+        """
+        groups = {gene: [] for gene in self.kb.genes}
+        for v in as_records(variants):
+            for gene in self.genes_for_variant(v):
+                groups.setdefault(gene, []).append(v)
+        return groups
+
+    def genes_for_drugs(self, drugs: Iterable[str]) -> List[str]:
+        """Every gene the drugs need, each once, in first-use order."""
+        return list(dict.fromkeys(g for d in drugs for g in self.drug_genes.get(d.upper(), ())))
 
-            # 3. Genomic coordinate approximation
-            if gene in GENE_CHROMOSOMES:
-                g_chrom, g_start, g_end = GENE_CHROMOSOMES[gene]
-                try:
-                    pos = int(v.get("position", 0))
-                    if chrom == g_chrom and g_start <= pos <= g_end:
-                        relevant.append(v)
-                        continue
-                except (ValueError, TypeError):
-                    pass
+    def call_gene(self, gene: str, variants: List[VariantLike]) -> GeneCall:
+        """Diplotype, phenotype and confidence for one gene from its variants."""
+        variants = as_records(variants)
+        phenotype, allele1, allele2, activity_score = self.determine_phenotype(gene, variants)
+        confidence = self.calculate_confidence(gene, variants, phenotype)
+        return GeneCall(gene, phenotype, allele1, allele2, activity_score, confidence, variants)
 
-        return relevant
+    def call_genes(self, variants_by_gene: Mapping[str, List[VariantLike]],
+                   genes: Optional[Iterable[str]] = None,
+                   calls: Optional[Dict[str, GeneCall]] = None) -> Dict[str, GeneCall]:
+        """
+        Call each gene once per patient (default: every gene any drug uses)
+        from group_variants_by_gene output. Genes already in ``calls`` are
+        not called again; it is extended in place and returned. A panel
+        then resolves each drug from these calls with
+        predict_risk(..., gene_calls=...) and no further genotyping.
+        """
+        calls = {} if calls is None else calls
+        for gene in (self.kb.genes if genes is None else genes):
+            if gene not in calls:
+                calls[gene] = self.call_gene(gene, variants_by_gene.get(gene, []))
+        return calls
 
-    def predict_risk(self, drug: str, variants: List[Dict]) -> Dict:
+    def predict_risk(self, drug: str, variants: List[VariantLike],
+                     gene_variants: Union[List[VariantLike], Mapping[str, List[VariantLike]], None] = None,
+                     gene_calls: Optional[Mapping[str, GeneCall]] = None) -> Dict:
         """
         Main entry point for risk prediction.
         Returns comprehensive result dict.
+
+        Each gene of the drug is called from, in order of preference:
+        ``gene_calls`` (e.g. from call_genes), ``gene_variants`` (a
+        {gene: variants} map such as group_variants_by_gene returns, or the
+        primary gene's variant list), else by filtering ``variants``.
+        The rule comes from the drug's combined-phenotype index; the
+        top-level gene, diplotype and activity score are the primary gene's
+        and ``gene_calls`` lists every gene's call.
         """
-        gene = DRUG_GENE_MAP.get(drug.upper())
-        if not gene:
+        drug = drug.upper()
+        genes = self.drug_genes.get(drug)
+        if not genes:
             return {
                 "gene": "Unknown",
                 "phenotype": "Unknown",
@@ -171,43 +218,160 @@ class RiskEngine:
                 "mechanism": "N/A",
                 "confidence": 0.0,
                 "gene_variants": [],
+                "gene_calls": [],
             }
 
-        # Filter to gene-relevant variants
-        gene_variants = self.filter_variants_for_gene(gene, variants)
+        calls = []
+        for gene in genes:
+            call = gene_calls.get(gene) if gene_calls is not None else None
+            if call is None:
+                if isinstance(gene_variants, Mapping):
+                    gv = gene_variants.get(gene, [])
+                elif gene_variants is not None and gene == genes[0]:
+                    gv = gene_variants
+                else:
+                    gv = self.filter_variants_for_gene(gene, variants)
+                # Activity-score phenotype (CPIC method) and confidence per gene
+                call = self.call_gene(gene, gv)
+            calls.append(call)
 
-        # Determine phenotype using CPIC activity-score method
-        phenotype, allele1, allele2, activity_score = self.determine_phenotype(gene, gene_variants)
+        # One index hit for the drug's phenotype combination (NM fallback compiled in)
+        phenotypes = tuple(c.phenotype for c in calls)
+        rule = self.kb.drug_rule(drug, phenotypes)
+        primary = calls[0]
+        if len(calls) == 1:
+            gene_variants = primary.variants
+        else:
+            gene_variants = [v for c in calls for v in c.variants]
 
-        # Get CPIC rules for this drug+phenotype
-        rules = CPIC_GUIDELINES.get(drug.upper(), {})
-        rule = rules.get(phenotype)
+        return {
+            "gene": primary.gene,
+            "phenotype": primary.phenotype,
+            "allele1": primary.allele1,
+            "allele2": primary.allele2,
+            "activity_score": primary.activity_score,
+            "risk": rule["risk"],
+            "severity": rule["severity"],
+            "recommendation": rule["recommendation"],
+            "mechanism": rule["mechanism"],
+            # As certain as the least certain gene that chose the rule; a
+            # secondary gene that left the primary gene's rule in place adds no doubt
+            "confidence": min(calls[i].confidence for i in self.kb.rule_genes(drug, phenotypes)),
+            "gene_variants": gene_variants,
+            "gene_calls": calls,
+        }
 
-        if rule is None:
-            # Fallback: use NM rules (safest conservative assumption)
-            rule = rules.get("NM", {
-                "risk": "Unknown",
-                "severity": "none",
-                "recommendation": "No CPIC guideline available for this phenotype.",
-                "mechanism": "See CPIC website for latest guidance."
-            })
+    def call_gene_matrix(self, gene: str, rows: List[int], matrix: GenotypeMatrix,
+                         dosages: Optional["np.ndarray"] = None) -> Dict[str, Any]:
+        """
+        Vectorized diplotype, phenotype and confidence for every sample.
+        ``rows`` are the matrix rows relevant to ``gene``. Dosages are read
+        as unphased genotypes (1 → 0/1, 2 → 1/1) and called exactly as
+        determine_diplotype would. Missing calls are treated as reference.
+        """
+        import numpy as np
+        if dosages is None:
+            dosages = np.clip(matrix.dosages, 0, None)
+        n_samples = dosages.shape[1]
+        sub = dosages[np.asarray(rows, dtype=np.intp)] if rows else np.zeros((0, n_samples), np.int8)
+        records = [matrix.variants[i] for i in rows]
+
+        known_mask = np.array([bool(self.caller.record_bits(v)) for v in records], dtype=bool)
+        star_rows = [k for k, v in enumerate(records) if gene in self.caller.genes_for_record(v)]
+        star_records = [records[k] for k in star_rows]
+
+        # Call each distinct genotype pattern over the star rows once, then
+        # broadcast back; cohorts share a handful of patterns per gene.
+        if star_rows:
+            patterns, inverse = np.unique(sub[star_rows].T, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            patterns, inverse = np.zeros((1, 0), np.int8), np.zeros(n_samples, np.intp)
+        calls = [
+            self.caller.call_records(gene, (v.with_genotype(DOSAGE_GENOTYPES[min(int(d), 2)])
+                                            for v, d in zip(star_records, pattern.tolist())))
+            for pattern in patterns
+        ]
+        pheno = [self.kb.phenotype(gene, a1, a2) for a1, a2 in calls]
 
-        confidence = self.calculate_confidence(gene, gene_variants, phenotype)
+        phenotype = np.array([p for p, _ in pheno], dtype=object)[inverse]
+        activity = np.array([a for _, a in pheno], dtype=float)[inverse]
+        allele1 = np.array([a1 for a1, _ in calls], dtype=object)[inverse]
+        allele2 = np.array([a2 for _, a2 in calls], dtype=object)[inverse]
+
+        # Same rules as calculate_confidence, over carried variants per sample
+        carried = sub > 0
+        total = carried.sum(axis=0)
+        known = carried[known_mask].sum(axis=0)
+        base = np.where(
+            known == 0, 0.55,
+            np.where(known == total, 0.93, 0.65 + known / np.maximum(total, 1) * 0.25)
+        )
+        extreme = np.isin(phenotype, ["PM", "URM"])
+        base = np.where(extreme, np.minimum(1.0, base + 0.04), base)
+        confidence = np.round(np.where(total == 0, 0.91, base), 2)
 
         return {
-            "gene": gene,
-            "phenotype": phenotype,
             "allele1": allele1,
             "allele2": allele2,
-            "activity_score": activity_score,
-            "risk": rule["risk"],
-            "severity": rule["severity"],
-            "recommendation": rule["recommendation"],
-            "mechanism": rule["mechanism"],
+            "phenotype": phenotype,
+            "activity_score": activity,
             "confidence": confidence,
-            "gene_variants": gene_variants,
+            "carried": carried,
         }
 
+    def predict_risk_matrix(self, drugs: List[str], matrix: GenotypeMatrix) -> Dict[str, Dict[str, Any]]:
+        """
+        Cohort entry point: columnar risk results for every sample and drug.
+        Genes are bucketed once and each gene is called once, however many
+        drugs share it. Returns {drug: {field: array over samples}}; the
+        call fields are the primary gene's, ``gene_calls`` has every gene's,
+        and ``rows``/``carried`` span all of the drug's genes.
+        """
+        import numpy as np
+        rows_by_gene: Dict[str, List[int]] = {}
+        for i, v in enumerate(matrix.variants):
+            for gene in self.genes_for_variant(v):
+                rows_by_gene.setdefault(gene, []).append(i)
+
+        dosages = np.clip(matrix.dosages, 0, None)
+        gene_calls: Dict[str, Dict[str, Any]] = {}
+        results = {}
+        for drug in drugs:
+            drug = drug.upper()
+            genes = self.drug_genes.get(drug)
+            if not genes:
+                continue
+            for gene in genes:
+                if gene not in gene_calls:
+                    gene_calls[gene] = {"gene": gene, **self.call_gene_matrix(
+                        gene, rows_by_gene.get(gene, []), matrix, dosages)}
+            calls = [gene_calls[gene] for gene in genes]
+            primary = calls[0]
+
+            # Resolve each distinct phenotype combination once, then broadcast
+            key = primary["phenotype"].astype(str)
+            for c in calls[1:]:
+                key = np.char.add(np.char.add(key, "|"), c["phenotype"].astype(str))
+            uniq, inverse = np.unique(key, return_inverse=True)
+            combos = [tuple(k.split("|")) for k in uniq.tolist()]
+            rules = [self.kb.drug_rule(drug, codes) for codes in combos]
+            inverse = inverse.reshape(-1)
+            # (genes, samples) mask of the calls that chose each sample's rule
+            deciding = np.array([[i in self.kb.rule_genes(drug, codes) for codes in combos]
+                                 for i in range(len(genes))])[:, inverse]
+            results[drug] = {
+                **primary,
+                "rows": [i for gene in genes for i in rows_by_gene.get(gene, [])],
+                "carried": np.vstack([c["carried"] for c in calls]),
+                "confidence": np.where(deciding, np.vstack([c["confidence"] for c in calls]), np.inf).min(axis=0),
+                "gene_calls": calls,
+                "risk": np.array([r["risk"] for r in rules], dtype=object)[inverse],
+                "severity": np.array([r["severity"] for r in rules], dtype=object)[inverse],
+                "recommendation": np.array([r["recommendation"] for r in rules], dtype=object)[inverse],
+            }
+        return results
+
     def generate_diplotype_string(self, phenotype: str) -> str:
         """Legacy helper — kept for schema compatibility"""
         if phenotype == "NM":  return "*1/*1"
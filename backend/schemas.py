@@ -13,11 +13,17 @@ class Variant(BaseModel):
     reference: str
     alternate: str
 
+class GeneDiplotype(BaseModel):
+    gene: str
+    diplotype: str
+    phenotype: str = Field(..., pattern="^(PM|IM|NM|RM|URM|Unknown)$")
+
 class PharmacogenomicProfile(BaseModel):
     primary_gene: str
     diplotype: str
     phenotype: str = Field(..., pattern="^(PM|IM|NM|RM|URM|Unknown)$")
     detected_variants: List[Variant]
+    secondary_genes: List[GeneDiplotype] = []
 
 class ClinicalRecommendation(BaseModel):
     cpic_guideline_reference: str
@@ -44,3 +50,30 @@ class AnalysisResult(BaseModel):
     clinical_recommendation: ClinicalRecommendation
     llm_generated_explanation: LLMExplanation
     quality_metrics: QualityMetrics
+    knowledge_base_version: Optional[str] = None
+    explanation_job_id: Optional[str] = None
+
+class ExplanationJob(BaseModel):
+    job_id: str
+    status: str = Field(..., pattern="^(pending|ready|failed)$")
+    explanation: Optional[LLMExplanation] = None
+
+class PanelResult(BaseModel):
+    patient_id: str
+    results: List[AnalysisResult]
+
+class ProfileGene(BaseModel):
+    gene: str
+    diplotype: str
+    phenotype: str = Field(..., pattern="^(PM|IM|NM|RM|URM|Unknown)$")
+    activity_score: Optional[float] = None
+    detected_variants: int
+
+class ProfileSummary(BaseModel):
+    profile_id: str
+    patient_id: str
+    created_at: str
+    expires_at: Optional[str] = None
+    vcf_parsing_success: bool
+    knowledge_base_version: str
+    genes: List[ProfileGene]
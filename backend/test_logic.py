@@ -9,9 +9,10 @@ project_root = os.path.dirname(current_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from backend.vcf_parser import VCFParser
+from backend.vcf_parser import VCFParser, TargetFilter
 from backend.risk_engine import RiskEngine
-from backend.knowledge_base import DRUG_GENE_MAP, STAR_ALLELE_VARIANTS, CPIC_GUIDELINES
+from backend.knowledge_base import DRUG_GENE_MAP, DRUG_GENES, STAR_ALLELE_VARIANTS, CPIC_GUIDELINES
+from backend.bgzf import compress_bgzf, build_tabix_index
 
 def test_vcf_parsing_valid():
     content = b"""##fileformat=VCFv4.2
@@ -38,6 +39,187 @@ chr10\t96522463\trs12345\tC\tT
     # Should not crash, and INFO should be empty string (default)
     assert variants[0]['info'] == ""
 
+def test_vcf_streaming_matches_whole_file_parse():
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        content = fh.read()
+    expected = VCFParser(content).parse()
+
+    # Feed in tiny chunks so lines are split across chunk boundaries
+    streamed = VCFParser()
+    chunks = (content[i:i + 7] for i in range(0, len(content), 7))
+    variants = list(streamed.iter_variants(chunks))
+    assert variants == expected
+    assert streamed.validate() is True
+
+def test_vcf_validate_rejects_missing_header():
+    content = b"#CHROM\tPOS\tID\tREF\tALT\nchr1\t1\trs1\tA\tG\n"
+    parser = VCFParser()
+    assert len(list(parser.iter_variants([content]))) == 1
+    assert parser.validate() is False
+    assert VCFParser(content).validate() is False
+
+def _synthetic_genome_vcf() -> bytes:
+    lines = ["##fileformat=VCFv4.2", "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+    for chrom in ("chr1", "chr6", "chr10", "chr12", "chr22"):
+        for pos in range(1_000_000, 120_000_000, 50_000):
+            lines.append(f"{chrom}\t{pos}\t.\tA\tG\t.\t.\t.")
+    lines.append("chr22\t42128945\trs3892097\tC\tT\t.\t.\t.")
+    lines.sort(key=lambda l: (not l.startswith("#"), l.split("\t")[0],
+                              int(l.split("\t")[1]) if not l.startswith("#") else 0))
+    return ("\n".join(lines) + "\n").encode()
+
+def test_vcf_gzip_stream_matches_plain():
+    import gzip
+    plain = _synthetic_genome_vcf()
+    expected = VCFParser(plain).parse()
+
+    gz_parser = VCFParser()
+    gz = gzip.compress(plain)
+    chunks = [gz[i:i + 4096] for i in range(0, len(gz), 4096)]
+    assert list(gz_parser.iter_variants(chunks)) == expected
+    assert gz_parser.validate() is True
+
+    # BGZF is multi-member gzip and must stream the same way
+    assert VCFParser(compress_bgzf(plain, block_size=4096)).parse() == expected
+
+    # Inflation is bounded: tiny pieces of output, a capped line and a capped total
+    import pytest
+    from backend.bgzf import GzipInflater
+    assert b"".join(GzipInflater(piece_size=1000).iter_decompress(gz)) == plain
+    with pytest.raises(ValueError):
+        list(VCFParser(gz, max_inflated_bytes=len(plain) // 2).iter_variants())
+    bomb = gzip.compress(b"A" * (4 << 20))
+    with pytest.raises(ValueError):
+        list(VCFParser(bomb, max_line_bytes=1 << 20).iter_variants())
+
+    from fastapi.testclient import TestClient
+    from backend import main, vcf_parser
+    res = TestClient(main.app).post("/analyze", files={"file": ("b.vcf.gz", gzip.compress(
+        b"A" * (vcf_parser.MAX_LINE_BYTES + 1)), "application/gzip")}, data={"drug": "CODEINE"})
+    assert res.status_code == 400 and "longer than" in res.json()["detail"]
+
+def test_vcf_tabix_region_seek():
+    import io
+    from backend.knowledge_base import GENE_CHROMOSOMES
+    plain = _synthetic_genome_vcf()
+    bgz = io.BytesIO(compress_bgzf(plain, block_size=4096))
+    tbi = build_tabix_index(bgz)
+
+    parser = VCFParser()
+    seeked = list(parser.iter_regions(bgz, tbi, GENE_CHROMOSOMES.values()))
+    assert parser.validate() is True
+
+    def in_window(v):
+        chrom = v["chromosome"].lstrip("chr")
+        pos = int(v["position"])
+        return any(chrom == c and s <= pos <= e for c, s, e in GENE_CHROMOSOMES.values())
+
+    expected = [v for v in VCFParser(plain).parse() if in_window(v)]
+    key = lambda v: (v["chromosome"], int(v["position"]))
+    assert sorted(seeked, key=key) == sorted(expected, key=key)
+    assert any(v["rsid"] == "rs3892097" for v in seeked)
+
+    from fastapi.testclient import TestClient
+    from backend.main import app
+    res = TestClient(app).post(
+        "/analyze",
+        files={"file": ("g.vcf.gz", bgz.getvalue(), "application/gzip"),
+               "index": ("g.vcf.gz.tbi", tbi, "application/octet-stream")},
+        data={"drug": "CODEINE"},
+    )
+    assert res.status_code == 200
+    assert res.json()["pharmacogenomic_profile"]["diplotype"] == "*1/*4"
+
+    # Past the streamed-upload cap, an indexed upload is still accepted: only its windows are read
+    import base64
+    import random
+    from backend import main
+    rng = random.Random(1)
+    lines = ["##fileformat=VCFv4.2", "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+    lines += [f"chr1\t{1000 + i * 100}\t.\tA\tG\t.\t.\tX={base64.b64encode(rng.randbytes(3000)).decode()}"
+              for i in range(2000)]
+    lines.append("chr22\t42128945\trs3892097\tC\tT\t.\t.\t.\tGT\t1/1")
+    big = compress_bgzf(("\n".join(lines) + "\n").encode())
+    assert len(big) > main.MAX_UPLOAD_BYTES
+    big_tbi = build_tabix_index(io.BytesIO(big))
+    res = TestClient(app).post("/analyze", files={"file": ("big.vcf.gz", big, "application/gzip"),
+                                                  "index": ("big.vcf.gz.tbi", big_tbi, "application/octet-stream")},
+                               data={"drug": "CODEINE"})
+    assert res.status_code == 200 and res.json()["pharmacogenomic_profile"]["diplotype"] == "*4/*4"
+    res = TestClient(app).post("/analyze", files={"file": ("big.vcf.gz", big, "application/gzip")},
+                               data={"drug": "CODEINE"})
+    assert res.status_code == 400 and "too large" in res.json()["detail"]
+
+    # A truncated index is a bad upload, not a server error
+    res = TestClient(app).post(
+        "/analyze",
+        files={"file": ("g.vcf.gz", bgz.getvalue(), "application/gzip"),
+               "index": ("g.vcf.gz.tbi", tbi[:len(tbi) // 2], "application/octet-stream")},
+        data={"drug": "CODEINE"},
+    )
+    assert res.status_code == 400
+
+def test_vcf_from_path_mmap_matches_in_memory_parse(tmp_path, monkeypatch):
+    import tracemalloc
+    from backend import vcf_parser
+    lines = [b"##fileformat=VCFv4.2", b"##source=test",
+             b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tP1"]
+    for i in range(40_000):
+        lines.append(b"chr%d\t%d\trs%d\tA\tG\t50\tPASS\tDP=30\tGT\t0/1" % (i % 22 + 1, i * 997, 10**8 + i))
+    lines[1000] = b"22\t42128945\trs3892097\tC\tT\t.\t.\t.\tGT\t1/1"
+    lines[2000] = b"chr10\t94781859\t.\tG\tA\t.\t.\tgene=cyp2c19;" + b"X" * 100_000 + b"\tGT\t0/1"
+    lines[3000] = b"chr1\t5\trs4244285\tG\tA\t.\t.\t.\tGT\t0/1"
+    content = b"\n".join(lines)
+    path = tmp_path / "big.vcf"
+    path.write_bytes(content)
+
+    targets = TargetFilter.pharmacogenes()
+    expected = VCFParser(content, targets=targets).parse()
+    monkeypatch.setattr(vcf_parser, "MAPPED_BLOCK_SIZE", 64 * 1024)
+    tracemalloc.start()
+    with VCFParser.from_path(str(path), targets=targets) as parser:
+        mapped = parser.parse()
+        _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert mapped == expected and len(mapped) >= 3
+    chunks = [content[i:i + 7777] for i in range(0, len(content), 7777)]
+    assert list(VCFParser(targets=targets).iter_variants(chunks)) == expected
+    engine = RiskEngine()
+    assert engine.group_variants_by_gene(expected) == engine.group_variants_by_gene(VCFParser(content).parse())
+    assert parser.validate() is True
+    assert peak < len(content) / 4
+    with VCFParser.from_path(str(path)) as parser:
+        assert parser.parse() == VCFParser(content).parse()
+
+def test_vcf_target_prefilter_keeps_engine_relevant_variants():
+    plain = _synthetic_genome_vcf() + b"chr3\t5\trs1\tA\tG\t.\t.\tGENE=cyp2c19\n"
+    engine = RiskEngine()
+    all_variants = VCFParser(plain).parse()
+    targeted = VCFParser(plain, targets=TargetFilter.pharmacogenes()).parse()
+
+    assert len(targeted) < len(all_variants) / 10
+    assert engine.group_variants_by_gene(targeted) == engine.group_variants_by_gene(all_variants)
+    assert any(v["rsid"] == "rs1" for v in targeted)
+
+def test_target_prefilter_covers_allele_definition_variants():
+    from backend.knowledge_base import ALLELE_ACTIVITY_SCORES, CompiledKnowledgeBase
+    kb = CompiledKnowledgeBase(ALLELE_ACTIVITY_SCORES, STAR_ALLELE_VARIANTS, CPIC_GUIDELINES, allele_definitions={
+        "CYP2D6": {"*99": [("rs99999901", None, None, "", "T"), (None, "22", 1000, "A", "G")]},
+    })
+    engine = RiskEngine(kb=kb)
+    lines = [b"chr1\t5\trs99999901\tC\tT\t.\tPASS\t.\tGT\t0/1",
+             b"chr22\t1000\t.\tA\tG\t.\tPASS\t.\tGT\t0/1"]
+    stock = TargetFilter.pharmacogenes()
+    targets = TargetFilter.pharmacogenes(kb, engine.gene_index)
+    for line in lines:
+        assert not stock.matches(line)
+        assert targets.matches(line)
+    content = b"##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n" + b"\n".join(lines) + b"\n"
+    kept = VCFParser(content, targets=targets).parse()
+    assert len(kept) == 2
+    assert engine.group_variants_by_gene(kept) == engine.group_variants_by_gene(VCFParser(content).parse())
+    assert len(engine.group_variants_by_gene(kept).get("CYP2D6", [])) == 2
+
 def test_risk_prediction_codeine_pm():
     engine = RiskEngine()
     # CYP2D6 *4/*4 (PM) -> Ineffective
@@ -84,6 +266,20 @@ def test_risk_prediction_warfarin_nm():
     assert risk['phenotype'] == 'NM'
     assert risk['risk'] == 'Safe'
 
+def test_compiled_knowledge_base_matches_tables():
+    from backend.knowledge_base import (
+        COMPILED_KB, ALLELE_ACTIVITY_SCORES, activity_score_to_phenotype,
+    )
+    for (gene, a1, a2), (phenotype, activity) in COMPILED_KB.phenotypes.items():
+        scores = ALLELE_ACTIVITY_SCORES[gene]
+        expected = scores.get(a1, scores["default"]) + scores.get(a2, scores["default"])
+        assert phenotype == activity_score_to_phenotype(gene, a1, a2)
+        assert activity == round(expected, 2)
+
+    assert COMPILED_KB.rule("WARFARIN", "URM") == CPIC_GUIDELINES["WARFARIN"]["NM"]
+    assert COMPILED_KB.rule("CODEINE", "PM")["risk"] == "Ineffective"
+    assert COMPILED_KB.phenotype("CYP2D6", "*99", "*4") == ("IM", 1.0)
+
 def test_knowledge_base_integrity():
     # Check for duplicate keys in STAR_ALLELE_VARIANTS (though Python dicts swallow them, we want to ensure we cleaned up)
     # We can't easily check for meaningful duplicates in a loaded dict, but we can verify our specific fix.
@@ -94,6 +290,506 @@ def test_knowledge_base_integrity():
     assert "rs1800462" in STAR_ALLELE_VARIANTS
     assert STAR_ALLELE_VARIANTS["rs1800462"][1] == "*2"
 
+def test_group_variants_by_gene_matches_filter():
+    engine = RiskEngine()
+    variants = [
+        {"rsid": "rs3892097", "info": "", "chromosome": "22", "position": "42128945", "reference": "C", "alternate": "T"},
+        {"rsid": "rs4244285", "info": "", "chromosome": "10", "position": "94781859", "reference": "G", "alternate": "A"},
+    ]
+    groups = engine.group_variants_by_gene(variants)
+    assert set(groups) == {g for genes in DRUG_GENES.values() for g in genes}
+    for gene, bucket in groups.items():
+        assert bucket == engine.filter_variants_for_gene(gene, variants)
+
+def test_gene_interval_index_and_bed(tmp_path):
+    from backend.gene_regions import GeneIntervalIndex
+    bed = tmp_path / "genes.bed"
+    bed.write_text(
+        "browser position chr10:94760999-94979000\n"
+        "track name=pgx\n"
+        "# pharmacogene windows\n"
+        "chr10\t94760999\t94855000\tCYP2C19\r\n"
+        "\n"
+        "chr10 94936999 94979000 CYP2C9\n"
+        "chr16\t31090000\t31096000\tVKORC1\t0\t+\n"
+        "chr10\t94800000\t94940000\tOVERLAP\n"
+    )
+    index = GeneIntervalIndex.from_bed(str(bed))
+    assert index.genes_at("chr10", 94761000) == ["CYP2C19"]
+    assert index.genes_at("10", 94760999) == []
+    assert sorted(index.genes_at("chr10", 94938000)) == ["CYP2C9", "OVERLAP"]
+    assert index.genes_at("16", 31091000) == ["VKORC1"]
+    assert index.genes_at("chrX", 1) == []
+
+    engine = RiskEngine(gene_index=index)
+    groups = engine.group_variants_by_gene([
+        {"rsid": ".", "chromosome": "chr16", "position": "31091000", "info": ""},
+    ])
+    assert len(groups["VKORC1"]) == 1
+
+def test_panel_endpoint_scores_all_drugs():
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    client = TestClient(app)
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        content = fh.read()
+    res = client.post(
+        "/analyze/panel",
+        files={"file": ("p.vcf", content, "text/plain")},
+        data={"drugs": "all", "patient_id": "P1"},
+    )
+    assert res.status_code == 200
+    body = res.json()
+    assert [r["drug"] for r in body["results"]] == list(DRUG_GENE_MAP.keys())
+
+    single = client.post(
+        "/analyze",
+        files={"file": ("p.vcf", content, "text/plain")},
+        data={"drug": "CLOPIDOGREL", "patient_id": "P1"},
+    ).json()
+    panel_row = next(r for r in body["results"] if r["drug"] == "CLOPIDOGREL")
+    assert panel_row["pharmacogenomic_profile"] == single["pharmacogenomic_profile"]
+    assert panel_row["risk_assessment"] == single["risk_assessment"]
+
+def test_lru_cache_eviction_and_ttl():
+    import time
+    from backend.cache import LRUCache
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    short = LRUCache(maxsize=2, ttl=0.01)
+    short.set("a", 1)
+    time.sleep(0.02)
+    assert short.get("a") is None
+
+def test_repeated_genotype_skips_llm(monkeypatch):
+    from fastapi.testclient import TestClient
+    from backend import main
+
+    calls = []
+    real = main.llm_service.explain_async
+
+    async def counting(**kw):
+        calls.append(kw)
+        return await real(**kw)
+    monkeypatch.setattr(main.llm_service, "explain_async", counting)
+    main.analysis_cache.clear()
+
+    client = TestClient(main.app)
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        content = fh.read()
+    first = client.post("/analyze", files={"file": ("a.vcf", content)},
+                        data={"drug": "WARFARIN", "patient_id": "A"}).json()
+    second = client.post("/analyze", files={"file": ("b.vcf", content)},
+                         data={"drug": "WARFARIN", "patient_id": "B"}).json()
+
+    assert len(calls) == 1
+    assert second["patient_id"] == "B"
+    assert second["llm_generated_explanation"] == first["llm_generated_explanation"]
+    stats = client.get("/stats").json()["analysis_cache"]
+    assert stats["hits"] >= 1
+
+class _FakeGemini:
+    """Stand-in model whose async call sleeps for `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def generate_content_async(self, prompt):
+        import asyncio
+        import json
+        await asyncio.sleep(self.delay)
+
+        class _Response:
+            text = json.dumps({"summary": "s", "biological_mechanism": "m",
+                               "variant_citations": [], "confidence_reasoning": "c"})
+        return _Response()
+
+def test_llm_async_timeout_falls_back_to_template():
+    import asyncio
+    from backend.llm_service import LLMService
+    svc = LLMService()
+    svc.model = _FakeGemini(delay=1.0)
+    svc.timeout = 0.05
+    result = asyncio.run(svc.generate_explanation_async(
+        "CODEINE", "CYP2D6", "NM", "Safe", [], "rec", "mech"))
+    assert result["summary"] != "s"
+    assert "CODEINE" in result["summary"]
+
+def test_llm_fallback_is_not_cached_as_the_explanation(monkeypatch):
+    from fastapi.testclient import TestClient
+    from backend import main
+    monkeypatch.setattr(main.llm_service, "model", _FakeGemini(delay=1.0))
+    monkeypatch.setattr(main.llm_service, "timeout", 0.05)
+    monkeypatch.setattr(main, "FALLBACK_CACHE_TTL", 0)
+    main.analysis_cache.clear()
+    client = TestClient(main.app)
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        content = fh.read()
+
+    def analyze():
+        res = client.post("/analyze", files={"file": ("p.vcf", content)}, data={"drug": "CODEINE"})
+        return res.json()["llm_generated_explanation"]["summary"]
+
+    assert analyze() != "s"  # timed out: template
+    main.llm_service.model = _FakeGemini(delay=0)
+    assert analyze() == "s"  # the fallback was not kept; the LLM is asked again
+    main.analysis_cache.clear()
+
+def test_llm_timed_out_thread_call_keeps_its_slot():
+    import asyncio
+    import json
+    import threading
+    from backend.llm_service import LLMService
+    release = threading.Event()
+    started = []
+
+    class _BlockingGemini:
+        """Sync-only model: runs on the executor and blocks until released."""
+
+        def generate_content(self, prompt):
+            started.append(prompt)
+            release.wait(5)
+
+            class _Response:
+                text = json.dumps({"summary": "s", "biological_mechanism": "m",
+                                   "variant_citations": [], "confidence_reasoning": "c"})
+            return _Response()
+
+    svc = LLMService()
+    svc.model = _BlockingGemini()
+    svc.timeout = 0.05
+    svc.max_concurrency = 1
+
+    async def run():
+        first = await svc.generate_explanation_async("CODEINE", "CYP2D6", "NM", "Safe", [], "r", "m")
+        # The timed-out worker still holds the only slot: no second outbound call
+        second = await svc.generate_explanation_async("WARFARIN", "CYP2C9", "NM", "Safe", [], "r", "m")
+        assert len(started) == 1
+        release.set()
+        await asyncio.sleep(0.05)
+        third = await svc.generate_explanation_async("WARFARIN", "CYP2C9", "NM", "Safe", [], "r", "m")
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert "CODEINE" in first["summary"] and "WARFARIN" in second["summary"]
+    assert len(started) == 2 and third["summary"] == "s"
+
+def test_llm_async_calls_overlap_within_limit():
+    import asyncio
+    import time
+    from backend.llm_service import LLMService
+    svc = LLMService()
+    svc.model = _FakeGemini(delay=0.1)
+    svc.max_concurrency = 4
+
+    async def run():
+        return await asyncio.gather(*(
+            svc.generate_explanation_async("CODEINE", "CYP2D6", "NM", "Safe", [], "r", "m")
+            for _ in range(8)
+        ))
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    assert all(r["summary"] == "s" for r in results)
+    # 8 calls, 4 at a time, 0.1 s each: two waves rather than eight serial calls
+    assert 0.2 <= elapsed < 0.6
+
+def test_fake_llm_backend(monkeypatch):
+    import asyncio
+    import random
+    import pytest
+    from backend.fake_llm import FakeGeminiModel, parse_latency
+    from backend.llm_service import LLMService
+    assert parse_latency("fixed:250")(random.Random()) == 0.25
+    assert 0.01 <= parse_latency("uniform:10,20")(random.Random(1)) <= 0.02
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1")
+
+    monkeypatch.setenv("PHARMAGUARD_LLM_BACKEND", "fake")
+    monkeypatch.setenv("PHARMAGUARD_FAKE_LLM_LATENCY", "fixed:1")
+    monkeypatch.setenv("PHARMAGUARD_EXPLANATION_DB", "")
+    svc = LLMService()
+    assert svc.model is None and svc.warming
+    v = {"rsid": "rs3892097", "gene": "CYP2D6"}
+    result = asyncio.run(svc.generate_explanation_async(
+        "CODEINE", "CYP2D6", "PM", "Ineffective", [v], "rec", "mech"))
+    assert result["summary"].startswith("[fake] CYP2D6")
+    assert svc.model_name == "fake-gemini" and not svc.warming
+    assert result["variant_citations"] == ["rs3892097"]
+
+    # Injected errors fall back to the template explanation
+    svc.model = FakeGeminiModel(latency="fixed:1", error_rate=1.0, seed=0)
+    result = asyncio.run(svc.generate_explanation_async(
+        "CODEINE", "CYP2D6", "PM", "Ineffective", [v], "rec", "mech"))
+    assert not result["summary"].startswith("[fake]")
+    assert svc.model.calls == 1
+
+    monkeypatch.setenv("PHARMAGUARD_LLM_BACKEND", "none")
+    assert LLMService().model is None
+
+def test_deferred_explanation_job(monkeypatch):
+    import time
+    from fastapi.testclient import TestClient
+    from backend import main
+
+    monkeypatch.setattr(main.llm_service, "model", _FakeGemini(delay=0.3))
+    main.analysis_cache.clear()
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        content = fh.read()
+
+    with TestClient(main.app) as client:
+        res = client.post("/analyze", files={"file": ("a.vcf", content)},
+                          data={"drug": "CODEINE", "explain": "deferred"}).json()
+        job_id = res["explanation_job_id"]
+        assert job_id
+        assert res["risk_assessment"]["risk_label"]
+        assert res["llm_generated_explanation"]["summary"] != "s"  # template for now
+
+        # A concurrent miss for the same genotype joins the running job
+        dup = client.post("/analyze", files={"file": ("b.vcf", content)},
+                          data={"drug": "CODEINE", "explain": "deferred"}).json()
+        assert dup["explanation_job_id"] == job_id
+
+        for _ in range(50):
+            job = client.get(f"/explanations/{job_id}").json()
+            if job["status"] != "pending":
+                break
+            time.sleep(0.02)
+        assert job["status"] == "ready"
+        assert job["explanation"]["summary"] == "s"
+
+        # The finished explanation is now cached for the same genotype
+        again = client.post("/analyze", files={"file": ("a.vcf", content)},
+                            data={"drug": "CODEINE", "explain": "deferred"}).json()
+        assert again["explanation_job_id"] is None
+        assert again["llm_generated_explanation"]["summary"] == "s"
+
+        assert client.get("/explanations/nope").status_code == 404
+
+def test_explanation_store_dedupes_and_evicts(tmp_path):
+    import json
+    from backend.explanation_store import ExplanationStore
+    from backend.llm_service import LLMService
+
+    class CountingModel:
+        calls = 0
+
+        def generate_content(self, prompt):
+            CountingModel.calls += 1
+
+            class _Response:
+                text = json.dumps({"summary": "g", "biological_mechanism": "m",
+                                   "variant_citations": [], "confidence_reasoning": "c"})
+            return _Response()
+
+    db = str(tmp_path / "expl.sqlite3")
+    svc = LLMService()
+    svc.model = CountingModel()
+    svc.store = ExplanationStore(db, max_entries=2)
+    args = ("CODEINE", "CYP2D6", "IM", "Adjust Dosage", [{"rsid": "rs3892097"}], "rec", "mech")
+    assert svc.generate_explanation(*args)["summary"] == "g"
+    assert svc.generate_explanation(*args)["summary"] == "g"
+    assert CountingModel.calls == 1
+
+    # Survives a "restart": a fresh service on the same file reuses it
+    fresh = LLMService()
+    fresh.model = CountingModel()
+    fresh.store = ExplanationStore(db, max_entries=2)
+    fresh.generate_explanation(*args)
+    assert CountingModel.calls == 1
+
+    for phenotype in ("PM", "NM"):
+        fresh.generate_explanation("CODEINE", "CYP2D6", phenotype, "Safe", [], "rec", "mech")
+    assert len(fresh.store) == 2
+
+def test_batch_cli_isolates_bad_files(tmp_path):
+    import json
+    import zipfile
+    from backend import batch
+
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        good = fh.read()
+    cohort = tmp_path / "cohort"
+    cohort.mkdir()
+    (cohort / "P1.vcf").write_bytes(good)
+    (cohort / "BAD.vcf").write_bytes(b"not a vcf\n")
+    with zipfile.ZipFile(tmp_path / "more.zip", "w") as zf:
+        zf.writestr("P2.vcf", good)
+
+    out = tmp_path / "out.ndjson"
+    code = batch.main([str(cohort), str(tmp_path / "more.zip"),
+                       "--drugs", "codeine,warfarin", "--workers", "2", "--output", str(out)])
+    records = {r["patient_id"]: r for r in map(json.loads, out.read_text().splitlines())}
+
+    assert code == 1
+    assert set(records) == {"P1", "P2", "BAD"}
+    assert "error" in records["BAD"]
+    assert [r["drug"] for r in records["P1"]["results"]] == ["CODEINE", "WARFARIN"]
+    assert records["P1"]["results"] == records["P2"]["results"]
+
+def test_batch_endpoint_streams_ndjson(monkeypatch):
+    import json
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        good = fh.read()
+    res = TestClient(app).post(
+        "/analyze/batch",
+        files=[("files", ("A.vcf", good)), ("files", ("B.txt", b"x")), ("files", ("C.vcf", good))],
+        data={"drugs": "all"},
+    )
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in res.text.splitlines()]
+    assert sorted(r["file"] for r in records) == ["A.vcf", "B.txt", "C.vcf"]
+    assert sum("error" in r for r in records) == 1
+    assert all(len(r["results"]) == len(DRUG_GENE_MAP) for r in records if "error" not in r)
+
+    # Oversized files and zip members get error lines; an oversized batch is rejected
+    import io
+    import zipfile
+    from backend import main
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("big.vcf", good + b"#" * (main.MAX_UPLOAD_BYTES + 1))
+        zf.writestr("ok.vcf", good)
+    res = TestClient(app).post("/analyze/batch", files=[("files", ("m.zip", archive.getvalue()))],
+                               data={"drugs": "CODEINE"})
+    records = {r["file"]: r for r in map(json.loads, res.text.splitlines())}
+    assert "too large" in records["m.zip:big.vcf"]["error"] and "results" in records["m.zip:ok.vcf"]
+    monkeypatch.setattr(main, "MAX_BATCH_BYTES", len(good) + 1)
+    res = TestClient(app).post("/analyze/batch", files=[("files", ("A.vcf", good)), ("files", ("B.vcf", good))],
+                               data={"drugs": "CODEINE"})
+    assert res.status_code == 400 and "Batch too large" in res.json()["detail"]
+
+    # A reload mid-batch retires the pool only once that batch lets go of it
+    import pytest
+    pool = main._acquire_batch_pool()
+    main._on_knowledge_base_reload(None, None)
+    assert pool.submit(len, b"ab").result() == 2
+    main._release_batch_pool(pool)
+    with pytest.raises(RuntimeError):
+        pool.submit(len, b"")
+
+def _multi_sample_vcf(n_samples, seed=7, max_dosage=1):
+    import random
+    rng = random.Random(seed)
+    rows = [
+        ("chr22", 42126640, "rs16947", "C", "T"),
+        ("chr22", 42128945, "rs3892097", "C", "T"),
+        ("chr22", 42127941, "rs28371725", "C", "T"),
+        ("chr10", 94942295, "rs1057910", "A", "C"),
+        ("chr10", 94938658, "rs1799853", "C", "T"),
+        ("chr10", 94762733, "rs4244285", "G", "A"),
+        ("chr10", 94800000, ".", "A", "G"),
+        ("chr6", 18128556, "rs1142345", "A", "G"),
+        ("chr3", 100, "rs999", "A", "G"),
+    ]
+    gts = {0: "0/0", 1: "0|1", 2: "1/1"}
+    samples = [f"S{i}" for i in range(n_samples)]
+    lines = ["##fileformat=VCFv4.2",
+             "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" + "\t".join(samples)]
+    for chrom, pos, rsid, ref, alt in rows:
+        calls = [gts[rng.choice(range(max_dosage + 1))] + ":35" for _ in samples]
+        if rsid == "rs1142345":
+            calls[0] = "./.:0"
+        lines.append(f"{chrom}\t{pos}\t{rsid}\t{ref}\t{alt}\t.\t.\t.\tGT:DP\t" + "\t".join(calls))
+    return ("\n".join(lines) + "\n").encode()
+
+def test_genotype_matrix_parsing():
+    matrix = VCFParser(_multi_sample_vcf(5, max_dosage=2)).parse_genotype_matrix()
+    assert matrix.samples == [f"S{i}" for i in range(5)]
+    assert matrix.dosages.shape == (9, 5)
+    assert str(matrix.dosages.dtype) == "int8"
+    assert matrix.dosages.min() >= -1 and matrix.dosages.max() <= 2
+    assert matrix.dosages[7, 0] == -1
+
+def test_vectorized_cohort_matches_per_sample_engine():
+    engine = RiskEngine()
+    matrix = VCFParser(_multi_sample_vcf(40, max_dosage=2)).parse_genotype_matrix()
+    drugs = list(DRUG_GENE_MAP)
+    cohort = engine.predict_risk_matrix(drugs, matrix)
+    for s in range(len(matrix.samples)):
+        carried = matrix.sample_variants(s)
+        for drug in drugs:
+            single = engine.predict_risk(drug, carried)
+            col = cohort[drug]
+            assert (col["allele1"][s], col["allele2"][s]) == (single["allele1"], single["allele2"])
+            assert col["phenotype"][s] == single["phenotype"]
+            assert col["activity_score"][s] == single["activity_score"]
+            assert col["risk"][s] == single["risk"]
+            assert col["confidence"][s] == single["confidence"]
+
+def test_batch_splits_multi_sample_vcf():
+    from backend import batch
+    records = batch.analyze_file("cohort.vcf", _multi_sample_vcf(3), ["CODEINE"])
+    assert [r["patient_id"] for r in records] == ["S0", "S1", "S2"]
+    assert all(len(r["results"]) == 1 for r in records)
+
+def test_vectorized_cohort_counts_homozygous_dosage():
+    content = (b"##fileformat=VCFv4.2\n"
+               b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tA\tB\n"
+               b"chr22\t42128945\trs3892097\tC\tT\t.\t.\t.\tGT\t1/1\t0/1\n")
+    matrix = VCFParser(content).parse_genotype_matrix()
+    codeine = RiskEngine().predict_risk_matrix(["CODEINE"], matrix)["CODEINE"]
+    assert list(zip(codeine["allele1"], codeine["allele2"])) == [("*4", "*4"), ("*1", "*4")]
+    assert list(codeine["phenotype"]) == ["PM", "IM"]
+def _single_sample_vcf(*calls):
+    rows = {"rs3892097": ("chr22", 42128945), "rs1065852": ("chr22", 42130692),
+            "rs16947": ("chr22", 42126640)}
+    lines = ["##fileformat=VCFv4.2",
+             "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tP1"]
+    for rsid, gt in calls:
+        chrom, pos = rows[rsid]
+        lines.append(f"{chrom}\t{pos}\t{rsid}\tC\tT\t.\t.\t.\tDP:GT\t30:{gt}")
+    return ("\n".join(lines) + "\n").encode()
+
+def test_genotype_aware_diplotype_calls():
+    engine = RiskEngine()
+
+    def call(*calls):
+        variants = VCFParser(_single_sample_vcf(*calls)).parse()
+        p = engine.predict_risk("CODEINE", variants)
+        return p["allele1"], p["allele2"], p["phenotype"]
+
+    assert call(("rs3892097", "1/1")) == ("*4", "*4", "PM")
+    assert call(("rs3892097", "0/1")) == ("*1", "*4", "IM")
+    assert call(("rs3892097", "0/0")) == ("*1", "*1", "NM")
+    assert call(("rs3892097", "./.")) == ("*1", "*1", "NM")
+    # cis: both alts on haplotype 1 leave haplotype 2 wild-type
+    assert call(("rs3892097", "1|0"), ("rs1065852", "1|0"))[:2] == ("*1", "*4")
+    # trans: one alt per haplotype
+    assert call(("rs3892097", "1|0"), ("rs1065852", "0|1"))[:2] == ("*4", "*10")
+    # no GT column keeps the per-line heterozygous reading
+    legacy = [{"rsid": "rs16947"}, {"rsid": "rs16947"}]
+    assert engine.determine_diplotype("CYP2D6", legacy) == ("*2", "*2")
+
+def test_fingerprint_distinguishes_zygosity():
+    from backend.cache import genotype_fingerprint
+    het = VCFParser(_single_sample_vcf(("rs3892097", "0/1"))).parse()
+    hom = VCFParser(_single_sample_vcf(("rs3892097", "1/1"))).parse()
+    assert genotype_fingerprint("CODEINE", het, "v") != genotype_fingerprint("CODEINE", hom, "v")
+
+def test_variant_records_are_compact_and_dict_compatible():
+    variants = VCFParser(_single_sample_vcf(("rs3892097", "0/1"), ("rs16947", "1/1"))).parse()
+    v = variants[0]
+    assert type(v).__name__ == "VariantRecord" and not hasattr(v, "__dict__")
+    assert v.position == 42128945 and v["position"] == 42128945
+    assert variants[0].chromosome is variants[1].chromosome
+    assert v.get("info") == "." and v.get("missing", "x") == "x"
+    # legacy dict input is converted at the engine boundary
+    as_dict = RiskEngine().predict_risk("CODEINE", [dict(v.as_dict(), position="42128945")])
+    assert as_dict["gene_variants"] == [v]
+
 if __name__ == "__main__":
     # Manually run tests if executed as script
     try:
@@ -114,3 +810,350 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"FAIL: Exception occurred: {e}")
         exit(1)
+
+def test_metrics_endpoint_and_real_stats():
+    from fastapi.testclient import TestClient
+    from backend import main
+    from backend.knowledge_base import STAR_ALLELE_VARIANTS
+    client = TestClient(main.app)
+    main.analysis_cache.clear()
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        content = fh.read()
+    for _ in range(2):
+        res = client.post("/analyze", files={"file": ("p.vcf", content, "text/plain")},
+                          data={"drug": "CODEINE"})
+        assert res.status_code == 200
+        assert res.headers["content-type"] == "application/json"
+
+    text = client.get("/metrics").text
+    for name in ("upload_read", "parse", "validate", "gene_filter", "phenotype", "llm", "serialize"):
+        assert f'pharmaguard_stage_seconds_count{{stage="{name}"}}' in text
+    assert 'pharmaguard_request_seconds_bucket{method="POST",route="/analyze",status="200",le="+Inf"}' in text
+    assert 'pharmaguard_analyses_total{drug="CODEINE",cache="hit"}' in text
+    assert "pharmaguard_upload_bytes_sum" in text
+    assert "pharmaguard_analysis_cache_hits_total" in text
+
+    stats = client.get("/stats").json()
+    assert stats["known_variants"] == len(STAR_ALLELE_VARIANTS)
+    assert stats["analyses_served"] >= 2
+    assert "fallbacks" in stats["llm_calls"]
+
+def test_request_profiling_middleware(monkeypatch):
+    from fastapi.testclient import TestClient
+    from backend import main
+    from backend.profiling import ProfileStore, ProfilingMiddleware, StackSampler
+    store = ProfileStore()
+    app = ProfilingMiddleware(main.app, store=store, token="secret", slow_ms=0.001,
+                              sampler=StackSampler(interval=0.001))
+    monkeypatch.setattr(main, "profile_store", store)
+    monkeypatch.setattr(main, "profile_token", "secret")
+    client = TestClient(app)
+    main.analysis_cache.clear()
+    res = client.post("/analyze", files={"file": ("g.vcf", _synthetic_genome_vcf(), "text/plain")},
+                      data={"drug": "CODEINE"},
+                      headers={"X-PharmaGuard-Profile": "secret", "X-Request-ID": "req-1"})
+    assert res.status_code == 200
+    assert res.headers["x-request-id"] == "req-1"
+    assert res.headers["x-pharmaguard-profile"] == "on"
+
+    entry = store.get("req-1")
+    assert entry["path"] == "/analyze" and entry["status"] == 200
+    assert "vcf_parser.py" in entry["cprofile"]
+    assert "folded" in entry
+    text = client.get("/debug/profiles/req-1?format=text", headers={"X-PharmaGuard-Profile": "secret"})
+    assert text.status_code == 200 and "cumulative" in text.text
+    assert client.get("/debug/profiles/req-1").status_code == 404
+    # Slow-request logging alone does not expose profiles over HTTP
+    monkeypatch.setattr(main, "profile_token", None)
+    assert client.get("/debug/profiles/req-1").status_code == 404
+    monkeypatch.setattr(main, "profile_token", "secret")
+
+    # Without the token header the request is not profiled
+    res = client.post("/analyze", files={"file": ("g.vcf", _synthetic_genome_vcf(), "text/plain")},
+                      data={"drug": "CODEINE"}, headers={"X-Request-ID": "req-2"})
+    assert "x-pharmaguard-profile" not in res.headers
+    assert "cprofile" not in store.get("req-2")
+
+def test_cold_import_budget():
+    # Autoscaled workers must come up fast: importing the app may not pull in
+    # the Gemini SDK or numpy, and stays under a wall-clock budget.
+    import json
+    import subprocess
+    budget = float(os.getenv("PHARMAGUARD_IMPORT_BUDGET_S", "2.0"))
+    code = (
+        "import json, sys, time\n"
+        "t = time.perf_counter()\n"
+        "import main\n"
+        "elapsed = time.perf_counter() - t\n"
+        "print(json.dumps({'elapsed': elapsed, 'modules': [m for m in ('google.generativeai', 'numpy')"
+        " if m in sys.modules], 'model': main.llm_service.model is not None}))\n"
+    )
+    env = {**os.environ, "GEMINI_API_KEY": "test-key", "PHARMAGUARD_EXPLANATION_DB": ""}
+    # As uvicorn loads it: `uvicorn main:app` from the backend directory
+    out = subprocess.run([sys.executable, "-c", code], cwd=current_dir, env=env,
+                         capture_output=True, text=True, timeout=60)
+    report = json.loads(out.stdout.strip().splitlines()[-1])
+    assert report["modules"] == [] and report["model"] is False
+    assert report["elapsed"] < budget, f"cold import took {report['elapsed']:.2f}s (budget {budget}s)"
+
+def test_preencoded_responses_match_pydantic_serialization():
+    import pytest
+    from fastapi.testclient import TestClient
+    from backend import main
+    from backend.schemas import AnalysisResult, PanelResult
+    from backend.responses import encode_analysis, render_analysis
+    client = TestClient(main.app)
+    main.analysis_cache.clear()
+    for name in ("sample_patient.vcf", "sample_toxic.vcf", "sample_ineffective.vcf"):
+        path = os.path.join(project_root, "frontend", "public", name)
+        if not os.path.exists(path):
+            path = os.path.join(project_root, name)
+        with open(path, "rb") as fh:
+            content = fh.read()
+        for _ in range(2):  # miss, then the cached fragments
+            res = client.post("/analyze/panel", files={"file": (name, content, "text/plain")},
+                              data={"patient_id": 'P "1" é'})
+            assert res.status_code == 200
+            assert PanelResult.model_validate_json(res.content).model_dump_json().encode() == res.content
+
+    engine = RiskEngine()
+    prediction = engine.predict_risk("CODEINE", [{"rsid": "rs3892097", "chromosome": "22", "position": "42128945"}])
+    explanation = {"summary": 'Line\nbreak, "quotes", ünïcode ✓', "biological_mechanism": "m",
+                   "variant_citations": ["rs3892097"], "confidence_reasoning": "c", "extra": 1}
+    body = render_analysis("P", "2026-01-01T00:00:00+00:00",
+                           encode_analysis("CODEINE", "CYP2D6", prediction, explanation), True, "job")
+    assert AnalysisResult.model_validate_json(body).model_dump_json().encode() == body
+
+    import pydantic
+    with pytest.raises(pydantic.ValidationError):
+        encode_analysis("CODEINE", "CYP2D6", {**prediction, "risk": "Bogus"}, explanation)
+
+def test_knowledge_base_hot_reload(tmp_path, monkeypatch):
+    import json
+    from fastapi.testclient import TestClient
+    from backend import main
+    from backend.knowledge_base import DEFAULT_KB_PATH
+    with open(DEFAULT_KB_PATH, encoding="utf-8") as fh:
+        data = json.load(fh)
+    data["version"] = "test-2"
+    data["cpic_guidelines"]["CODEINE"]["NM"]["recommendation"] = "Updated guidance."
+    updated = tmp_path / "kb.json"
+    updated.write_text(json.dumps(data))
+    malformed = tmp_path / "malformed.json"
+    rsid = next(iter(data["star_allele_variants"]))
+    malformed.write_text(json.dumps({**data, "star_allele_variants": {
+        **data["star_allele_variants"], rsid: {"allele": "*2", "function": "Decreased"}}}))
+    broken = tmp_path / "broken.json"
+    del data["cpic_guidelines"]["CODEINE"]
+    broken.write_text(json.dumps(data))
+
+    monkeypatch.setattr(main, "_admin_token", "admin")
+    client = TestClient(main.app)
+    vcf = {"file": ("p.vcf", b"##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n", "text/plain")}
+    before = client.post("/analyze", files=vcf, data={"drug": "CODEINE"})
+    old_version = before.headers["x-knowledge-base-version"]
+    assert before.json()["knowledge_base_version"] == old_version
+    in_flight = main.knowledge_base.current
+
+    assert client.post("/admin/knowledge-base/reload").status_code == 404
+    store_path = main.knowledge_base.path
+    try:
+        main.knowledge_base.path = str(updated)
+        res = client.post("/admin/knowledge-base/reload", headers={"X-PharmaGuard-Admin": "admin"})
+        assert res.status_code == 200 and res.json()["changed"]
+        new_version = res.json()["knowledge_base_version"]
+        assert new_version.startswith("test-2+")
+
+        after = client.post("/analyze", files=vcf, data={"drug": "CODEINE"})
+        assert after.headers["x-knowledge-base-version"] == new_version
+        assert after.json()["clinical_recommendation"]["dose_adjustment"] == "Updated guidance."
+        # A request that started before the swap keeps its own tables
+        assert in_flight.version == old_version
+        assert in_flight.engine.predict_risk("CODEINE", [])["recommendation"] != "Updated guidance."
+
+        main.knowledge_base.path = str(broken)
+        res = client.post("/admin/knowledge-base/reload", headers={"X-PharmaGuard-Admin": "admin"})
+        assert res.status_code == 422
+        assert main.knowledge_base.current.version == new_version
+
+        # A missing key inside an entry is a validation failure, on the endpoint and on SIGHUP
+        main.knowledge_base.path = str(malformed)
+        res = client.post("/admin/knowledge-base/reload", headers={"X-PharmaGuard-Admin": "admin"})
+        assert res.status_code == 422 and "malformed entry" in res.json()["detail"]
+        main._reload_logged()
+        assert main.knowledge_base.current.version == new_version
+    finally:
+        main.knowledge_base.reload(store_path)
+    assert main.knowledge_base.current.version == old_version
+
+def test_multi_variant_allele_definitions_match_by_position():
+    from backend.diplotype import AlleleDefinition, DefiningVariant, DiplotypeCaller
+    from backend.genotypes import parse_gt
+    from backend.knowledge_base import ALLELE_ACTIVITY_SCORES, CompiledKnowledgeBase
+    from backend.variants import VariantRecord
+    v100, v200, v300 = (DefiningVariant(None, "chr1", p, r, a) for p, r, a in ((100, "A", "G"), (200, "C", "T"), (300, "G", "A")))
+    caller = DiplotypeCaller({}, {"G": {"*3": 0.0, "*3.001": 0.0}}, [
+        AlleleDefinition("G", "*2", (v100,)),
+        AlleleDefinition("G", "*3", (v100, v200)),
+        AlleleDefinition("G", "*3.001", (v100, v200, v300)),
+    ])
+
+    def rank(*calls):
+        return caller.rank_records("G", [VariantRecord(".", "1", pos, ref, alt, genotype=parse_gt(gt))
+                                         for pos, ref, alt, gt in calls])
+
+    best = rank((100, "A", "G", "0/1"), (200, "C", "T", "0/1"))
+    assert (best[0].allele1, best[0].allele2, best[0].score) == ("*1", "*3", 1.0)
+    assert [m.score for m in best] == sorted((m.score for m in best), reverse=True)
+    # a shared variant on both haplotypes, the longest definition on one
+    best = rank((100, "A", "G", "1/1"), (200, "C", "T", "0/1"), (300, "G", "A", "0/1"))[0]
+    assert (best.allele1, best.allele2, best.unexplained) == ("*2", "*3.001", 0)
+    # phased trans: 200 alone defines nothing, so it stays unexplained
+    best = rank((100, "a", "g,t", "1|0"), (200, "C", "T", "0|1"))[0]
+    assert (best.allele1, best.allele2, best.unexplained) == ("*1", "*2", 1)
+    assert rank((999, "A", "G", "1/1"))[0][:2] == ("*1", "*1")
+
+    # Knowledge-base definitions with positions match records that have no rsID
+    kb = CompiledKnowledgeBase(ALLELE_ACTIVITY_SCORES, STAR_ALLELE_VARIANTS, CPIC_GUIDELINES,
+                               allele_definitions={"CYP2D6": {"*4": [("rs3892097", "22", 42128945, "C", "T")]}})
+    engine = RiskEngine(kb=kb)
+    record = VariantRecord(".", "chr22", 42128945, "C", "T", genotype=parse_gt("1/1"))
+    p = engine.predict_risk("CODEINE", [record])
+    assert (p["allele1"], p["allele2"], p["phenotype"]) == ("*4", "*4", "PM")
+    assert engine.classify_variants_to_alleles("CYP2D6", [record]) == ["*4"]
+
+def test_multi_gene_drugs_share_gene_calls(monkeypatch):
+    from fastapi.testclient import TestClient
+    from backend import main
+    from backend.genotypes import parse_gt
+    from backend.knowledge_base import COMPILED_KB
+    from backend.schemas import AnalysisResult
+    from backend.variants import VariantRecord
+    assert DRUG_GENES["WARFARIN"] == ("CYP2C9", "VKORC1") and DRUG_GENE_MAP["WARFARIN"] == "CYP2C9"
+    # Combined rules resolve through the index; uncovered combinations fall back to the primary gene
+    assert COMPILED_KB.drug_rule("WARFARIN", ("IM", "PM"))["severity"] == "critical"
+    assert COMPILED_KB.drug_rule("WARFARIN", ("PM", "NM")) == COMPILED_KB.rule("WARFARIN", "PM")
+    assert COMPILED_KB.drug_rule("AZATHIOPRINE", ("NM", "PM"))["risk"] == "Toxic"
+
+    engine = RiskEngine()
+    variants = [VariantRecord("rs1057910", "10", 94981296, "A", "C", genotype=parse_gt("1/1")),
+                VariantRecord("rs9923231", "16", 31096368, "C", "T", genotype=parse_gt("1/1"))]
+    by_gene = engine.group_variants_by_gene(variants)
+    called = []
+    monkeypatch.setattr(engine, "call_gene", lambda g, v, f=engine.call_gene: called.append(g) or f(g, v))
+    calls = engine.call_genes(by_gene, engine.genes_for_drugs(["WARFARIN", "CODEINE", "warfarin"]))
+    p = engine.predict_risk("WARFARIN", [], gene_calls=calls)
+    assert called == ["CYP2C9", "VKORC1", "CYP2D6"]
+    assert engine.predict_risk("WARFARIN", variants) == p
+    assert (p["gene"], p["allele1"], p["allele2"], p["phenotype"]) == ("CYP2C9", "*3", "*3", "IM")
+    assert [(c.gene, c.allele1, c.allele2, c.phenotype) for c in p["gene_calls"]][1] == ("VKORC1", "*2", "*2", "PM")
+    assert p["risk"] == "Toxic" and p["severity"] == "critical" and len(p["gene_variants"]) == 2
+
+    vcf = ("##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tP1\n"
+           "chr10\t94981296\trs1057910\tA\tC\t.\t.\t.\tGT\t1/1\n"
+           "chr16\t31096368\trs9923231\tC\tT\t.\t.\t.\tGT\t1/1\n").encode()
+    main.analysis_cache.clear()
+    res = TestClient(main.app).post("/analyze/panel", files={"file": ("p.vcf", vcf, "text/plain")},
+                                    data={"drugs": "warfarin,codeine"})
+    warfarin = res.json()["results"][0]
+    assert warfarin["risk_assessment"]["severity"] == "critical"
+    assert warfarin["pharmacogenomic_profile"]["secondary_genes"] == [
+        {"gene": "VKORC1", "diplotype": "*2/*2", "phenotype": "PM"}]
+    assert res.json()["results"][1]["pharmacogenomic_profile"]["secondary_genes"] == []
+    body = res.content[res.content.index(b'{"patient_id"', 1):res.content.index(b',{"patient_id"')]
+    assert AnalysisResult.model_validate_json(body).model_dump_json().encode() == body
+
+    # The explanation, prompt and store key cover every gene the combined rule used
+    from backend.llm_service import LLMService
+    svc = LLMService()
+    args = main._explanation_args("WARFARIN", "CYP2C9", p)
+    assert args["secondary_genes"] == [("VKORC1", "*2/*2", "PM")]
+    assert "*2/*2 VKORC1 diplotype" in svc.generate_explanation(**args, use_llm=False)["summary"]
+    assert "VKORC1 | Diplotype: *2/*2" in svc._build_prompt(**args)[0]
+    other = {**args, "secondary_genes": [("VKORC1", "*1/*2", "IM")]}
+    assert svc._store_key(**other) != svc._store_key(**args)
+
+def test_secondary_gene_confidence_only_counts_when_it_chose_the_rule():
+    from backend.genotypes import parse_gt
+    from backend.variants import VariantRecord
+    engine = RiskEngine()
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        variants = VCFParser(fh.read()).parse()
+    # Reference VKORC1 / NUDT15 (or an unrelated SNP in their windows) keep the single-gene confidence
+    noise = [VariantRecord("rs999", "16", 31091000, "G", "A", genotype=parse_gt("0/1")),
+             VariantRecord("rs998", "13", 48040000, "G", "A", genotype=parse_gt("0/1"))]
+    for drug in ("WARFARIN", "AZATHIOPRINE"):
+        primary = engine.call_gene(DRUG_GENE_MAP[drug], engine.filter_variants_for_gene(DRUG_GENE_MAP[drug], variants))
+        assert engine.predict_risk(drug, variants)["confidence"] == primary.confidence == 0.93
+        noisy = engine.predict_risk(drug, variants + noise)
+        assert noisy["gene_calls"][1].confidence < primary.confidence
+        assert noisy["confidence"] == 0.93 and noisy["risk"] == engine.predict_risk(drug, variants)["risk"]
+
+    # A secondary call that picks a combined rule does count
+    vkorc1 = VariantRecord("rs9923231", "16", 31096368, "C", "T", genotype=parse_gt("0/1"))
+    p = engine.predict_risk("WARFARIN", variants + [vkorc1] + noise)
+    assert p["risk"] == "Adjust Dosage"
+    assert p["confidence"] == min(c.confidence for c in p["gene_calls"]) < 0.93
+
+    # The vectorized cohort path applies the same rule per sample
+    content = (b"##fileformat=VCFv4.2\n"
+               b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tA\tB\tC\n"
+               b"chr10\t94942295\trs1057910\tA\tC\t.\t.\t.\tGT\t0/1\t0/1\t0/0\n"
+               b"chr16\t31096368\trs9923231\tC\tT\t.\t.\t.\tGT\t0/0\t0/1\t0/0\n"
+               b"chr16\t31091000\t.\tG\tA\t.\t.\t.\tGT\t0/1\t0/1\t0/0\n")
+    matrix = VCFParser(content).parse_genotype_matrix()
+    cohort = engine.predict_risk_matrix(["WARFARIN"], matrix)["WARFARIN"]
+    for i in range(len(matrix.samples)):
+        single = engine.predict_risk("WARFARIN", matrix.sample_variants(i))
+        assert (cohort["risk"][i], cohort["confidence"][i]) == (single["risk"], single["confidence"])
+    assert cohort["confidence"][0] > cohort["confidence"][1]
+
+def test_patient_profiles_answer_drug_queries_without_reupload():
+    from fastapi.testclient import TestClient
+    from backend import main
+    client = TestClient(main.app)
+    with open(os.path.join(project_root, "sample_patient.vcf"), "rb") as fh:
+        content = fh.read()
+    res = client.post("/profiles", files={"file": ("p.vcf", content, "text/plain")}, data={"patient_id": "P7"})
+    assert res.status_code == 201
+    summary = res.json()
+    assert {g["gene"] for g in summary["genes"]} == {g for genes in DRUG_GENES.values() for g in genes}
+    profile_id = summary["profile_id"]
+
+    for drug in ("clopidogrel", "WARFARIN"):
+        direct = client.post("/analyze", files={"file": ("p.vcf", content, "text/plain")},
+                             data={"drug": drug, "patient_id": "P7"}).json()
+        stored = client.get(f"/profiles/{profile_id}/analyze", params={"drug": drug})
+        assert stored.status_code == 200
+        assert {**stored.json(), "timestamp": ""} == {**direct, "timestamp": ""}
+    assert client.get(f"/profiles/{profile_id}/analyze", params={"drug": "ASPIRIN"}).status_code == 400
+    assert client.delete(f"/profiles/{profile_id}").status_code == 204
+    assert client.get(f"/profiles/{profile_id}/analyze", params={"drug": "CODEINE"}).status_code == 404
+
+def test_profile_store_caps_expiry_and_sqlite_tier(tmp_path, monkeypatch):
+    from backend import patient_profiles
+    from backend.genotypes import parse_gt
+    from backend.patient_profiles import ProfileStore
+    from backend.variants import VariantRecord
+    by_gene = {"CYP2D6": [VariantRecord("rs3892097", "22", 42128945, "C", "T", "GENE=CYP2D6", parse_gt("0|1"))],
+               "TPMT": []}
+    store = ProfileStore(max_profiles=2, ttl=0)
+    ids = [store.create(f"P{i}", by_gene, True).profile_id for i in range(3)]
+    assert store.get(ids[0]) is None and store.get(ids[2]).variants_by_gene["CYP2D6"][0].info == ""
+    size = store.get(ids[2]).size
+    store = ProfileStore(max_bytes=size * 5 // 2, ttl=0)  # payload sizes vary by a few bytes
+    ids = [store.create(f"P{i}", by_gene, True).profile_id for i in range(3)]
+    assert len(store) == 2 and store.stats()["evictions"] == 1
+
+    db = str(tmp_path / "profiles.sqlite3")
+    store = ProfileStore(max_profiles=1, ttl=60, path=db)
+    first = store.create("P1", by_gene, False)
+    store.create("P2", by_gene, True)
+    reloaded = ProfileStore(path=db).get(first.profile_id)  # evicted from memory, kept on disk
+    assert (reloaded.patient_id, reloaded.vcf_valid) == ("P1", False)
+    [variant] = reloaded.variants_by_gene.pop("CYP2D6")
+    assert variant.as_dict() == VariantRecord("rs3892097", "22", 42128945, "C", "T", genotype=parse_gt("0|1")).as_dict()
+    assert reloaded.variants_by_gene == {}
+    now = patient_profiles.time.time()
+    monkeypatch.setattr(patient_profiles.time, "time", lambda: now + 61)
+    assert store.get(first.profile_id) is None
@@ -0,0 +1,80 @@
+"""
+PharmaGuard Variant Record
+==========================
+The compact per-variant record passed from the VCF parser through the risk
+engine. Slots instead of a dict, an integer position parsed once, and an
+interned chromosome name shared by every variant on that chromosome.
+Conversion to the pydantic ``Variant`` schema happens only when a
+response is built.
+
+Records still answer ``v["rsid"]`` and ``v.get("info", "")`` so callers
+written against the old dict shape keep working.
+"""
+import sys
+from typing import Any, Iterable, List, Mapping, Optional, Union
+
+from genotypes import Genotype
+
+_FIELDS = ("rsid", "chromosome", "position", "reference", "alternate", "info", "genotype")
+
+
+class VariantRecord:
+    __slots__ = _FIELDS
+
+    def __init__(self, rsid: str, chromosome: str, position: int, reference: str = "",
+                 alternate: str = "", info: str = "", genotype: Optional[Genotype] = None):
+        self.rsid = rsid
+        self.chromosome = sys.intern(chromosome)
+        self.position = position
+        self.reference = reference
+        self.alternate = alternate
+        self.info = info
+        self.genotype = genotype
+
+    @classmethod
+    def from_mapping(cls, m: Mapping[str, Any]) -> "VariantRecord":
+        """Build from a legacy variant dict; missing fields get empty defaults."""
+        try:
+            position = int(m.get("position", 0))
+        except (ValueError, TypeError):
+            position = 0
+        return cls(
+            m.get("rsid", ""), m.get("chromosome", ""), position,
+            m.get("reference", ""), m.get("alternate", ""), m.get("info", "") or "",
+            m.get("genotype"),
+        )
+
+    def with_genotype(self, genotype: Optional[Genotype]) -> "VariantRecord":
+        return VariantRecord(self.rsid, self.chromosome, self.position, self.reference,
+                             self.alternate, self.info, genotype)
+
+    def as_dict(self) -> dict:
+        return {f: getattr(self, f) for f in _FIELDS}
+
+    # Mapping-style access for dict-era callers
+    def __getitem__(self, key: str) -> Any:
+        if key not in _FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in _FIELDS else default
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, VariantRecord):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in _FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return (f"VariantRecord({self.rsid!r}, {self.chromosome!r}, {self.position}, "
+                f"{self.reference!r}, {self.alternate!r}, genotype={self.genotype})")
+
+
+VariantLike = Union[VariantRecord, Mapping[str, Any]]
+
+
+def as_records(variants: Iterable[VariantLike]) -> List[VariantRecord]:
+    """Pass records through; convert any legacy dicts."""
+    return [v if isinstance(v, VariantRecord) else VariantRecord.from_mapping(v) for v in variants]
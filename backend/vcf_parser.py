@@ -1,91 +1,495 @@
+import mmap
+import os
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, BinaryIO, Iterable, Iterator, Optional, Tuple, Union
+
+from bgzf import GZIP_MAGIC, GzipInflater, TabixIndex, fetch_region, iter_header_lines
+from knowledge_base import STAR_ALLELE_VARIANTS, DRUG_GENES, ALLELE_DEFINITIONS
+from gene_regions import GENE_INDEX, normalize_chrom
+from genotypes import GenotypeMatrix, sample_dosages, sample_genotype
+from variants import VariantRecord
+
+VCF_HEADER_TAG = b'##fileformat=VCFv4.2'
+
+# Slice size when inflating a memory-mapped .vcf.gz, and the line-aligned
+# block size used when scanning a memory-mapped plain VCF
+MAPPED_CHUNK_SIZE = 1 << 20
+MAPPED_BLOCK_SIZE = 4 << 20
+
+# Longest data or header line accepted; bounds the partial-line buffer
+MAX_LINE_BYTES = int(os.getenv("PHARMAGUARD_MAX_LINE_BYTES", str(8 << 20)))
+
+
+def int_range_pattern(lo: int, hi: int) -> bytes:
+    """
+    Regex alternation matching exactly the decimal integers in [lo, hi]
+    (no leading zeros), e.g. 95..123 → 9[5-9]|1[0-1]\\d|12[0-3].
+    """
+    lo = max(lo, 0)
+    parts = []
+    start = lo
+    while start <= hi:
+        k = 0
+        while start % 10 ** (k + 1) == 0 and start + 10 ** (k + 1) - 1 <= hi and start:
+            k += 1
+        step = 10 ** k
+        digit = (start // step) % 10
+        extra = min(9 - digit, (hi - start + 1) // step - 1)
+        head = str(start // (step * 10)) if start >= step * 10 else ""
+        mid = f"[{digit}-{digit + extra}]" if extra else str(digit)
+        parts.append(head + mid + r"\d" * k)
+        start += (extra + 1) * step
+    return "|".join(parts).encode()
+
+
+def _trie_pattern(words: Iterable[bytes]) -> bytes:
+    """Alternation of ``words`` factored into a prefix trie, so the regex
+    engine compares each shared prefix once instead of once per word."""
+    tree: Dict[int, dict] = {}
+    for word in words:
+        node = tree
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[-1] = {}
+
+    def emit(node: dict) -> bytes:
+        alts = [re.escape(bytes([ch])) + emit(child) for ch, child in sorted(node.items()) if ch != -1]
+        if not alts:
+            return b""
+        body = alts[0] if len(alts) == 1 else b"(?:" + b"|".join(alts) + b")"
+        return b"(?:" + body + b")?" if -1 in node else body
+
+    return emit(tree)
+
+
+class TargetFilter:
+    """
+    Cheap pre-filter applied to raw data lines before any decoding or dict
+    building. A line passes if its ID is a known star-allele rsID, its
+    CHROM/POS falls in a gene window, or a gene symbol appears in it (the
+    INFO-annotation case). It is a superset of what RiskEngine keeps, so
+    filtering early never changes a result.
+    """
+
+    def __init__(self, rsids: Iterable[str], regions: Iterable[Tuple[str, int, int]],
+                 gene_names: Iterable[str]):
+        self.rsids = frozenset(r.encode() for r in rsids)
+        windows: Dict[bytes, List[Tuple[int, int]]] = {}
+        for chrom, start, end in regions:
+            windows.setdefault(normalize_chrom(chrom).encode(), []).append((start, end))
+        self.windows = windows
+        names = sorted(set(gene_names), key=len, reverse=True)
+        self._gene_pattern = re.compile(
+            b"|".join(re.escape(n.encode()) for n in names), re.IGNORECASE
+        ) if names else None
+        # Gene names grouped under their shared 4-byte prefix: one find per
+        # prefix, then a startswith check per name at each hit.
+        self._gene_probes: Dict[bytes, List[bytes]] = {}
+        for n in names:
+            lowered = n.lower().encode()
+            self._gene_probes.setdefault(lowered[:4], []).append(lowered)
+
+        # Block-level scan: a "\n" followed by a line whose ID is a target
+        # rsID or whose CHROM/POS falls in a window. Gene names are found
+        # separately with bytes.find on the lower-cased block.
+        branches = []
+        if self.rsids:
+            branches.append(b"[^\t\n]*\t[^\t\n]*\t" + _trie_pattern(self.rsids) + b"\t")
+        for chrom, spans in sorted(windows.items()):
+            positions = b"|".join(int_range_pattern(start, end) for start, end in sorted(spans))
+            branches.append(b"(?:chr)?" + re.escape(chrom) + b"\t(?:" + positions + b")\t")
+        self._line_pattern = re.compile(b"\n(?:" + b"|".join(branches) + b")") if branches else None
+
+    @classmethod
+    def pharmacogenes(cls, kb=None, gene_index=None) -> "TargetFilter":
+        """
+        Targets for every pharmacogene in the knowledge base (default: the
+        startup tables), including the variants that only appear in
+        ``allele_definitions``: their rsIDs, and their positions when they
+        fall outside every gene window.
+        """
+        star_alleles = STAR_ALLELE_VARIANTS if kb is None else kb.star_alleles
+        drug_genes = DRUG_GENES if kb is None else kb.drug_genes
+        definitions = ALLELE_DEFINITIONS if kb is None else kb.allele_definitions
+        gene_index = gene_index or GENE_INDEX
+        genes = {g for g, _, _ in star_alleles.values()} | set(definitions)
+        genes |= set(gene_index.genes()) | {g for gs in drug_genes.values() for g in gs}
+        rsids = set(star_alleles)
+        regions = list(gene_index.regions())
+        for alleles in definitions.values():
+            for variants in alleles.values():
+                for rsid, chrom, pos, _, _ in variants:
+                    if rsid:
+                        rsids.add(rsid)
+                    if chrom is not None and pos is not None and not gene_index.genes_at(str(chrom), int(pos)):
+                        regions.append((str(chrom), int(pos), int(pos)))
+        return cls(rsids, regions, genes)
+
+    def matches(self, raw: bytes) -> bool:
+        return self.matches_at(raw, 0, len(raw))
+
+    def candidate_lines(self, block: bytes) -> List[int]:
+        """
+        Sorted start offsets of the lines in ``block`` (which must begin at a
+        line start) that may match. A superset of the lines ``matches``
+        accepts, found with C-level scans instead of a Python loop per line.
+        """
+        starts = set()
+        if self._line_pattern is not None:
+            starts.update(m.start() for m in self._line_pattern.finditer(b"\n" + block))
+        if self._gene_probes:
+            lowered = block.lower()
+            for probe, names in self._gene_probes.items():
+                i = lowered.find(probe)
+                while i != -1:
+                    if any(lowered.startswith(n, i) for n in names):
+                        starts.add(lowered.rfind(b"\n", 0, i) + 1)
+                    i = lowered.find(probe, i + 1)
+        return sorted(starts)
+
+    def matches_at(self, buf: Union[bytes, mmap.mmap], start: int, end: int) -> bool:
+        """
+        ``matches`` for the line buf[start:end] without slicing it out; only
+        the short CHROM/POS/ID fields are copied. Works on mmaps as well.
+        """
+        t1 = buf.find(b'\t', start, end)
+        t2 = buf.find(b'\t', t1 + 1, end) if t1 != -1 else -1
+        t3 = buf.find(b'\t', t2 + 1, end) if t2 != -1 else -1
+        if t3 == -1:
+            return False
+        if buf[t2 + 1:t3] in self.rsids:
+            return True
+        chrom = buf[start:t1]
+        if chrom[:3] == b'chr':
+            chrom = chrom[3:]
+        spans = self.windows.get(chrom)
+        if spans:
+            try:
+                pos = int(buf[t1 + 1:t2])
+            except ValueError:
+                pos = None
+            if pos is not None and any(s <= pos <= e for s, e in spans):
+                return True
+        return self._gene_pattern is not None and self._gene_pattern.search(buf, start, end) is not None
+
 
 class VCFParser:
-    def __init__(self, content: bytes):
-        self.content = content.decode('utf-8')
-        self.lines = self.content.splitlines()
+    """
+    Incremental VCF v4.2 parser.
+
+    Content can be handed over all at once (``VCFParser(content)``) or fed in
+    chunks with ``feed()``/``close()``, which yield variant records as soon as
+    their line is complete. Only the current partial line is buffered, so peak
+    memory is bounded by the chunk size rather than the file size; a line
+    longer than ``max_line_bytes`` or gzip input inflating past
+    ``max_inflated_bytes`` raises ValueError.
+
+    Gzip/BGZF input (``.vcf.gz``) is detected from its magic bytes and inflated
+    on the fly. With a tabix/CSI index, ``iter_regions()`` seeks straight to
+    the requested windows instead of inflating the whole file.
+
+    An optional ``targets`` filter drops irrelevant data lines after splitting
+    only the first columns, so allocation scales with pharmacogene hits.
+
+    ``VCFParser.from_path()`` memory-maps an on-disk file instead of reading
+    it; lines are filtered in place and only the ones that pass are copied
+    out and decoded.
+    """
+
+    def __init__(self, content: bytes = b"", targets: Optional[TargetFilter] = None,
+                 max_line_bytes: int = MAX_LINE_BYTES, max_inflated_bytes: Optional[int] = None):
+        self.content = content
+        self.targets = targets
+        self.max_line_bytes = max_line_bytes
+        self.max_inflated_bytes = max_inflated_bytes
         self.variants = []
         self.metadata = {}
-        
+        self.header = []
+        self.header_valid = False
+        self.data_started = False
+        self._buffer = b""
+        self._consumed = False
+        self._inflater = None
+        self._sniffed = False
+        self._genotype_rows = None
+
+    @classmethod
+    def from_path(cls, path: str, targets: Optional[TargetFilter] = None) -> "VCFParser":
+        """Parser over a file on local disk, memory-mapped rather than read."""
+        with open(path, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return cls(b"", targets)
+            content = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(content, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            content.madvise(mmap.MADV_SEQUENTIAL)
+        return cls(content, targets)
+
+    def __enter__(self) -> "VCFParser":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if isinstance(self.content, mmap.mmap):
+            self.content.close()
+
     def validate(self) -> bool:
         """Validates if the file is a valid VCF v4.2"""
-        if not self.lines:
+        if self._consumed or self.data_started:
+            return self.header_valid
+        if not self.content:
             return False
-            
-        header_found = False
-        for line in self.lines:
-            if line.startswith('##fileformat=VCFv4.2'):
-                header_found = True
+        if self.content[:2] == GZIP_MAGIC:
+            # Compressed content must be inflated; let the full pass decide.
+            self.parse()
+            return self.header_valid
+
+        # Only the ## meta block can carry the fileformat line, so stop at the
+        # first data line instead of scanning the whole file.
+        for line in self._iter_lines(self.content):
+            if line.startswith(VCF_HEADER_TAG):
+                return True
+            if line and not line.startswith(b'#'):
                 break
-        
+
         # Basic check, can be relaxed if needed but requirement says strict
-        return header_found
+        return False
 
-    def parse(self) -> Dict[str, Any]:
+    def parse(self) -> List[VariantRecord]:
         """Parses the VCF content"""
-        # Iterate relevant lines
         # In a real scenario, we'd look for specific positions.
-        # For this hackathon/MVP, we'll scan for our target genes if annotated, 
+        # For this hackathon/MVP, we'll scan for our target genes if annotated,
         # or simplified variant detection.
-        
-        extracted_data = []
-
-        data_started = False
-        header = []
-        
-        for line in self.lines:
-            if line.startswith('#CHROM'):
-                header = line.strip().split('\t')
-                data_started = True
-                continue
-            
-            if line.startswith('#'):
-                continue
-                
-            if data_started:
-                parts = line.strip().split('\t')
-                if len(parts) < 5:
-                    continue
-                    
-                chrom = parts[0]
-                pos = parts[1]
-                rsid = parts[2]
-                ref = parts[3]
-                alt = parts[4]
-                info = parts[7] if len(parts) > 7 else ""
-                
-                # Check for target genes in INFO if available, or just collect all
-                # In a real VCF, GENE might be in INFO like GENE=CYP2D6
-                
-                # Minimal struct
-                variant = {
-                    "rsid": rsid if rsid != "." else f"{chrom}:{pos}",
-                    "chromosome": chrom,
-                    "position": pos,
-                    "reference": ref,
-                    "alternate": alt,
-                    "info": info
-                }
-                
-                extracted_data.append(variant)
-                
-        return extracted_data
+        return list(self.iter_variants())
+
+    def parse_genotype_matrix(self, chunks: Iterable[bytes] = None) -> GenotypeMatrix:
+        """
+        Parse a multi-sample VCF into a variants × samples dosage matrix.
+        Reads from ``chunks`` if given, otherwise from the constructor content.
+        """
+        rows: List[List[int]] = []
+        self._genotype_rows = rows
+        try:
+            variants = list(self.iter_variants(chunks))
+        finally:
+            self._genotype_rows = None
+        return GenotypeMatrix.from_rows(self.samples, variants, rows)
+
+    @property
+    def samples(self) -> List[str]:
+        """Sample names from the #CHROM header line."""
+        return self.header[9:]
+
+    def iter_variants(self, chunks: Iterable[bytes] = None) -> Iterator[VariantRecord]:
+        """
+        Yield variant records one at a time.
+        Reads from ``chunks`` if given, otherwise from the constructor content.
+        """
+        if chunks is None:
+            if self.content[:2] == GZIP_MAGIC:
+                yield from self.iter_variants(self._content_chunks())
+                return
+            yield from self._iter_buffer()
+            return
+
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.close()
+
+    def feed(self, chunk: bytes) -> Iterator[VariantRecord]:
+        """Consume one chunk of raw bytes, yielding every completed variant."""
+        self._consumed = True
+        if not self._sniffed and chunk:
+            self._sniffed = True
+            if chunk[:2] == GZIP_MAGIC:
+                self._inflater = GzipInflater(max_output=self.max_inflated_bytes)
+        if self._inflater is None:
+            yield from self._feed_plain(chunk)
+            return
+        # Inflated in bounded pieces: a highly compressed chunk never becomes one huge buffer
+        for piece in self._inflater.iter_decompress(chunk):
+            yield from self._feed_plain(piece)
+
+    def _feed_plain(self, chunk: bytes) -> Iterator[VariantRecord]:
+        data = self._buffer + chunk if self._buffer else chunk
+        start = 0
+        # Header lines one by one; once targeted data starts, every run of
+        # complete lines goes through the block scan.
+        while self.targets is None or not self.data_started:
+            end = data.find(b'\n', start)
+            if end == -1:
+                break
+            variant = self._parse_line(data[start:end])
+            if variant is not None:
+                yield variant
+            start = end + 1
+        else:
+            last = data.rfind(b'\n', start)
+            if last != -1:
+                yield from self._scan_targets(data[start:last + 1])
+                start = last + 1
+        if len(data) - start > self.max_line_bytes:
+            raise ValueError(f"VCF line longer than {self.max_line_bytes} bytes.")
+        self._buffer = data[start:]
+
+    def close(self) -> Iterator[VariantRecord]:
+        """Flush a trailing line that had no newline terminator."""
+        if self._buffer:
+            line, self._buffer = self._buffer, b""
+            variant = self._parse_line(line)
+            if variant is not None:
+                yield variant
+
+    def iter_regions(self, bgzf_file: BinaryIO, index_data: bytes,
+                     regions: Iterable[Tuple[str, int, int]]) -> Iterator[VariantRecord]:
+        """
+        Yield variants inside ``regions`` (chrom, start, end; 1-based inclusive)
+        from a BGZF-compressed VCF, using its ``.tbi``/``.csi`` index to read
+        only the blocks that cover those windows.
+        """
+        self._consumed = True
+        index = TabixIndex.load(index_data)
+        for line in iter_header_lines(bgzf_file):
+            self._parse_line(line)
+        self.data_started = True
+
+        for chrom, start, end in regions:
+            for line in fetch_region(bgzf_file, index, chrom, start, end):
+                variant = self._parse_line(line)
+                if variant is not None:
+                    yield variant
+
+    def _content_chunks(self) -> Iterator[bytes]:
+        if not isinstance(self.content, mmap.mmap):
+            yield self.content
+            return
+        for start in range(0, len(self.content), MAPPED_CHUNK_SIZE):
+            yield self.content[start:start + MAPPED_CHUNK_SIZE]
+
+    def _iter_buffer(self) -> Iterator[VariantRecord]:
+        """
+        Scan uncompressed content (bytes or a memory map). The ## block is
+        skipped with one search for the #CHROM line. With ``targets``, the
+        content is read in bounded line-aligned blocks and only candidate
+        lines are decoded.
+        """
+        self._consumed = True
+        mm = self.content
+        size = len(mm)
+        if mm[:6] == b'#CHROM':
+            header_at = 0
+        else:
+            header_at = mm.find(b'\n#CHROM') + 1
+            if header_at == 0:
+                return
+        self.header_valid = (mm[:len(VCF_HEADER_TAG)] == VCF_HEADER_TAG
+                             or mm.find(b'\n' + VCF_HEADER_TAG, 0, header_at) != -1)
+        end = mm.find(b'\n', header_at)
+        if end == -1:
+            end = size
+        self._parse_line(mm[header_at:end])
+
+        targets = self.targets
+        start = end + 1
+        if targets is None:
+            while start < size:
+                end = mm.find(b'\n', start)
+                if end == -1:
+                    end = size
+                if mm[start:start + 1] != b'#':
+                    variant = self._parse_record(mm[start:end])
+                    if variant is not None:
+                        yield variant
+                start = end + 1
+            return
+
+        # Line-aligned blocks: candidate lines are located by C-level scans
+        # and confirmed one by one, so untargeted lines never reach Python.
+        while start < size:
+            stop = min(start + MAPPED_BLOCK_SIZE, size)
+            if stop < size:
+                cut = mm.rfind(b'\n', start, stop)
+                stop = cut + 1 if cut != -1 else (mm.find(b'\n', stop) + 1 or size)
+            yield from self._scan_targets(mm[start:stop])
+            start = stop
+
+    def _scan_targets(self, block: bytes) -> Iterator[VariantRecord]:
+        """Targeted variants in ``block``, a run of whole data lines."""
+        targets = self.targets
+        for offset in targets.candidate_lines(block):
+            end = block.find(b'\n', offset)
+            if end == -1:
+                end = len(block)
+            if block[offset:offset + 1] != b'#' and targets.matches_at(block, offset, end):
+                variant = self._parse_record(block[offset:end])
+                if variant is not None:
+                    yield variant
+
+    @staticmethod
+    def _iter_lines(content: bytes) -> Iterator[bytes]:
+        start = 0
+        while start < len(content):
+            end = content.find(b'\n', start)
+            if end == -1:
+                end = len(content)
+            yield content[start:end]
+            start = end + 1
+
+    def _parse_line(self, raw: bytes):
+        """Handle one raw line: header bookkeeping or a variant record."""
+        if raw.startswith(b'#'):
+            if raw.startswith(b'#CHROM'):
+                self.header = raw.decode('utf-8').strip().split('\t')
+                self.data_started = True
+            elif raw.startswith(VCF_HEADER_TAG):
+                self.header_valid = True
+            return None
+
+        if not self.data_started:
+            return None
+        if self.targets is not None and not self.targets.matches(raw):
+            return None
+        return self._parse_record(raw)
+
+    def _parse_record(self, raw: bytes) -> Optional[VariantRecord]:
+        """Decode one data line that already passed the target filter."""
+        parts = raw.decode('utf-8').strip().split('\t')
+        if len(parts) < 5:
+            return None
+
+        chrom = parts[0]
+        try:
+            pos = int(parts[1])
+        except ValueError:
+            return None
+        rsid = parts[2]
+        info = parts[7] if len(parts) > 7 else ""
+
+        format_field = parts[8] if len(parts) > 8 else ""
+        if self._genotype_rows is not None:
+            self._genotype_rows.append(sample_dosages(
+                format_field, parts[9:], max(len(self.header) - 9, 0)
+            ))
+        # GT of a single-sample file; cohort genotypes live in the matrix
+        genotype = sample_genotype(format_field, parts[9]) if len(parts) == 10 else None
+
+        return VariantRecord(
+            rsid if rsid != "." else f"{chrom}:{pos}",
+            chrom, pos, parts[3], parts[4], info, genotype,
+        )
 
     def find_variants_for_gene(self, gene: str, variants: List[Dict]) -> List[Dict]:
         """
         Filter variants relevant to a gene.
         This is a heuristic since proper mapping requires genomic coordinates.
-        For the prompt's sake, we assume the VCF might interpretatively have gene names 
+        For the prompt's sake, we assume the VCF might interpretatively have gene names
         OR we match known RSIDs.
         """
         # Mocking the gene lookup for the MVP if INFO tags aren't perfect
         # In production: Use an interval tree or strict coordinate lookup.
-        
+
         relevant = []
         for v in variants:
             # Simple substring check in INFO or look up by RSID list (ommitted for brevity)
             if gene in v.get("info", ""):
                 relevant.append(v)
-        
+
         return relevant
@@ -0,0 +1,177 @@
+"""
+Benchmark: star-allele matching against a synthetic PharmVar-size table.
+
+Builds a table of multi-variant haplotype definitions over many genes
+(core alleles plus suballeles that add one or two variants, with variants
+shared between alleles), then calls every gene for synthetic samples whose
+records carry no rsID, so matching goes through the position/allele index.
+
+    python bench/bench_diplotype.py --genes 120 --alleles 250 --samples 500
+
+Samples are drawn two ways: ``skewed`` (each haplotype is *1 with
+probability 0.6, otherwise a Zipf-weighted allele, as in real cohorts) and
+``uniform`` (every haplotype a uniformly random definition; nearly every
+genotype pattern is new, the worst case for the call memo).
+
+Reports table build time, per-sample time over all genes with the call
+memo cleared (cold) and in steady state over a cohort (warm), and how often
+the best-ranked diplotype is the one the sample was generated from.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from diplotype import AlleleDefinition, DefiningVariant, DiplotypeCaller  # noqa: E402
+from genotypes import Genotype  # noqa: E402
+from variants import VariantRecord  # noqa: E402
+
+_BASES = "ACGT"
+
+
+def synthetic_table(genes: int, alleles: int, variants: int, seed: int = 0):
+    """
+    ``alleles`` definitions per gene over ``variants`` positions: a quarter
+    are core alleles of 1-4 variants, the rest suballeles of a core allele
+    plus 1-2 variants of their own. Returns (definitions, {gene: [(star, variants)]}).
+    """
+    rng = random.Random(seed)
+    definitions, by_gene = [], {}
+    for g in range(genes):
+        gene = f"G{g:03d}"
+        chrom = str(1 + g % 22)
+        base = 1_000_000 + g * 200_000
+        pool = []
+        for v in range(variants):
+            ref = rng.choice(_BASES)
+            pool.append(DefiningVariant(None, chrom, base + v * 37, ref, rng.choice(_BASES.replace(ref, ""))))
+        cores = []
+        rows = []
+        for a in range(alleles):
+            if a < max(alleles // 4, 1):
+                vs = tuple(rng.sample(pool, rng.randint(1, 4)))
+                cores.append(vs)
+                star = f"*{a + 2}"
+            else:
+                core = rng.randrange(len(cores))
+                vs = tuple(dict.fromkeys(cores[core] + tuple(rng.sample(pool, rng.randint(1, 2)))))
+                star = f"*{core + 2}.{a:03d}"
+            rows.append((star, vs))
+            definitions.append(AlleleDefinition(gene, star, vs))
+        by_gene[gene] = rows
+    return definitions, by_gene
+
+
+def synthetic_samples(by_gene: Dict[str, List[Tuple[str, tuple]]], count: int, seed: int = 1,
+                      distribution: str = "skewed"):
+    """Per sample, {gene: (records, (allele1, allele2))} from two drawn haplotypes."""
+    rng = random.Random(seed)
+    wild = ("*1", ())
+
+    def draw(rows, weights):
+        if distribution == "uniform":
+            return rng.choice(rows)
+        if rng.random() < 0.6:
+            return wild
+        return rng.choices(rows, weights)[0]
+
+    weights = {gene: [1 / (k + 1) ** 1.2 for k in range(len(rows))] for gene, rows in by_gene.items()}
+    samples = []
+    for _ in range(count):
+        sample = {}
+        for gene, rows in by_gene.items():
+            (s1, v1), (s2, v2) = draw(rows, weights[gene]), draw(rows, weights[gene])
+            phased = rng.random() < 0.3
+            records = []
+            for v in dict.fromkeys(v1 + v2):
+                on1, on2 = v in v1, v in v2
+                gt = Genotype(int(on1), int(on2), phased) if phased or (on1 and on2) else Genotype(0, 1, False)
+                records.append(VariantRecord(".", v.chromosome, v.position, v.reference, v.alternate, genotype=gt))
+            sample[gene] = (records, (s1, s2))
+        samples.append(sample)
+    return samples
+
+
+def run_distribution(caller: DiplotypeCaller, by_gene, samples: int, seed: int, distribution: str) -> Dict:
+    data = synthetic_samples(by_gene, samples, seed, distribution)
+    flat = [[r for records, _ in sample.values() for r in records] for sample in data]
+
+    cold = []
+    for records in flat:
+        caller._calls.clear()
+        t0 = time.perf_counter()
+        caller.rank_sample(records, limit=3)
+        cold.append(time.perf_counter() - t0)
+    caller._calls.clear()
+    for records in flat:
+        caller.rank_sample(records, limit=3)
+    warm_start = time.perf_counter()
+    calls = [caller.rank_sample(records, limit=3) for records in flat]
+    warm_s = (time.perf_counter() - warm_start) / len(data)
+
+    exact = top = 0
+    for sample, called in zip(data, calls):
+        for gene, (_, truth) in sample.items():
+            best = called.get(gene) or caller.rank_records(gene, [], limit=3)
+            exact += best[0].score == 1.0
+            top += any(sorted((m.allele1, m.allele2)) == sorted(truth) for m in best)
+    n = len(data) * len(by_gene)
+    cold.sort()
+    return {
+        "samples": len(data),
+        "records_per_sample": sum(map(len, flat)) / len(flat),
+        "cold_ms_per_sample": sum(cold) / len(cold) * 1e3,
+        "cold_p95_ms_per_sample": cold[int(len(cold) * 0.95) - 1] * 1e3,
+        "warm_ms_per_sample": warm_s * 1e3,
+        "fully_explained": exact / n,
+        "truth_in_top3": top / n,
+    }
+
+
+def run(genes: int, alleles: int, variants: int, samples: int, seed: int = 0,
+        distributions=("skewed", "uniform")) -> Dict:
+    definitions, by_gene = synthetic_table(genes, alleles, variants, seed)
+    start = time.perf_counter()
+    caller = DiplotypeCaller({}, {}, definitions)
+    build_s = time.perf_counter() - start
+    return {
+        "genes": genes,
+        "definitions": caller.definition_count(),
+        "build_s": build_s,
+        **{d: run_distribution(caller, by_gene, samples, seed + 1, d) for d in distributions},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    ap = argparse.ArgumentParser(description="Star-allele matching on a synthetic PharmVar-size table")
+    ap.add_argument("--genes", type=int, default=120)
+    ap.add_argument("--alleles", type=int, default=250, help="definitions per gene")
+    ap.add_argument("--variants", type=int, default=400, help="defining positions per gene")
+    ap.add_argument("--samples", type=int, default=500)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--distribution", choices=("skewed", "uniform", "both"), default="both")
+    ap.add_argument("--output", help="write the results as JSON here")
+    args = ap.parse_args(argv)
+
+    distributions = ("skewed", "uniform") if args.distribution == "both" else (args.distribution,)
+    r = run(args.genes, args.alleles, args.variants, args.samples, args.seed, distributions)
+    print(f"table: {r['definitions']} definitions over {r['genes']} genes, built in {r['build_s']:.2f} s")
+    for d in distributions:
+        x = r[d]
+        print(f"{d:>8}: {x['records_per_sample']:.0f} defining records/sample, "
+              f"cold {x['cold_ms_per_sample']:.3f} ms/sample (p95 {x['cold_p95_ms_per_sample']:.3f}), "
+              f"warm {x['warm_ms_per_sample']:.3f} ms/sample; {x['fully_explained']:.1%} fully explained, "
+              f"truth in top 3 {x['truth_in_top3']:.1%}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(r, fh, indent=2)
+    return r
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Micro-benchmark: phenotype + CPIC rule lookup, legacy path vs CompiledKnowledgeBase.
+
+    python bench/bench_knowledge_base.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from knowledge_base import (  # noqa: E402
+    ALLELE_ACTIVITY_SCORES, CPIC_GUIDELINES, COMPILED_KB, DRUG_GENE_MAP,
+    activity_score_to_phenotype,
+)
+
+CASES = [
+    ("CODEINE", "*4", "*41"),
+    ("WARFARIN", "*2", "*3"),
+    ("CLOPIDOGREL", "*1", "*17"),
+    ("SIMVASTATIN", "*1", "*5"),
+    ("AZATHIOPRINE", "*3C", "*3C"),
+    ("FLUOROURACIL", "*1", "*2A"),
+]
+
+
+def legacy(drug, allele1, allele2):
+    gene = DRUG_GENE_MAP[drug]
+    phenotype = activity_score_to_phenotype(gene, allele1, allele2)
+    scores = ALLELE_ACTIVITY_SCORES.get(gene, {})
+    s1 = scores.get(allele1, scores.get("default", 1.0))
+    s2 = scores.get(allele2, scores.get("default", 1.0))
+    rules = CPIC_GUIDELINES.get(drug, {})
+    rule = rules.get(phenotype) or rules.get("NM")
+    return phenotype, round(s1 + s2, 2), rule["risk"]
+
+
+def compiled(drug, allele1, allele2):
+    phenotype, activity = COMPILED_KB.phenotype(DRUG_GENE_MAP[drug], allele1, allele2)
+    return phenotype, activity, COMPILED_KB.rule(drug, phenotype)["risk"]
+
+
+def main(number: int = 20_000) -> dict:
+    for case in CASES:
+        assert legacy(*case) == compiled(*case), case
+
+    results = {}
+    for name, fn in (("legacy", legacy), ("compiled", compiled)):
+        seconds = min(timeit.repeat(lambda: [fn(*c) for c in CASES], number=number, repeat=5))
+        results[name] = seconds / (number * len(CASES)) * 1e9
+    results["speedup"] = results["legacy"] / results["compiled"]
+    print(f"legacy:   {results['legacy']:8.1f} ns/lookup")
+    print(f"compiled: {results['compiled']:8.1f} ns/lookup")
+    print(f"speedup:  {results['speedup']:8.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Load generator for /analyze and /analyze/panel.
+
+Drives concurrent traffic at several concurrency levels and reports
+p50/p95/p99 latency, throughput and error counts per level. Targets a
+running server (--url), or the app in-process through httpx's ASGI
+transport (--inprocess), which defaults to the fake Gemini backend so runs
+need no network or API key:
+
+    PHARMAGUARD_LLM_BACKEND=fake PHARMAGUARD_FAKE_LLM_LATENCY=lognormal:800,0.4 \\
+        uvicorn main:app --app-dir backend --port 8001 --workers 4
+    python bench/loadgen.py --url http://localhost:8001 --concurrency 1,8,32,64
+
+    python bench/loadgen.py --inprocess --concurrency 1,16,64 --requests 200 \\
+        --patients 20 --mix analyze=0.7,panel=0.3 --output load.json
+
+--patients sets how many distinct genotypes are uploaded, which controls
+the analysis cache hit rate (1 = everything after the first request hits).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "backend"))
+
+import httpx  # noqa: E402
+
+from knowledge_base import DRUG_GENE_MAP, GENE_CHROMOSOMES, STAR_ALLELE_VARIANTS  # noqa: E402
+
+
+def patient_vcfs(count: int, seed: int = 0) -> List[bytes]:
+    """``count`` small single-sample VCFs with distinct star-allele genotypes."""
+    rng = random.Random(seed)
+    rsids = [(r, g) for r, (g, _, _) in STAR_ALLELE_VARIANTS.items() if g in GENE_CHROMOSOMES]
+    vcfs, seen = [], set()
+    while len(vcfs) < count:
+        picks = tuple(sorted((r, rng.choice(("0/1", "1/1"))) for r, _ in rng.sample(rsids, rng.randint(0, 4))))
+        if picks in seen and len(seen) < 2 ** len(rsids):
+            continue
+        seen.add(picks)
+        lines = ["##fileformat=VCFv4.2",
+                 "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tPATIENT"]
+        for i, (rsid, gt) in enumerate(picks):
+            gene = STAR_ALLELE_VARIANTS[rsid][0]
+            chrom, start, _ = GENE_CHROMOSOMES[gene]
+            lines.append(f"chr{chrom}\t{start + 100 + i}\t{rsid}\tC\tT\t60\tPASS\tGENE={gene}\tGT\t{gt}")
+        vcfs.append(("\n".join(lines) + "\n").encode())
+    return vcfs
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    weights = []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("analyze", "panel"):
+            raise ValueError(f"Unknown request kind {name!r} (use analyze, panel)")
+        weights.append((name.strip(), float(weight or 1)))
+    return weights
+
+
+async def _one_request(client: httpx.AsyncClient, kind: str, vcf: bytes, drug: str,
+                       explain: str) -> Tuple[str, float, int]:
+    files = {"file": ("patient.vcf", vcf, "text/plain")}
+    start = time.perf_counter()
+    try:
+        if kind == "panel":
+            res = await client.post("/analyze/panel", files=files, data={"drugs": "all", "explain": explain})
+        else:
+            res = await client.post("/analyze", files=files, data={"drug": drug, "explain": explain})
+        status = res.status_code
+    except httpx.HTTPError:
+        status = 0
+    return kind, time.perf_counter() - start, status
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, total: int, vcfs: List[bytes],
+                    mix: List[Tuple[str, float]], explain: str, seed: int) -> Dict[str, Any]:
+    """``total`` requests with at most ``concurrency`` in flight."""
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix)
+    drugs = list(DRUG_GENE_MAP)
+    plan = [(rng.choices(kinds, weights)[0], rng.choice(vcfs), rng.choice(drugs)) for _ in range(total)]
+    queue: "asyncio.Queue" = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+    samples: List[Tuple[str, float, int]] = []
+
+    async def worker():
+        while True:
+            try:
+                kind, vcf, drug = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            samples.append(await _one_request(client, kind, vcf, drug, explain))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    report: Dict[str, Any] = {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(samples) / elapsed if elapsed else None,
+    }
+    for kind in ("all",) + tuple(kinds):
+        rows = [s for s in samples if kind == "all" or s[0] == kind]
+        latencies = sorted(s[1] for s in rows if s[2] == 200)
+        statuses: Dict[str, int] = {}
+        for s in rows:
+            statuses[str(s[2])] = statuses.get(str(s[2]), 0) + 1
+        report[kind] = {
+            "count": len(rows),
+            "errors": sum(1 for s in rows if s[2] != 200),
+            "status": statuses,
+            **{f"p{p}_ms": (v * 1e3 if v is not None else None)
+               for p, v in ((50, percentile(latencies, 50)), (95, percentile(latencies, 95)),
+                            (99, percentile(latencies, 99)))},
+        }
+    return report
+
+
+def _print_level(r: Dict[str, Any]) -> None:
+    a = r["all"]
+
+    def ms(v):
+        return f"{v:8.1f}" if v is not None else "       -"
+    print(f"{r['concurrency']:>6} {r['requests']:>8} {r['throughput_rps']:>9.1f} "
+          f"{ms(a['p50_ms'])} {ms(a['p95_ms'])} {ms(a['p99_ms'])} {a['errors']:>7}")
+
+
+def _make_client(args) -> httpx.AsyncClient:
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=max(args.levels), max_keepalive_connections=max(args.levels))
+    if args.inprocess:
+        os.environ.setdefault("PHARMAGUARD_LLM_BACKEND", "fake")
+        os.environ.setdefault("PHARMAGUARD_EXPLANATION_DB", "")
+        import main
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app),
+                                 base_url="http://pharmaguard", timeout=timeout)
+    return httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits)
+
+
+async def run(args) -> Dict[str, Any]:
+    vcfs = patient_vcfs(args.patients, args.seed)
+    mix = parse_mix(args.mix)
+    levels = []
+    async with _make_client(args) as client:
+        if args.warmup:
+            await run_level(client, 1, args.warmup, vcfs, mix, args.explain, args.seed + 1)
+        print(f"{'conc':>6} {'reqs':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for i, concurrency in enumerate(args.levels):
+            report = await run_level(client, concurrency, args.requests, vcfs, mix, args.explain, args.seed + 2 + i)
+            _print_level(report)
+            levels.append(report)
+    return {
+        "target": "inprocess" if args.inprocess else args.url,
+        "mix": args.mix,
+        "patients": args.patients,
+        "explain": args.explain,
+        "llm_backend": os.getenv("PHARMAGUARD_LLM_BACKEND", "gemini"),
+        "fake_latency": os.getenv("PHARMAGUARD_FAKE_LLM_LATENCY"),
+        "levels": levels,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="PharmaGuard load generator")
+    target = ap.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://localhost:8001", help="base URL of a running server")
+    target.add_argument("--inprocess", action="store_true", help="drive the app in-process (ASGI)")
+    ap.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    ap.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    ap.add_argument("--patients", type=int, default=50, help="distinct genotypes uploaded")
+    ap.add_argument("--mix", default="analyze=1", help="request mix, e.g. analyze=0.8,panel=0.2")
+    ap.add_argument("--explain", choices=("inline", "deferred"), default="inline")
+    ap.add_argument("--warmup", type=int, default=10, help="sequential warm-up requests")
+    ap.add_argument("--timeout", type=float, default=120.0, help="client timeout (s)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", help="write the report as JSON here")
+    args = ap.parse_args(argv)
+    args.levels = [int(c) for c in args.concurrency.split(",")]
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"wrote {args.output}")
+    return 1 if any(level["all"]["errors"] for level in report["levels"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
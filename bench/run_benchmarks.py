@@ -0,0 +1,318 @@
+"""
+Benchmark suite for the parse → score → explain pipeline.
+
+Times, per synthetic VCF size:
+  parser   VCFParser.validate, parse (all lines / pharmacogene targets),
+           from_path (mmap, targets)
+  engine   RiskEngine.filter_variants_for_gene, group_variants_by_gene,
+           predict_risk for every drug (each gene called per drug), and
+           call_genes once + predict_risk from the shared gene calls
+  explain  LLMService._generate_template
+  response AnalysisResult JSON per panel: pydantic models + response_model
+           re-validation (the former path) vs pre-encoded fragments on a
+           cache miss and a cache hit
+  route    POST /analyze in-process through TestClient (template explanations)
+  cohort   parse_genotype_matrix + predict_risk_matrix for multi-sample files
+
+and writes the timings to JSON so releases can be compared:
+
+    python bench/run_benchmarks.py                          # 1KB, 5MB; 1 and 100 samples
+    python bench/run_benchmarks.py --sizes 1KB,5MB,100MB,1GB --samples 1,1000
+    python bench/run_benchmarks.py --output new.json --compare old.json
+
+Generated VCFs are cached under bench/.data. Whole-file stages (untargeted
+parse, the /analyze upload) are skipped above --full-limit, since they hold
+the entire file in memory.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "backend"))
+sys.path.insert(0, BENCH_DIR)
+
+# Route benchmarks must not hit Gemini, a store on disk or the upload cap
+os.environ.pop("GEMINI_API_KEY", None)
+os.environ.pop("GOOGLE_API_KEY", None)
+os.environ.setdefault("PHARMAGUARD_EXPLANATION_DB", "")
+os.environ.setdefault("PHARMAGUARD_MAX_UPLOAD_MB", "1024")
+
+from knowledge_base import DRUG_GENES  # noqa: E402
+from llm_service import LLMService  # noqa: E402
+from responses import (  # noqa: E402
+    DEFAULT_MONITORING_ADVICE, MONITORING_ADVICE, confidence_level, encode_analysis, render_analysis, render_panel,
+)
+from schemas import (  # noqa: E402
+    AnalysisResult, ClinicalRecommendation, LLMExplanation, PanelResult, PharmacogenomicProfile,
+    QualityMetrics, RiskAssessment, Variant,
+)
+from risk_engine import RiskEngine  # noqa: E402
+from vcf_parser import TargetFilter, VCFParser  # noqa: E402
+from vcf_gen import cached_vcf, parse_size  # noqa: E402
+
+
+def timed(fn: Callable[[], Any], repeat: int, min_batch_s: float = 0.02) -> Dict[str, Any]:
+    """
+    Per-call min/median/mean wall time in seconds over ``repeat`` rounds.
+    Fast calls are looped ``number`` times per round (as timeit's autorange
+    does) so microsecond stages are not lost in timer noise.
+    """
+    start = time.perf_counter()
+    fn()
+    first = time.perf_counter() - start
+    number = 1 if first >= min_batch_s else max(int(min_batch_s / max(first, 1e-7)), 1)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "repeat": repeat,
+        "number": number,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+    }
+
+
+class Suite:
+    def __init__(self, repeat: int, full_limit: int):
+        self.repeat = repeat
+        self.full_limit = full_limit
+        self.results: List[Dict[str, Any]] = []
+        self.engine = RiskEngine()
+        self.llm = LLMService()
+        self.targets = TargetFilter.pharmacogenes()
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from fastapi.testclient import TestClient
+            import main
+            self._main = main
+            self._client = TestClient(main.app)
+        return self._client
+
+    def record(self, name: str, size: str, samples: int, nbytes: int, fn: Callable[[], Any],
+               repeat: Optional[int] = None, **extra: Any) -> None:
+        stats = timed(fn, repeat or self.repeat)
+        row = {"name": name, "size": size, "samples": samples, "bytes": nbytes, **stats, **extra}
+        if nbytes:
+            row["mb_per_s"] = nbytes / (1 << 20) / stats["min_s"] if stats["min_s"] else None
+        self.results.append(row)
+        print(f"  {name:<34} {stats['min_s'] * 1e3:10.2f} ms"
+              + (f"  {row['mb_per_s']:8.1f} MB/s" if row.get("mb_per_s") else ""))
+
+    def run_size(self, size: str, samples: int) -> None:
+        path = cached_vcf(size, samples)
+        nbytes = os.path.getsize(path)
+        print(f"{size} × {samples} sample(s) ({nbytes} bytes)")
+        # Large inputs run once; a 1 KB file needs many rounds to be measurable
+        repeat = 1 if nbytes > 64 << 20 else self.repeat
+
+        def scan():
+            with VCFParser.from_path(path, targets=self.targets) as parser:
+                return parser.parse()
+        self.record("parser.from_path_targets", size, samples, nbytes, scan, repeat)
+        targeted = scan()
+
+        if samples > 1:
+            self.run_cohort(path, size, samples, nbytes, repeat)
+            return
+
+        whole = nbytes <= self.full_limit
+        if whole:
+            with open(path, "rb") as fh:
+                content = fh.read()
+            # validate() reads only the ## block, so no throughput figure
+            self.record("parser.validate", size, samples, 0, lambda: VCFParser(content).validate(), repeat)
+            self.record("parser.parse", size, samples, nbytes, lambda: VCFParser(content).parse(), repeat)
+            self.record("parser.parse_targets", size, samples, nbytes,
+                        lambda: VCFParser(content, targets=self.targets).parse(), repeat)
+            variants = VCFParser(content).parse()
+        else:
+            content, variants = None, targeted
+
+        engine = self.engine
+        n = len(variants)
+        self.record("engine.filter_variants_for_gene", size, samples, 0,
+                    lambda: [engine.filter_variants_for_gene(g, variants) for g in engine.genes_for_drugs(DRUG_GENES)],
+                    repeat, variants=n)
+        self.record("engine.group_variants_by_gene", size, samples, 0,
+                    lambda: engine.group_variants_by_gene(variants), repeat, variants=n)
+        by_gene = engine.group_variants_by_gene(targeted)
+        self.record("engine.predict_risk", size, samples, 0,
+                    lambda: [engine.predict_risk(d, [], gene_variants=by_gene) for d in DRUG_GENES],
+                    self.repeat)
+
+        def panel():
+            calls = engine.call_genes(by_gene, engine.genes_for_drugs(DRUG_GENES))
+            return [engine.predict_risk(d, [], gene_calls=calls) for d in DRUG_GENES]
+        self.record("engine.predict_panel_shared_calls", size, samples, 0, panel, self.repeat)
+
+        predictions = {d: engine.predict_risk(d, [], gene_variants=by_gene) for d in DRUG_GENES}
+
+        def explain_all():
+            for drug, p in predictions.items():
+                self.llm._generate_template(
+                    drug, p["gene"], p["phenotype"], p["risk"], p["gene_variants"], p["recommendation"],
+                    p["mechanism"], f"{p['allele1']}/{p['allele2']}", p["activity_score"],
+                )
+        self.record("llm._generate_template", size, samples, 0, explain_all, self.repeat)
+
+        items = []
+        for drug, p in predictions.items():
+            explanation = self.llm._generate_template(
+                drug, p["gene"], p["phenotype"], p["risk"], p["gene_variants"], p["recommendation"],
+                p["mechanism"], f"{p['allele1']}/{p['allele2']}", p["activity_score"],
+            )
+            items.append((drug, p["gene"], p, explanation))
+        self.run_responses(size, samples, items)
+
+        if whole:
+            client = self.client  # import main outside the timed region
+
+            def analyze():
+                self._main.analysis_cache.clear()
+                res = client.post(
+                    "/analyze",
+                    files={"file": ("bench.vcf", content, "text/plain")},
+                    data={"drug": "CODEINE", "patient_id": "BENCH"},
+                )
+                assert res.status_code == 200, res.text
+            self.record("route./analyze", size, samples, nbytes, analyze, repeat)
+
+    def run_responses(self, size: str, samples: int, items) -> None:
+        timestamp = "2026-01-01T00:00:00+00:00"
+        n = sum(len(p["gene_variants"]) for _, _, p, _ in items)
+        self.record("response.pydantic_revalidate", size, samples, 0,
+                    lambda: pydantic_panel("BENCH", timestamp, items), self.repeat, variants=n)
+
+        def encoded_miss():
+            return render_panel("BENCH", [
+                render_analysis("BENCH", timestamp, encode_analysis(d, g, p, e), True) for d, g, p, e in items
+            ])
+        self.record("response.encoded_miss", size, samples, 0, encoded_miss, self.repeat, variants=n)
+
+        encoded = [encode_analysis(d, g, p, e) for d, g, p, e in items]
+        self.record("response.encoded_hit", size, samples, 0,
+                    lambda: render_panel("BENCH", [render_analysis("BENCH", timestamp, enc, True) for enc in encoded]),
+                    self.repeat, variants=n)
+
+    def run_cohort(self, path: str, size: str, samples: int, nbytes: int, repeat: int) -> None:
+        def parse_matrix():
+            with VCFParser.from_path(path, targets=self.targets) as parser:
+                return parser.parse_genotype_matrix()
+        self.record("cohort.parse_genotype_matrix", size, samples, nbytes, parse_matrix, repeat)
+        matrix = parse_matrix()
+        drugs = list(DRUG_GENES)
+        self.record("cohort.predict_risk_matrix", size, samples, 0,
+                    lambda: self.engine.predict_risk_matrix(drugs, matrix), self.repeat,
+                    variants=len(matrix.variants))
+
+
+def pydantic_panel(patient_id: str, timestamp: str, items) -> bytes:
+    """
+    The pre-fast-path response: nested models built (validation 1), then
+    FastAPI's response_model handling validates again and JSON-encodes.
+    """
+    results = []
+    for drug, gene, p, explanation in items:
+        severity = p.get("severity", "none")
+        results.append(AnalysisResult(
+            patient_id=patient_id, drug=drug, timestamp=timestamp,
+            risk_assessment=RiskAssessment(risk_label=p["risk"], confidence_score=p["confidence"], severity=severity),
+            pharmacogenomic_profile=PharmacogenomicProfile(
+                primary_gene=gene, diplotype=f"{p['allele1']}/{p['allele2']}", phenotype=p["phenotype"],
+                detected_variants=[Variant(rsid=v.rsid, chromosome=v.chromosome, position=str(v.position),
+                                           reference=v.reference, alternate=v.alternate)
+                                   for v in p["gene_variants"]],
+            ),
+            clinical_recommendation=ClinicalRecommendation(
+                cpic_guideline_reference=f"CPIC Guideline for {drug.title()} and {gene} (Tier A)",
+                dose_adjustment=p["recommendation"],
+                monitoring_advice=MONITORING_ADVICE.get(severity, DEFAULT_MONITORING_ADVICE),
+            ),
+            llm_generated_explanation=LLMExplanation(**explanation),
+            quality_metrics=QualityMetrics(vcf_parsing_success=True,
+                                           missing_annotations=not p["gene_variants"],
+                                           confidence_level=confidence_level(p["confidence"])),
+        ))
+    panel = PanelResult(patient_id=patient_id, results=results)
+    revalidated = PanelResult.model_validate(panel.model_dump())
+    return json.dumps(revalidated.model_dump(mode="json"), ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def metadata() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> int:
+    """Print min-time ratios against a previous run; count regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as fh:
+        baseline = {(r["name"], r["size"], r["samples"]): r for r in json.load(fh)["results"]}
+    regressions = 0
+    print(f"\nvs {baseline_path} (regression if > {tolerance:.0%} slower)")
+    for r in results:
+        old = baseline.get((r["name"], r["size"], r["samples"]))
+        if not old or not old["min_s"]:
+            continue
+        ratio = r["min_s"] / old["min_s"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"  {r['name']:<34} {r['size']:>6} {r['samples']:>5}s  {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="PharmaGuard pipeline benchmarks")
+    ap.add_argument("--sizes", default="1KB,5MB", help="comma-separated VCF sizes (1KB, 5MB, 100MB, 1GB)")
+    ap.add_argument("--samples", default="1,100", help="comma-separated sample counts")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--full-limit", default="128MB",
+                    help="largest file for whole-file stages (untargeted parse, /analyze)")
+    ap.add_argument("--output", default=os.path.join(BENCH_DIR, "results.json"))
+    ap.add_argument("--compare", help="previous results JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args(argv)
+
+    suite = Suite(args.repeat, parse_size(args.full_limit))
+    for size in args.sizes.split(","):
+        for samples in (int(s) for s in args.samples.split(",")):
+            suite.run_size(size.strip(), samples)
+
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump({"meta": metadata(), "results": suite.results}, fh, indent=2)
+    print(f"\nwrote {len(suite.results)} results to {args.output}")
+
+    if args.compare:
+        return 1 if compare(suite.results, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
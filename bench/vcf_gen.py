@@ -0,0 +1,123 @@
+"""
+Synthetic VCF generators for the benchmark suite.
+
+Files look like a chromosome-sorted whole-genome VCF: mostly off-target
+SNVs, with one record for every known star-allele rsID placed inside its
+gene window, so every pharmacogene gets a call. Multi-sample files carry
+a random GT per sample.
+
+    python bench/vcf_gen.py 100MB out.vcf --samples 50
+"""
+import argparse
+import os
+import random
+import sys
+from typing import Iterator, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from knowledge_base import GENE_CHROMOSOMES, STAR_ALLELE_VARIANTS  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+
+_UNITS = {"B": 1, "KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+_GTS = ("0/0", "0/0", "0/0", "0/1", "0|1", "1/1")
+
+
+def parse_size(size: str) -> int:
+    """'1KB' → 1024, '5MB' → 5242880, '1GB' → 1073741824."""
+    size = size.strip().upper()
+    for unit in ("GB", "MB", "KB", "B"):
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * _UNITS[unit])
+    return int(size)
+
+
+def _pharmacogene_records() -> List[Tuple[str, int, str]]:
+    """(chrom, pos, rsid) for every star-allele rsID, inside its gene window."""
+    records = []
+    for i, (rsid, (gene, _, _)) in enumerate(STAR_ALLELE_VARIANTS.items()):
+        if gene not in GENE_CHROMOSOMES:
+            continue
+        chrom, start, end = GENE_CHROMOSOMES[gene]
+        records.append((chrom, start + (i * 7919) % max(end - start, 1), rsid))
+    return records
+
+
+def iter_vcf_lines(target_bytes: int, samples: int = 1, seed: int = 0) -> Iterator[bytes]:
+    """Lines (with newlines) of a VCF of roughly ``target_bytes``."""
+    rng = random.Random(seed)
+    names = [f"S{i:05d}" for i in range(samples)]
+    header = [
+        b"##fileformat=VCFv4.2\n",
+        b"##source=pharmaguard-bench\n",
+        *(f"##contig=<ID=chr{c}>\n".encode() for c in range(1, 23) if target_bytes >= 1 << 20),
+        b'##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">\n',
+        b'##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n',
+        ("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" + "\t".join(names) + "\n").encode(),
+    ]
+    # A pool of pre-joined sample columns keeps generation I/O bound
+    pool = ["\t".join(rng.choice(_GTS) for _ in range(samples)) for _ in range(64)]
+    written = sum(len(h) for h in header)
+    yield from header
+
+    pgx = sorted(_pharmacogene_records(), key=lambda r: (int(r[0]), r[1]))
+    body = max(target_bytes - written, 0)
+    line_len = 52 + 4 * samples
+    serial = 0
+    for chrom in range(1, 23):
+        limit = target_bytes - body + body * chrom // 22
+        targets = [r for r in pgx if r[0] == str(chrom)]
+        step = max(250_000_000 * line_len * 22 // max(body, 1), 1)
+        pos = 0
+        while written < limit or (targets and written < target_bytes):
+            pos += rng.randint(1, 2 * step)
+            if targets and (targets[0][1] <= pos or written >= limit):
+                _, tpos, rsid = targets.pop(0)
+                line = f"chr{chrom}\t{tpos}\t{rsid}\tC\tT\t60\tPASS\tDP=35\tGT\t{rng.choice(pool)}\n"
+            else:
+                serial += 1
+                line = (f"chr{chrom}\t{pos}\trs{900_000_000 + serial}\tA\tG\t50\tPASS"
+                        f"\tDP={rng.randint(10, 60)}\tGT\t{rng.choice(pool)}\n")
+            data = line.encode()
+            written += len(data)
+            yield data
+
+
+def synthetic_vcf(target_bytes: int, samples: int = 1, seed: int = 0) -> bytes:
+    """In-memory VCF; use write_vcf for anything large."""
+    return b"".join(iter_vcf_lines(target_bytes, samples, seed))
+
+
+def write_vcf(path: str, target_bytes: int, samples: int = 1, seed: int = 0) -> str:
+    with open(path, "wb") as fh:
+        batch = []
+        for line in iter_vcf_lines(target_bytes, samples, seed):
+            batch.append(line)
+            if len(batch) >= 10_000:
+                fh.write(b"".join(batch))
+                batch.clear()
+        fh.write(b"".join(batch))
+    return path
+
+
+def cached_vcf(size: str, samples: int = 1, seed: int = 0) -> str:
+    """Path of a generated VCF under bench/.data, created on first use."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"synthetic_{size.upper()}_{samples}s_{seed}.vcf")
+    if not os.path.exists(path):
+        tmp = path + ".tmp"
+        write_vcf(tmp, parse_size(size), samples, seed)
+        os.replace(tmp, path)
+    return path
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Generate a synthetic VCF")
+    ap.add_argument("size", help="target size, e.g. 1KB, 5MB, 1GB")
+    ap.add_argument("output")
+    ap.add_argument("--samples", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    write_vcf(args.output, parse_size(args.size), args.samples, args.seed)
+    print(f"wrote {os.path.getsize(args.output)} bytes to {args.output}")
@@ -65,38 +65,39 @@ export default function PanelPage() {
         const allResults: DrugResult[] = []
         const pid = patientId.trim() || 'PANEL_' + Math.random().toString(36).substr(2, 6).toUpperCase()
 
-        for (let i = 0; i < DRUGS.length; i++) {
-            const drug = DRUGS[i]
-            setCurrentDrug(drug)
-            setProgress(Math.round((i / DRUGS.length) * 100))
+        setCurrentDrug(DRUGS[0])
+        setProgress(10)
 
-            const fd = new FormData()
-            fd.append('file', file)
-            fd.append('drug', drug)
-            fd.append('patient_id', pid)
+        const fd = new FormData()
+        fd.append('file', file)
+        fd.append('drugs', DRUGS.join(','))
+        fd.append('patient_id', pid)
 
-            try {
-                const res = await fetch(`${API_URL}/analyze`, { method: 'POST', body: fd })
-                if (res.ok) {
-                    const data = await res.json()
+        try {
+            // One upload, one parse — the backend scores every drug in the panel
+            const res = await fetch(`${API_URL}/analyze/panel`, { method: 'POST', body: fd })
+            if (res.ok) {
+                const data = await res.json()
+                for (const r of data.results) {
                     allResults.push({
-                        drug,
-                        risk_label: data.risk_assessment.risk_label,
-                        phenotype: data.pharmacogenomic_profile.phenotype,
-                        diplotype: data.pharmacogenomic_profile.diplotype,
-                        confidence_score: data.risk_assessment.confidence_score,
-                        dose_adjustment: data.clinical_recommendation.dose_adjustment,
-                        severity: data.risk_assessment.severity,
+                        drug: r.drug,
+                        risk_label: r.risk_assessment.risk_label,
+                        phenotype: r.pharmacogenomic_profile.phenotype,
+                        diplotype: r.pharmacogenomic_profile.diplotype,
+                        confidence_score: r.risk_assessment.confidence_score,
+                        dose_adjustment: r.clinical_recommendation.dose_adjustment,
+                        severity: r.risk_assessment.severity,
                     })
-                } else {
+                }
+            } else {
+                for (const drug of DRUGS) {
                     allResults.push({ drug, risk_label: 'Unknown', phenotype: '?', diplotype: '?/?', confidence_score: 0, dose_adjustment: 'Analysis failed', severity: 'none' })
                 }
-            } catch {
+            }
+        } catch {
+            for (const drug of DRUGS) {
                 allResults.push({ drug, risk_label: 'Unknown', phenotype: '?', diplotype: '?/?', confidence_score: 0, dose_adjustment: 'Backend unreachable', severity: 'none' })
             }
-
-            // Small delay between requests
-            await new Promise(r => setTimeout(r, 300))
         }
 
         setProgress(100)
@@ -20,6 +20,11 @@ export interface AnalysisResult {
             reference: string;
             alternate: string;
         }>;
+        secondary_genes?: Array<{
+            gene: string;
+            diplotype: string;
+            phenotype: string;
+        }>;
     };
     clinical_recommendation: {
         cpic_guideline_reference: string;
@@ -37,6 +42,8 @@ export interface AnalysisResult {
         missing_annotations: boolean;
         confidence_level: string;
     };
+    knowledge_base_version?: string | null;
+    explanation_job_id?: string | null;
 }
 
 export async function analyzeVCF(file: File, drug: string, patientId?: string): Promise<AnalysisResult> {
@@ -57,3 +64,49 @@ export async function analyzeVCF(file: File, drug: string, patientId?: string):
 
     return response.json();
 }
+
+export interface ProfileSummary {
+    profile_id: string;
+    patient_id: string;
+    created_at: string;
+    expires_at?: string | null;
+    vcf_parsing_success: boolean;
+    knowledge_base_version: string;
+    genes: Array<{
+        gene: string;
+        diplotype: string;
+        phenotype: string;
+        activity_score?: number | null;
+        detected_variants: number;
+    }>;
+}
+
+export async function createProfile(file: File, patientId?: string): Promise<ProfileSummary> {
+    const formData = new FormData();
+    formData.append("file", file);
+    formData.append("patient_id", patientId || "PATIENT_" + Math.random().toString(36).substr(2, 9).toUpperCase());
+
+    const response = await fetch(`${API_URL}/profiles`, {
+        method: "POST",
+        body: formData,
+    });
+
+    if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.detail || "Profile upload failed");
+    }
+
+    return response.json();
+}
+
+export async function analyzeProfile(profileId: string, drug: string): Promise<AnalysisResult> {
+    const params = new URLSearchParams({ drug });
+    const response = await fetch(`${API_URL}/profiles/${encodeURIComponent(profileId)}/analyze?${params}`);
+
+    if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.detail || "Analysis failed");
+    }
+
+    return response.json();
+}